@@ -467,39 +467,73 @@ class BaseCamera(ABC):
         is_batched = im.ndim == 4
         if not is_batched:
             im = im[None]
+        _, _, h, w = im.shape
+        map_xy, valid = self.undistortion_map(params, (h, w), None, scale, target_proj)
+        if valid is not None and not valid.all():
+            print(f"Warning: {~valid.sum()} invalid projections.")
+        # undistort
+        im_undist = outside_value + torch.nn.functional.grid_sample(
+            im - outside_value,
+            map_xy,
+            mode=interp_mode,
+            padding_mode="zeros",
+            align_corners=False,
+        )
+        if not is_batched:
+            im_undist = im_undist[0]
+        return im_undist
+
+    def undistortion_map(
+        self,
+        params: Tensor,
+        in_size: tuple[int, int],
+        out_size: tuple[int, int] | None = None,
+        scale: float = 1.0,
+        target_proj: str = "perspective",
+    ) -> tuple[Tensor, Tensor | None]:
+        """Sampling grid mapping undistorted pixels to the distorted input image.
+
+        The principal point of the undistorted image keeps the same offset w.r.t. the
+        image center as in the input image.
+
+        Args:
+            params: (B, D) intrinsic parameters.
+            in_size: (H, W) size of the distorted images.
+            out_size: (H', W') size of the undistorted images. Default: `in_size`.
+            scale: scaling factor for the focal length(s).
+            target_proj: target projection model for the undistortion. See options in
+                the method `ideal_unprojection`.
+
+        Returns:
+            (B, H', W', 2) sampling coordinates, normalized to [-1, 1] as expected by
+                `grid_sample` with align_corners=False.
+            (B, H'*W') boolean tensor indicating valid projections or None if all
+                projections are valid.
+        """
         assert scale > 0, f"scale must be positive, got {scale=}"
-        b, _, h, w = im.shape
+        h, w = in_size
+        h_out, w_out = in_size if out_size is None else out_size
         num_f = self.NUM_F
         f, c = params[..., None, :num_f], params[..., None, num_f : num_f + 2]
+        c_out = c + 0.5 * c.new_tensor((w_out - w, h_out - h))
         # normalized image coordinates
-        im_n = (self.pixel_grid_coords(h, w, params, 0.0).reshape(-1, 2) - c) / f
-        r = torch.linalg.norm(im_n, dim=-1) / scale  # (B, H*W)
+        im_coords = self.pixel_grid_coords(h_out, w_out, params, 0.0).reshape(-1, 2)
+        im_n = (im_coords - c_out) / f
+        r = torch.linalg.norm(im_n, dim=-1) / scale  # (B, H'*W')
         # get forward distortion map
         theta = self.ideal_unprojection(r, target_proj)
         phi = torch.atan2(im_n[..., 1], im_n[..., 0])
         R = torch.sin(theta)
         rays = torch.stack(
             (R * torch.cos(phi), R * torch.sin(phi), torch.cos(theta)), dim=-1
-        )  # (B, H*W, 3)
+        )  # (B, H'*W', 3)
         if num_f == 2:
             params = params.clone()
-            params[..., :2] = f.amax(dim=-1, keepdim=True)
+            params[..., :2] = f.amax(dim=-1)
         map_xy, valid = self.project(params, rays)
-        if valid is not None and not valid.all():
-            print(f"Warning: {~valid.sum()} invalid projections.")
         # normalize coords to [-1, 1]
-        map_xy = 2 * map_xy.reshape(b, h, w, 2) / map_xy.new_tensor((w, h)) - 1
-        # undistort
-        im_undist = outside_value + torch.nn.functional.grid_sample(
-            im - outside_value,
-            map_xy,
-            mode=interp_mode,
-            padding_mode="zeros",
-            align_corners=False,
-        )
-        if not is_batched:
-            im_undist = im_undist[0]
-        return im_undist
+        map_xy = 2 * map_xy.reshape(-1, h_out, w_out, 2) / map_xy.new_tensor((w, h)) - 1
+        return map_xy, valid
 
     @staticmethod
     def ideal_unprojection(r: Tensor, target_proj: str) -> Tensor:
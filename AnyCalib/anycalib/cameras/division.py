@@ -4,6 +4,10 @@ from torch import Tensor
 
 from anycalib import utils as ut
 from anycalib.cameras.base import BaseCamera
+from anycalib.cameras.radial_lut import radial_lut_inverse, use_lut
+
+# default root solver per number of distortion coefficients
+DEFAULT_ROOT_SOLVERS = {1: "quadratic", 2: "quartic"}
 
 
 def radii_via_companion(
@@ -11,7 +15,8 @@ def radii_via_companion(
 ) -> tuple[Tensor, Tensor]:
     """Get radii in retinal plane using the companion matrix of the polynomial.
 
-    TODO: Implement backward pass via implicit function theorem.
+    Gradients are not propagated through the eigenvalues but with the implicit
+    function theorem, see `division_radii`.
 
     Args:
         R: (..., N) radii of the 3D points: sqrt(X^2 + Y^2).
@@ -44,6 +49,226 @@ def radii_via_companion(
     return sol, valid
 
 
+def radii_via_quadratic(R: Tensor, Z: Tensor, k: Tensor) -> tuple[Tensor, Tensor]:
+    """Get radii in retinal plane in closed form for a single distortion coefficient.
+
+    Args:
+        R: (..., N) radii of the 3D points: sqrt(X^2 + Y^2).
+        Z: (..., N) z-coordinates of the 3D points.
+        k: (..., 1) distortion coefficient.
+
+    Returns:
+        (..., N) radii in the retinal plane.
+        (..., N) boolean tensor indicating valid radii.
+    """
+    eps = torch.finfo(R.dtype).eps
+    disc = Z**2 - 4 * k * R**2
+    den = Z + torch.sqrt(disc.clamp(0))  # use + to get smallest root
+    valid = (disc > -eps) & (den > eps)
+    return 2 * R / den.clamp(eps), valid
+
+
+def _cubic_largest_root(b: Tensor, c: Tensor, d: Tensor) -> Tensor:
+    """Largest real root of the monic cubic y^3 + b*y^2 + c*y + d = 0 (Cardano)."""
+    # depressed cubic t^3 + p*t + q = 0, with y = t - b/3
+    b3 = b / 3
+    p = c - b * b3
+    q = (2 * b3 * b3 - c) * b3 + d
+    disc = (q / 2) ** 2 + (p / 3) ** 3
+    # one real root
+    sqrt_disc = torch.sqrt(disc.clamp(0))
+    u, v = -q / 2 + sqrt_disc, -q / 2 - sqrt_disc
+    t1 = u.sign() * u.abs().pow(1 / 3) + v.sign() * v.abs().pow(1 / 3)
+    # three real roots (p < 0): trigonometric solution, largest one
+    m = torch.sqrt((-p / 3).clamp(0))
+    cos_arg = (-q / 2) / torch.where(m == 0, 1, m**3)
+    t3 = 2 * m * torch.cos(torch.acos(cos_arg.clamp(-1, 1)) / 3)
+    y = torch.where(disc > 0, t1, t3) - b3
+    # polish (Newton)
+    f = ((y + b) * y + c) * y + d
+    df = (3 * y + 2 * b) * y + c
+    return torch.where(df.abs() > 0, y - f / torch.where(df == 0, 1, df), y)
+
+
+def radii_via_quartic(
+    R: Tensor, Z: Tensor, k: Tensor, cplex_tol: float = 1e-4, polish_iters: int = 2
+) -> tuple[Tensor, Tensor]:
+    """Get radii in retinal plane in closed form for two distortion coefficients.
+
+    The quartic
+        k2*r^4 + k1*r^2 - (Z/R)*r + 1 = 0
+    has no cubic term, so Ferrari's method factors it into two real quadratics once
+    the largest root of its resolvent cubic is known. To limit the dynamic range of
+    the coefficients, it is solved for u = r/s with s = |k2|^(-1/4). Only real
+    elementwise operations are involved, and the selected root is polished with Newton
+    iterations on the original polynomial.
+
+    Args:
+        R: (..., N) radii of the 3D points: sqrt(X^2 + Y^2).
+        Z: (..., N) z-coordinates of the 3D points.
+        k: (..., 2) distortion coefficients.
+        cplex_tol: relative tolerance of the imaginary part of the roots for being
+            considered real.
+        polish_iters: number of Newton iterations for polishing the selected root.
+
+    Returns:
+        (..., N) radii in the retinal plane.
+        (..., N) boolean tensor indicating valid radii.
+    """
+    eps = torch.finfo(R.dtype).eps
+    close_to_ppoint = R < eps
+    iR = torch.where(close_to_ppoint, 0.1, R).reciprocal()
+    k1, k2 = k[..., :1], k[..., 1:2]
+    k2 = torch.where(k2.abs() < eps, torch.where(k2 < 0, -eps, eps), k2)
+    sign = k2.sign()
+    s = k2.abs().pow(-0.25)  # (..., 1)
+    # monic quartic in u: u^4 + a*u^2 + b*u + e = 0, with e = ±1
+    a = sign * k1 * s * s
+    b = -sign * Z * iR * s  # (..., N)
+    e = sign
+    # (u^2 + y)^2 = (2y - a)*u^2 - b*u + y^2 - e is a perfect square for the largest
+    # root y of the resolvent cubic, which satisfies 2y - a > 0 for b != 0
+    y = _cubic_largest_root(-a / 2, -e, a * e / 2 - b * b / 8)
+    w = torch.sqrt((2 * y - a).clamp(eps))
+    # factorization: (u^2 - w*u + y + b/2w) * (u^2 + w*u + y - b/2w)
+    roots, is_real = [], []
+    for p, q in ((-w, y + b / (2 * w)), (w, y - b / (2 * w))):
+        disc = p * p - 4 * q
+        sqrt_disc = torch.sqrt(disc.abs())
+        real = disc >= 0
+        # numerically stable roots of u^2 + p*u + q = 0
+        u1 = -0.5 * (p + torch.where(p < 0, -1, 1) * torch.where(real, sqrt_disc, 0))
+        u2 = q / torch.where(u1 == 0, eps, u1)
+        # complex pairs are accepted if their imaginary part is small enough
+        is_real_ = real | (0.5 * sqrt_disc < cplex_tol * 0.5 * p.abs())
+        roots += [u1, u2]
+        is_real += [is_real_, is_real_]
+    roots = torch.stack(roots, dim=-1) * s[..., None]  # (..., N, 4)
+    valid = torch.stack(is_real, dim=-1) & (roots >= 0)
+
+    # smallest positive real root (if exists)
+    sol = torch.where(valid, roots, torch.inf).amin(dim=-1)
+    valid = sol < torch.inf
+    sol = torch.where(valid, sol, 0.1)  # set bogus value
+    for _ in range(polish_iters):
+        f, df = _radii_residual(sol, R, Z, k)
+        sol = torch.where(valid & (df != 0), sol - f / torch.where(df == 0, 1, df), sol)
+    sol = torch.where(close_to_ppoint, 0, sol)
+    return sol, valid | close_to_ppoint
+
+
+def _radii_residual(
+    r: Tensor, R: Tensor, Z: Tensor, k: Tensor
+) -> tuple[Tensor, Tensor]:
+    """Residual F = R*(1 + k1*r^2 + ...) - Z*r whose roots are the retinal radii, and
+    its derivative dF/dr."""
+    r2 = ri = r * r
+    poly = 1 + k[..., :1] * r2
+    dpoly_r = 2 * k[..., :1] * r2  # r * dpoly/dr
+    for i in range(1, k.shape[-1]):
+        ri = ri * r2
+        poly = poly + k[..., i, None] * ri
+        dpoly_r = dpoly_r + (2 * i + 2) * k[..., i, None] * ri
+    return R * poly - Z * r, R * dpoly_r / torch.where(r == 0, 1, r) - Z
+
+
+class DivisionRadii(torch.autograd.Function):
+
+    @staticmethod
+    def forward(
+        ctx, R: Tensor, Z: Tensor, k: Tensor, solver: str, cplex_tol: float
+    ) -> tuple[Tensor, Tensor]:
+        """Smallest positive root of R*(1 + k1*r^2 + k2*r^4 + ...) - Z*r = 0.
+
+        Args:
+            R: (..., N) radii of the 3D points: sqrt(X^2 + Y^2).
+            Z: (..., N) z-coordinates of the 3D points.
+            k: (..., num_k) distortion coefficients.
+            solver: 'quadratic' (closed form, num_k=1), 'quartic' (closed form,
+                num_k=2) or 'companion' (eigenvalues of the companion matrix).
+            cplex_tol: relative tolerance of the imaginary part of the roots for
+                being considered real.
+
+        Returns:
+            r: (..., N) radii in the retinal plane.
+            valid: (..., N) boolean tensor indicating valid radii.
+        """
+        if solver == "quadratic":
+            r, valid = radii_via_quadratic(R, Z, k)
+        elif solver == "quartic":
+            r, valid = radii_via_quartic(R, Z, k, cplex_tol)
+        elif solver == "companion":
+            r, valid = radii_via_companion(R, Z, k, cplex_tol)
+        else:
+            raise ValueError(f"Unknown solver: {solver}.")
+        ctx.save_for_backward(R, Z, k, r, valid)
+        ctx.mark_non_differentiable(valid)
+        return r, valid
+
+    @staticmethod
+    def backward(
+        ctx, dloss_dr: Tensor, dloss_dvalid: Tensor
+    ) -> tuple[Tensor | None, Tensor | None, Tensor | None, None, None]:
+        """Backward pass using the implicit function theorem.
+
+        With F(r; R, Z, k) := R*(1 + k1*r^2 + ...) - Z*r = 0, the derivatives of the
+        root are dr/dx = -(dF/dx) / (dF/dr). Invalid radii do not propagate gradients.
+
+        Args:
+            dloss_dr: (..., N) gradient w.r.t. the retinal radii.
+            dloss_dvalid: (..., N) gradient w.r.t. the valid flags. Ignored as they
+                are not differentiable.
+
+        Returns:
+            dloss_dR: (..., N) gradient w.r.t. the radii of the 3D points.
+            dloss_dZ: (..., N) gradient w.r.t. the z-coordinates of the 3D points.
+            dloss_dk: (..., num_k) gradient w.r.t. the distortion coefficients.
+        """
+        R, Z, k, r, valid = ctx.saved_tensors
+        dloss_dR = dloss_dZ = dloss_dk = None
+        _, dF_dr = _radii_residual(r, R, Z, k)
+        valid = valid & (dF_dr != 0)
+        # -dloss/dr / (dF/dr), common factor of all gradients
+        g = torch.where(valid, -dloss_dr / torch.where(valid, dF_dr, 1), 0)
+        r2 = r * r
+        monomials = r2.unsqueeze(-1).pow(
+            torch.arange(1, k.shape[-1] + 1, device=r.device, dtype=r.dtype)
+        )  # r^2, r^4, ... (..., N, num_k)
+        if ctx.needs_input_grad[0]:
+            dF_dR = 1 + (k.unsqueeze(-2) * monomials).sum(-1)
+            dloss_dR = (g * dF_dR).sum_to_size(R.shape)
+        if ctx.needs_input_grad[1]:
+            dloss_dZ = (-g * r).sum_to_size(Z.shape)
+        if ctx.needs_input_grad[2]:
+            dF_dk = R.unsqueeze(-1) * monomials
+            dloss_dk = (g.unsqueeze(-1) * dF_dk).sum(-2).sum_to_size(k.shape)
+        return dloss_dR, dloss_dZ, dloss_dk, None, None
+
+
+def division_radii(
+    R: Tensor, Z: Tensor, k: Tensor, cplex_tol: float = 1e-4, solver: str = "auto"
+) -> tuple[Tensor, Tensor]:
+    """Get radii in retinal plane, differentiable w.r.t. the rays and coefficients.
+
+    Args:
+        R: (..., N) radii of the 3D points: sqrt(X^2 + Y^2).
+        Z: (..., N) z-coordinates of the 3D points.
+        k: (..., num_k) distortion coefficients.
+        cplex_tol: relative tolerance of the imaginary part of the roots for being
+            considered real.
+        solver: 'quadratic', 'quartic', 'companion' or 'auto' (default), which
+            selects the closed-form solution for num_k <= 2 and the eigenvalues of the
+            companion matrix otherwise.
+
+    Returns:
+        (..., N) radii in the retinal plane.
+        (..., N) boolean tensor indicating valid radii.
+    """
+    if solver == "auto":
+        solver = DEFAULT_ROOT_SOLVERS.get(k.shape[-1], "companion")
+    return DivisionRadii.apply(R, Z, k, solver, cplex_tol)
+
+
 def unproject_z(xy: Tensor, k: Tensor) -> Tensor:
     """Back-projection/unprojection function for the Division model.
 
@@ -62,6 +287,28 @@ def unproject_z(xy: Tensor, k: Tensor) -> Tensor:
     return z
 
 
+def theta_from_radii(r: Tensor, k: Tensor) -> tuple[Tensor, Tensor]:
+    """Polar angles of the unprojected rays, θ = atan2(r, z(r)), and dθ/dr.
+
+    Args:
+        r: (..., N) radii in the retinal plane.
+        k: (..., num_k) distortion coefficients.
+
+    Returns:
+        (..., N) polar angles.
+        (..., N) derivatives dθ/dr.
+    """
+    r2 = ri = r * r
+    z = 1 + k[..., :1] * r2
+    dz_r = 2 * k[..., :1] * r2  # r * dz/dr
+    for i in range(1, k.shape[-1]):
+        ri = ri * r2
+        z = z + k[..., i, None] * ri
+        dz_r = dz_r + (2 * i + 2) * k[..., i, None] * ri
+    theta = torch.atan2(r, z)
+    return theta, (z - dz_r) / (r2 + z * z)
+
+
 class Division(BaseCamera):
     """Implementation of the Division Camera Model [1].
 
@@ -84,6 +331,20 @@ class Division(BaseCamera):
     [2] Revisiting Radial Distortion Absolute Pose. V. Larsson et al., ICCV 2019.
     [3] Babelcalib: A Universal Approach to Calibrating Central Cameras.
         Y. Lochman et al., ICCV 2021.
+
+    Args:
+        num_k: number of distortion coefficients. Default is 1.
+        complex_tol: relative tolerance of the imaginary part of the roots for being
+            considered real, when projecting with num_k > 1.
+        lut_size: if positive, projections with num_k > 1 are computed with a lookup
+            table of θ(r) with this number of nodes, tabulated for each set of
+            intrinsics, instead of with the eigenvalues of companion matrices. Only used
+            when no gradients are required.
+        lut_tol: maximum admissible error of the LUT solutions (retinal radii). Points
+            with larger estimated errors are solved with the exact solver.
+        root_solver: exact solver of the polynomial when projecting with num_k > 1:
+            'quartic' (closed form, num_k=2 only), 'companion' or 'auto' (default),
+            which uses the closed form whenever possible.
     """
 
     NAME = "division"
@@ -100,11 +361,21 @@ class Division(BaseCamera):
         "k4": 7,
     }
 
-    def __init__(self, num_k: int = 1, complex_tol: float = 1e-4):
+    def __init__(
+        self,
+        num_k: int = 1,
+        complex_tol: float = 1e-4,
+        lut_size: int = 0,
+        lut_tol: float = 1e-5,
+        root_solver: str = "auto",
+    ):
         if num_k <= 0 or not isinstance(num_k, int):
             raise ValueError(f"`num_k` must be a positive integer but got: {num_k}.")
         self.num_k = num_k
         self.cplex_tol = complex_tol
+        self.lut_size = lut_size
+        self.lut_tol = lut_tol
+        self.root_solver = root_solver
 
     def parse_params(self, params: Tensor) -> tuple[Tensor, Tensor, Tensor]:
         """Parse parameters into focal lengths, principal points, and distortion.
@@ -183,7 +454,12 @@ class Division(BaseCamera):
             return im_coords, valid
 
         R = torch.linalg.norm(points_3d[..., :2], dim=-1)  # (..., N)
-        r, valid = radii_via_companion(R, points_3d[..., 2], k, self.cplex_tol)
+        if use_lut(self.lut_size, params, points_3d):
+            r, valid = self._radii_via_lut(R, points_3d[..., 2], k)
+        else:
+            r, valid = division_radii(
+                R, points_3d[..., 2], k, self.cplex_tol, self.root_solver
+            )
         im_coords = (
             r.unsqueeze(-1)
             * points_3d[..., :2]
@@ -192,6 +468,39 @@ class Division(BaseCamera):
         im_coords = f.unsqueeze(-2) * im_coords + c.unsqueeze(-2)
         return im_coords, valid
 
+    def _radii_via_lut(self, R: Tensor, Z: Tensor, k: Tensor) -> tuple[Tensor, Tensor]:
+        """Get radii in retinal plane by inverting θ(r) with a lookup table.
+
+        Args:
+            R: (..., N) radii of the 3D points: sqrt(X^2 + Y^2).
+            Z: (..., N) z-coordinates of the 3D points.
+            k: (..., num_k) distortion coefficients.
+
+        Returns:
+            (..., N) radii in the retinal plane.
+            (..., N) boolean tensor indicating valid radii.
+        """
+        eps = torch.finfo(k.dtype).eps
+        # the table covers up to ~3x the radius at which 1 + k1*r^2 = 0 (or up to
+        # r=10, i.e. ~84 deg. without distortion). Beyond it, the exact solver is used
+        r_max = (3 * k[..., 0].abs().clamp(eps).rsqrt()).clamp(max=10)
+
+        def exact_inverse(k_: Tensor, theta: Tensor) -> tuple[Tensor, Tensor]:
+            return division_radii(
+                torch.sin(theta), torch.cos(theta), k_, self.cplex_tol, self.root_solver
+            )
+
+        theta = torch.atan2(R, Z)
+        return radial_lut_inverse(
+            theta_from_radii,
+            k,
+            theta,
+            r_max,
+            exact_inverse,
+            self.lut_size,
+            self.lut_tol,
+        )
+
     def unproject(self, params: Tensor, points_2d: Tensor) -> tuple[Tensor, None]:
         """Unproject image coordinates to unit bearing vectors in the camera frame.
 
@@ -40,7 +40,7 @@ class CameraFactory:
         return CameraFactory.FACTORY[cam_id].create_from_params(params)
 
     @staticmethod
-    def create_from_id(cam_id: str) -> BaseCamera:
+    def create_from_id(cam_id: str, lut_size: int = 0) -> BaseCamera:
         """Create a camera model from an identifier of the form: {name}_{spec}
 
         Examples:
@@ -48,9 +48,16 @@ class CameraFactory:
             "simple_pinhole": SimplePinhole
             "radial_2": Radial with num_k=1
             "simple_radial_1": SimpleRadial with num_k=2
+
+        If `lut_size` is positive, the iterative (un)projections of the models that
+        support it are computed with a lookup table of that size (see
+        anycalib/cameras/radial_lut.py). It is ignored by the other models.
         """
         name = cam_id.partition(":")[0]
-        return CameraFactory.FACTORY[name].create_from_id(cam_id)
+        cam = CameraFactory.FACTORY[name].create_from_id(cam_id)
+        if lut_size > 0 and hasattr(cam, "lut_size"):
+            cam.lut_size = lut_size
+        return cam
 
     @staticmethod
     def create(cam_id: str, *args, **kwargs) -> BaseCamera:
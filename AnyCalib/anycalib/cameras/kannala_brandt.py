@@ -1,10 +1,12 @@
-from math import ceil
+from math import ceil, pi
 
 import torch
 from torch import Tensor
 
 from anycalib import utils as ut
 from anycalib.cameras.base import BaseCamera
+from anycalib.cameras.radial_lut import radial_lut_inverse, use_lut
+from anycalib.manifolds import Unit3
 
 
 class NewtonThetaFromRadii(torch.autograd.Function):
@@ -99,8 +101,79 @@ def newton_theta_from_radii(
     return NewtonThetaFromRadii.apply(k, sen_radii, newton_iters, newton_tol)  # type: ignore
 
 
-def propagate_tangent_covs(bearings: Tensor, bs, covs: Tensor, k0: Tensor) -> Tensor:
-    raise NotImplementedError
+def radii_from_theta(theta: Tensor, k: Tensor) -> tuple[Tensor, Tensor]:
+    """Sensor radii, r = θ + k1*θ^3 + k2*θ^5 + ..., and their derivatives w.r.t. θ.
+
+    Args:
+        theta: (..., N) polar angles.
+        k: (..., num_k) radial distortion coefficients.
+
+    Returns:
+        (..., N) sensor radii.
+        (..., N) derivatives dr/dθ.
+    """
+    theta_2 = theta_i = theta**2
+    factor = 1 + k[..., :1] * theta_2
+    grad = 1 + 3 * k[..., :1] * theta_2
+    for j in range(1, k.shape[-1]):
+        theta_i = theta_i * theta_2
+        factor = factor + k[..., j, None] * theta_i
+        grad = grad + (3 + 2 * j) * k[..., j, None] * theta_i
+    return theta * factor, grad
+
+
+def propagate_tangent_covs(
+    bearings: Tensor, covs: Tensor, k0: Tensor | None = None
+) -> Tensor:
+    """Propagate covariances expressed in the tangent space of the bearings to the
+    space where errors are linear w.r.t. the intrinsic parameters.
+
+    The propagation is done to the error space of the linear system formed in
+    `KannalaBrandt._form_batched_system`:
+        e = a * (u, v) - b - r(θ) * (X, Y) / R,
+    where a = 1/f, b = c/f, r(θ) = θ + k1*θ^3 + ... and R = sqrt(X^2 + Y^2). Only the
+    last term depends on the bearings.
+
+    Args:
+        bearings: (..., N, 3) unit bearing vectors in the camera frame.
+        covs: (..., N, 2) diagonal elements of the covariances expressed in the tangent
+            space of the input bearings.
+        k0: (..., num_k) approximate distortion coefficients. If None, they are assumed
+            to be zero, i.e. r(θ) = θ.
+
+    Returns:
+        (..., N, 2, 2) error covariances.
+    """
+    eps = torch.finfo(bearings.dtype).eps
+    R = torch.linalg.norm(bearings[..., :2], dim=-1, keepdim=True)  # (..., N, 1)
+    theta = torch.atan2(R, bearings[..., 2:])
+    u = bearings[..., :2] / R.clamp(eps)  # unit radial direction (..., N, 2)
+    # r(θ)/θ and r'(θ)
+    r_div_theta, dr_dtheta = torch.ones_like(theta), torch.ones_like(theta)
+    if k0 is not None:
+        theta2 = theta**2
+        theta2i = torch.ones_like(theta)
+        for i in range(k0.shape[-1]):
+            theta2i = theta2i * theta2
+            k_i = k0[..., None, i, None]
+            r_div_theta = r_div_theta + k_i * theta2i
+            dr_dtheta = dr_dtheta + (3 + 2 * i) * k_i * theta2i
+    # r(θ)/R, with θ/R -> 1/Z as R -> 0
+    r_div_R = r_div_theta * torch.where(R > eps, theta / R.clamp(eps), 1)
+    # Jacobian of r(θ) * (X, Y) / R w.r.t. the point in the unit sphere (..., N, 2, 3)
+    # using dθ/d(X, Y, Z) = (Z * u, -R) for unit bearings
+    derr_dp = bearings.new_zeros((*covs.shape, 3))
+    uuT = u[..., :, None] * u[..., None, :]
+    derr_dp[..., :2] = dr_dtheta[..., None] * bearings[..., 2:, None] * uuT + r_div_R[
+        ..., None
+    ] * (torch.eye(2, dtype=u.dtype, device=u.device) - uuT)
+    derr_dp[..., 2] = -dr_dtheta * R * u
+    # Jacobian of the error w.r.t. the coordinates in the tangent plane
+    derr_dbasis = derr_dp @ Unit3.get_tangent_basis(bearings)
+    error_covs = ut.fast_small_matmul(
+        derr_dbasis * covs[..., None, :], derr_dbasis.transpose(-1, -2)
+    )
+    return error_covs
 
 
 class KannalaBrandt(BaseCamera):
@@ -130,6 +203,11 @@ class KannalaBrandt(BaseCamera):
         num_k: number of radial distortion coefficients. Default is 4.
         newton_iters: number of Newton iterations for mapping sensor radii to polar angles (θ)
         newton_tol: threshold for checking convergence of the Newton algorithm.
+        lut_size: if positive, unprojections are computed with a lookup table of θ(r)
+            with this number of nodes, tabulated for each set of intrinsics, instead
+            of with the Newton method. Only used when no gradients are required.
+        lut_tol: maximum admissible error (in radians) of the LUT solutions. Points
+            with larger estimated errors are solved with the Newton method.
     """
 
     NAME = "kb"
@@ -151,6 +229,8 @@ class KannalaBrandt(BaseCamera):
         num_k: int = 4,
         newton_iters: int = 25,
         newton_tol: float = 1e-5,
+        lut_size: int = 0,
+        lut_tol: float = 1e-5,
     ):
         if num_k < 1 or num_k > 4 or not isinstance(num_k, int):
             raise ValueError(
@@ -159,6 +239,8 @@ class KannalaBrandt(BaseCamera):
         self.num_k = num_k
         self.newton_iters = newton_iters
         self.newton_tol = newton_tol
+        self.lut_size = lut_size
+        self.lut_tol = lut_tol
 
     def parse_params(self, params: Tensor) -> tuple[Tensor, Tensor, Tensor]:
         """Parse parameters into focal lengths, principal points, and distortion.
@@ -269,9 +351,22 @@ class KannalaBrandt(BaseCamera):
         f, c, k = self.parse_params(params)
         sen_coords = (points_2d - c.unsqueeze(-2)) / f.unsqueeze(-2)
         sen_radii = torch.linalg.norm(sen_coords, dim=-1)
-        theta, valid = newton_theta_from_radii(
-            k, sen_radii, self.newton_iters, self.newton_tol
-        )
+        if use_lut(self.lut_size, params, points_2d):
+            theta, valid = radial_lut_inverse(
+                radii_from_theta,
+                k,
+                sen_radii,
+                pi,
+                lambda k_, r_: newton_theta_from_radii(
+                    k_, r_, self.newton_iters, self.newton_tol
+                ),
+                self.lut_size,
+                self.lut_tol,
+            )
+        else:
+            theta, valid = newton_theta_from_radii(
+                k, sen_radii, self.newton_iters, self.newton_tol
+            )
         bearings = torch.cat(
             (
                 torch.sin(theta).unsqueeze(-1)
@@ -332,20 +427,27 @@ class KannalaBrandt(BaseCamera):
                 expressed in the tangent space of the input bearings.
             params0: (..., D) approximate estimation of the intrinsic parameters to
                 propagate the covariances from the tangent space to the error space.
-                Currently ignored.
+                Only its distortion coefficients are used. If None, they are assumed
+                to be zero.
 
         Returns:
             (..., D) fitted intrinsic parameters: fx, fy, cx, cy, k1, ...
             (...,) integer tensor indicating success. 0 if successful. Otherwise, an
                 illegal value was found (<0) or the system is singular (>0).
         """
-        if covs is not None:
-            raise NotImplementedError
         nf = self.NUM_F  # number of focal lengths
         As, bs = self._form_batched_system(
             im_coords, bearings, None if cxcy is None else cxcy
         )
-        sol, info = ut.solve_2dweighted_lstsq_qr(As, bs)
+        # propagate covariances if present (..., N, 2, 2)
+        if covs is not None:
+            k0 = None if params0 is None else params0[..., nf + 2 :]
+            covs = covs.to(bearings.dtype).clamp(torch.finfo(bearings.dtype).eps)
+            e_covs = propagate_tangent_covs(bearings, covs, k0)
+            Ws, info = torch.linalg.inv_ex(e_covs)
+            sol, info = ut.solve_2dweighted_lstsq_qr(As, bs, Ws, info == 0)
+        else:
+            sol, info = ut.solve_2dweighted_lstsq_qr(As, bs)
         f = sol[..., :nf].reciprocal()
         if cxcy is None:
             c = sol[..., nf : nf + 2] * f
@@ -12,7 +12,7 @@ import torch
 from scipy.optimize import newton
 from tqdm import tqdm
 
-from anycalib.cameras.division import radii_via_companion
+from anycalib.cameras.division import division_radii
 from anycalib.cameras.factory import CameraFactory
 from anycalib.optim import GaussNewtonCalib, LevMarCalib
 
@@ -623,7 +623,7 @@ class LensFunCam:
         assert k.shape == (2,)
         R = torch.from_numpy(np.sin(theta))
         Z = torch.from_numpy(np.cos(theta))
-        r, valid = radii_via_companion(R, Z, torch.from_numpy(k))
+        r, valid = division_radii(R, Z, torch.from_numpy(k))
         assert valid.sum() > 0.99 * len(valid)
         return r.numpy()
 
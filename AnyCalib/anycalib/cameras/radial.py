@@ -1,4 +1,4 @@
-from math import ceil, sqrt
+from math import ceil, radians, sqrt, tan
 
 import torch
 import torch.nn.functional as F
@@ -7,6 +7,7 @@ from torch import Tensor
 from anycalib import utils as ut
 from anycalib.cameras.base import BaseCamera
 from anycalib.cameras.pinhole import check_within_fov
+from anycalib.cameras.radial_lut import radial_lut_inverse, use_lut
 from anycalib.manifolds import Unit3
 
 
@@ -137,6 +138,27 @@ def compute_distortion(radii_u2: Tensor, k: Tensor) -> Tensor:
     return dist
 
 
+def distort_radii(radii_u: Tensor, k: Tensor) -> tuple[Tensor, Tensor]:
+    """Distorted radii, r_d = r_u * (1 + k1*r_u^2 + ...), and derivatives dr_d/dr_u.
+
+    Args:
+        radii_u: (..., N) undistorted radii.
+        k: (..., num_k) radial distortion coefficients.
+
+    Returns:
+        (..., N) distorted radii.
+        (..., N) derivatives dr_d/dr_u.
+    """
+    radii_ui = radii_u2 = radii_u * radii_u
+    dist = 1 + k[..., :1] * radii_u2
+    grad = 1 + 3 * k[..., :1] * radii_u2
+    for j in range(1, k.shape[-1]):
+        radii_ui = radii_u2 * radii_ui  # radii_ui = r_u^(2 + 2j)
+        dist = dist + k[..., j, None] * radii_ui
+        grad = grad + (3 + 2 * j) * k[..., j, None] * radii_ui
+    return radii_u * dist, grad
+
+
 def propagate_tangent_covs(
     bearings: Tensor, proj: Tensor, covs: Tensor, k: Tensor
 ) -> Tensor:
@@ -190,6 +212,12 @@ class Radial(BaseCamera):
         num_k: number of radial distortion coefficients. Default is 2.
         undist_iters: number of Newton iterations for undistorting radii.
         undist_tol: threshold for checking convergence of the Newton algorithm.
+        lut_size: if positive, undistortions of radii (with num_k > 1) are computed
+            with a lookup table of the distortion function with this number of nodes,
+            tabulated for each set of intrinsics, instead of with the Newton method.
+            Only used when no gradients are required.
+        lut_tol: maximum admissible error of the LUT solutions (undistorted radii).
+            Points with larger estimated errors are solved with the Newton method.
     """
 
     NAME = "radial"
@@ -212,6 +240,8 @@ class Radial(BaseCamera):
         num_k: int = 2,
         undist_iters: int = 25,
         undist_tol: float = 1e-5,
+        lut_size: int = 0,
+        lut_tol: float = 1e-5,
     ):
         if not (0 < max_fov < 180):
             raise ValueError(f"`max_fov` must be in (0, 180) but got: {max_fov}.")
@@ -221,6 +251,8 @@ class Radial(BaseCamera):
         self.num_k = num_k
         self.undist_iters = undist_iters
         self.undist_tol = undist_tol
+        self.lut_size = lut_size
+        self.lut_tol = lut_tol
 
     def parse_params(self, params: Tensor) -> tuple[Tensor, Tensor, Tensor]:
         """Parse parameters into focal lengths, principal points, and distortion.
@@ -329,6 +361,18 @@ class Radial(BaseCamera):
             # select solution
             ru = torch.where(disc >= 0, sol_p, sol_n)
             valid = None
+        elif use_lut(self.lut_size, params, points_2d):
+            ru, valid = radial_lut_inverse(
+                distort_radii,
+                k,
+                rd,
+                tan(radians(0.5 * self.max_fov)),
+                lambda k_, rd_: newton_undistort_radii(
+                    k_, rd_, self.undist_iters, self.undist_tol
+                ),
+                self.lut_size,
+                self.lut_tol,
+            )
         else:
             ru, valid = newton_undistort_radii(
                 k, rd, self.undist_iters, self.undist_tol
@@ -0,0 +1,161 @@
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+import torch
+from torch import Tensor
+
+# (x, coeffs) -> (g(x), g'(x)) with x: (..., N), coeffs: (..., C)
+RadialFun = Callable[[Tensor, Tensor], tuple[Tensor, Tensor]]
+# (coeffs, y) -> (x, valid) with coeffs: (M, C), y: (M, 1)
+ExactInverse = Callable[[Tensor, Tensor], tuple[Tensor, Tensor | None]]
+
+# tables of the last few sets of coefficients, e.g. of a fixed camera being undistorted
+# or of the intrinsics refined during the last iterations of the nonlinear optimizer
+LUT_CACHE_SIZE = 32
+LUT_CACHE_MAX_SETS = 8  # batches with more sets (e.g. RANSAC hypotheses) are not cached
+_lut_cache: OrderedDict[tuple, tuple[Tensor, Tensor, Tensor]] = OrderedDict()
+_lut_cache_lock = threading.Lock()
+
+
+def use_lut(lut_size: int, *tensors: Tensor) -> bool:
+    """Whether to use the LUT, which is not differentiable, for the given inputs."""
+    return lut_size > 0 and not any(t.requires_grad for t in tensors)
+
+
+def build_radial_lut(
+    fun: RadialFun, coeffs: Tensor, x_max: Tensor | float, size: int
+) -> tuple[Tensor, Tensor, Tensor]:
+    """Tabulate a radial mapping y = g(x) on a uniform grid over [0, x_max].
+
+    Only the monotonically increasing prefix of the table, starting at x=0, is kept.
+    The remaining entries of y are set to +inf so that the table stays sorted and
+    queries beyond its range can be detected.
+
+    Args:
+        fun: radial mapping returning its values and derivatives.
+        coeffs: (..., C) coefficients of the mapping (e.g. distortion coefficients).
+        x_max: (...,) or scalar upper limit of the grid.
+        size: number of nodes.
+
+    Returns:
+        (..., size) x nodes.
+        (..., size) y values.
+        (...,) maximum y of the monotonic part of the table.
+    """
+    grid = torch.linspace(0, 1, size, device=coeffs.device, dtype=coeffs.dtype)
+    x_max = torch.as_tensor(x_max, device=coeffs.device, dtype=coeffs.dtype)
+    x = grid * x_max[..., None]  # (..., size)
+    y, _ = fun(x, coeffs)
+    # number of nodes of the monotonic prefix
+    increasing = y.diff(dim=-1) > 0
+    n_mono = increasing.int().cumprod(dim=-1).sum(dim=-1, keepdim=True) + 1
+    idx = torch.arange(size, device=coeffs.device)
+    y = torch.where(idx < n_mono, y, torch.inf)
+    y_max = y.take_along_dim(n_mono - 1, dim=-1).squeeze(-1)
+    return x, y, y_max
+
+
+def cached_radial_lut(
+    fun: RadialFun, coeffs: Tensor, x_max: Tensor | float, size: int
+) -> tuple[Tensor, Tensor, Tensor]:
+    """`build_radial_lut` with an LRU cache keyed by the values of the coefficients.
+
+    Only small batches of coefficients are cached since hashing them requires copying
+    them to the host.
+    """
+    n_sets = coeffs.numel() // max(coeffs.shape[-1], 1)
+    if n_sets > LUT_CACHE_MAX_SETS or LUT_CACHE_SIZE <= 0:
+        return build_radial_lut(fun, coeffs, x_max, size)
+    x_max_ = torch.as_tensor(x_max, dtype=coeffs.dtype)
+    key = (
+        fun,
+        size,
+        coeffs.device,
+        coeffs.dtype,
+        coeffs.shape,
+        coeffs.detach().cpu().numpy().tobytes(),
+        x_max_.shape,
+        x_max_.detach().cpu().numpy().tobytes(),
+    )
+    with _lut_cache_lock:
+        if key in _lut_cache:
+            _lut_cache.move_to_end(key)
+            return _lut_cache[key]
+    lut = build_radial_lut(fun, coeffs, x_max, size)
+    with _lut_cache_lock:
+        _lut_cache[key] = lut
+        while len(_lut_cache) > LUT_CACHE_SIZE:
+            _lut_cache.popitem(last=False)
+    return lut
+
+
+def radial_lut_inverse(
+    fun: RadialFun,
+    coeffs: Tensor,
+    y: Tensor,
+    x_max: Tensor | float,
+    exact_inverse: ExactInverse,
+    size: int = 1024,
+    tol: float = 1e-5,
+) -> tuple[Tensor, Tensor]:
+    """Invert a monotonic radial mapping y = g(x) with a 1-D lookup table.
+
+    The mapping is tabulated once for each set of coefficients (and cached, see
+    `cached_radial_lut`), and the queries are inverted by vectorized linear
+    interpolation, followed by one Newton correction.
+    The error of each solution is then estimated as |g(x) - y| / g'(x), i.e. the next
+    Newton step, which is a first-order approximation of |x - g⁻¹(y)|. Queries that
+    fall outside the monotonic part of the table, or whose estimated error exceeds
+    `tol`, are solved with `exact_inverse`.
+
+    Args:
+        fun: radial mapping returning its values and derivatives.
+        coeffs: (..., C) coefficients of the mapping.
+        y: (..., N) queries.
+        x_max: (...,) or scalar upper limit of the table.
+        exact_inverse: exact solver used as fallback.
+        size: number of nodes of the table.
+        tol: maximum admissible error of the LUT solutions.
+
+    Returns:
+        (..., N) solutions x.
+        (..., N) boolean tensor indicating valid solutions.
+    """
+    x_tab, y_tab, y_max = cached_radial_lut(fun, coeffs, x_max, size)
+    batch = torch.broadcast_shapes(y_tab.shape[:-1], y.shape[:-1])
+    x_tab = x_tab.expand(*batch, size).contiguous()
+    y_tab = y_tab.expand(*batch, size).contiguous()
+    y = y.expand(*batch, y.shape[-1])
+    # linear interpolation
+    i1 = torch.searchsorted(y_tab, y.contiguous()).clamp(1, size - 1)
+    i0 = i1 - 1
+    y0, y1 = y_tab.take_along_dim(i0, dim=-1), y_tab.take_along_dim(i1, dim=-1)
+    x0, x1 = x_tab.take_along_dim(i0, dim=-1), x_tab.take_along_dim(i1, dim=-1)
+    in_range = (y >= 0) & (y <= y_max[..., None])
+    t = ((y - y0) / torch.where(in_range, y1 - y0, 1)).clamp(0, 1)
+    x = x0 + t * (x1 - x0)
+    # Newton correction and error estimate
+    g, dg = fun(x, coeffs)
+    x = x - (g - y) / dg
+    g, dg = fun(x, coeffs)
+    err = (g - y).abs() / dg
+    accept = in_range & (dg > 0) & (err <= tol)  # nan -> False
+
+    if not accept.all():
+        fallback = ~accept
+        coeffs_fb = coeffs.unsqueeze(-2).expand(*batch, y.shape[-1], coeffs.shape[-1])[
+            fallback
+        ]
+        x_fb, valid_fb = exact_inverse(coeffs_fb, y[fallback][:, None])
+        x = x.masked_scatter(fallback, x_fb.squeeze(-1))
+        valid = accept.masked_scatter(
+            fallback,
+            (
+                torch.ones_like(x_fb, dtype=torch.bool)
+                if valid_fb is None
+                else valid_fb
+            ).squeeze(-1),
+        )
+        return x, valid
+    return x, accept
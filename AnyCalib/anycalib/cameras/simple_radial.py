@@ -21,6 +21,12 @@ class SimpleRadial(Radial):
         num_k: number of radial distortion coefficients. Default is 1.
         undist_iters: number of Newton iterations for undistorting radii.
         undist_tol: threshold for checking convergence of the Newton algorithm.
+        lut_size: if positive, undistortions of radii (with num_k > 1) are computed
+            with a lookup table of the distortion function with this number of nodes,
+            tabulated for each set of intrinsics, instead of with the Newton method.
+            Only used when no gradients are required.
+        lut_tol: maximum admissible error of the LUT solutions (undistorted radii).
+            Points with larger estimated errors are solved with the Newton method.
     """
 
     NAME = "simple_radial"
@@ -42,6 +48,8 @@ class SimpleRadial(Radial):
         num_k: int = 1,
         undist_iters: int = 25,
         undist_tol: float = 1e-5,
+        lut_size: int = 0,
+        lut_tol: float = 1e-5,
     ):
         if not (0 < max_fov < 180):
             raise ValueError(f"`max_fov` must be in (0, 180) but got: {max_fov}.")
@@ -51,6 +59,8 @@ class SimpleRadial(Radial):
         self.num_k = num_k
         self.undist_iters = undist_iters
         self.undist_tol = undist_tol
+        self.lut_size = lut_size
+        self.lut_tol = lut_tol
 
     def _form_batched_system(
         self, im_coords: Tensor, bearings: Tensor, cxcy: Tensor | None = None
@@ -0,0 +1,171 @@
+import json
+import os
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor
+
+
+def detect_image_circle(
+    image: Tensor,
+    threshold: float = 0.05,
+    min_dark_frac: float = 0.02,
+    max_size: int = 512,
+) -> Tensor | None:
+    """Detect the circular footprint of a fisheye lens on the sensor.
+
+    The image is thresholded on the maximum over the color channels, so that the black
+    corners outside the image circle are dark in all channels. The left/right-most and
+    top/bottom-most bright pixels of each row and column are the boundary points of the
+    footprint, and those lying on the image borders (where the circle is cropped by the
+    sensor) are discarded. The circle is then fitted to the remaining points with the
+    algebraic (Kasa) fit, iteratively rejecting outlying points, e.g. those due to
+    bright pixels outside the circle.
+
+    Args:
+        image: (3, H, W) or (1, 3, H, W) image with RGB values in [0, 1].
+        threshold: intensity below which pixels are considered as black.
+        min_dark_frac: minimum fraction of black pixels for the image to be considered
+            as having a circular footprint.
+        max_size: images are downsampled by an integer factor so that their longest
+            side is not greater than this value.
+
+    Returns:
+        (3,) center (cx, cy) and radius, in pixels of the input image and with the
+            origin at the top-left corner of the top-left pixel, or None if no image
+            circle is found.
+    """
+    image = image.reshape(-1, *image.shape[-3:])[:1].float()
+    h, w = image.shape[-2:]
+    stride = -(-max(h, w) // max_size)
+    if stride > 1:
+        image = F.avg_pool2d(image, stride, ceil_mode=True)
+    bright = image[0].amax(0) > threshold  # (h, w)
+    if 1 - bright.float().mean() < min_dark_frac or not bright.any():
+        return None
+    hs, ws = bright.shape
+
+    # boundary points of each row (x extents) and column (y extents) of the footprint
+    points = []
+    for mask, n in ((bright, ws), (bright.T, hs)):
+        has_bright = mask.any(-1)
+        idx = torch.arange(n, device=mask.device)
+        first = torch.where(mask, idx, n).amin(-1)  # left edge of first bright pixel
+        last = torch.where(mask, idx, -1).amax(-1) + 1  # right edge of last one
+        line = torch.arange(mask.shape[0], device=mask.device) + 0.5
+        for edge, on_border in ((first, first == 0), (last, last == n)):
+            keep = has_bright & ~on_border
+            points.append(torch.stack((edge[keep].float(), line[keep]), -1))
+    points[2:] = [p.flip(-1) for p in points[2:]]  # columns: (y, x) -> (x, y)
+    points = torch.cat(points).double() * stride
+    if len(points) < 10:
+        return None
+
+    keep = torch.ones(len(points), dtype=torch.bool, device=points.device)
+    for _ in range(5):
+        # x^2 + y^2 + a x + b y + c = 0
+        pts = points[keep]
+        A = torch.cat((pts, torch.ones_like(pts[:, :1])), -1)
+        sol = torch.linalg.lstsq(A, -(pts**2).sum(-1, keepdim=True)).solution[:, 0]
+        center = -0.5 * sol[:2]
+        r2 = (center**2).sum() - sol[2]
+        if r2 <= 0:
+            return None
+        err = ((points - center).norm(dim=-1) - r2.sqrt()).abs()
+        mad = err[keep].median()
+        new_keep = err <= max(3 * 1.4826 * mad.item(), stride)
+        if new_keep.sum() < 10 or (new_keep == keep).all():
+            break
+        keep = new_keep
+    radius = r2.sqrt()
+    if radius < 0.25 * min(h, w):
+        return None
+    return torch.cat((center, radius[None])).to(image.dtype)
+
+
+def image_circle_mask(
+    circle: Tensor, size: tuple[int, int], margin: float = 0.0
+) -> Tensor:
+    """Mask of the pixels whose centers lie inside an image circle.
+
+    Args:
+        circle: (3,) center (cx, cy) and radius, in pixels.
+        size: (H, W) image size.
+        margin: fraction of the radius to shrink the circle with, to discard the
+            strongly vignetted rim of the footprint.
+
+    Returns:
+        (H, W) boolean mask.
+    """
+    h, w = size
+    x = torch.arange(w, device=circle.device, dtype=circle.dtype) + 0.5
+    y = torch.arange(h, device=circle.device, dtype=circle.dtype) + 0.5
+    sq_dist = (x - circle[0]) ** 2 + (y[:, None] - circle[1]) ** 2
+    return sq_dist <= (circle[2] * (1 - margin)) ** 2
+
+
+class ImageCircleCache:
+    """Image circles detected once per lens and stored in a JSON file.
+
+    The footprint of a fisheye lens on the sensor does not change between captures, so
+    it is detected on the first image of each lens and reused afterwards, as long as
+    the image size does not change.
+
+    Args:
+        path: JSON file where the circles are stored. If None, they are only kept in
+            memory.
+        threshold, min_dark_frac: see `detect_image_circle`.
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        threshold: float = 0.05,
+        min_dark_frac: float = 0.02,
+    ):
+        self.path = path
+        self.threshold = threshold
+        self.min_dark_frac = min_dark_frac
+        self.circles = {}
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.circles = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"WARNING: Could not load image circles from {path}: {e}")
+
+    def get(self, key: str, image: Tensor) -> Tensor | None:
+        """Image circle of a lens, detected on `image` if not cached.
+
+        Args:
+            key: identifier of the lens.
+            image: (3, H, W) or (1, 3, H, W) image captured with the lens.
+
+        Returns:
+            (3,) center (cx, cy) and radius in pixels, or None if the image has no
+                circular footprint.
+        """
+        size = list(image.shape[-2:])
+        entry = self.circles.get(key)
+        if entry is None or entry["size"] != size:
+            circle = detect_image_circle(image, self.threshold, self.min_dark_frac)
+            entry = {
+                "size": size,
+                "circle": None if circle is None else circle.tolist(),
+            }
+            self.circles[key] = entry
+            self.save()
+        if entry["circle"] is None:
+            return None
+        return torch.tensor(entry["circle"], device=image.device)
+
+    def save(self):
+        if self.path is None:
+            return
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # write to a temporary file first so that interrupted writes are not reused
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.circles, f, indent=4)
+        os.replace(tmp_path, self.path)
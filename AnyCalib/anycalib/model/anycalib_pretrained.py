@@ -7,15 +7,22 @@ from torch import Tensor
 
 from anycalib.cameras import CameraFactory
 from anycalib.cameras.base import BaseCamera
+from anycalib.manifolds import Unit3
 from anycalib.model.dinov2 import DINOv2
 from anycalib.model.dpt_light_decoder import LightDPTDecoder
-from anycalib.model.ray_decoder import ConvexTangentDecoder
+from anycalib.model.field_cache import RayFieldCache
+from anycalib.model.model_selection import DEFAULT_SWEEP_CAM_IDS, sweep_camera_models
+from anycalib.model.ray_decoder import (
+    ConvexTangentDecoder,
+    field_spread_log_covs,
+    fuse_tangent_fields,
+)
 from anycalib.optim import GaussNewtonCalib, LevMarCalib
 from anycalib.ransac import RANSAC
 
 
-def get_cam_list(data: dict) -> list[BaseCamera]:
-    return [CameraFactory.create_from_id(id_) for id_ in data["cam_id"]]
+def get_cam_list(data: dict, lut_size: int = 0) -> list[BaseCamera]:
+    return [CameraFactory.create_from_id(id_, lut_size) for id_ in data["cam_id"]]
 
 
 def subsample(total: int, h: int, w: int, *tensors):
@@ -80,6 +87,11 @@ class Calibrator:
         ransac_conf: dict | None = None,
         rm_borders: int = 0,  # border size to ignore during fitting
         sample_size: int = -1,  # negative -> no subsampling)
+        return_optim_log: bool = False,  # output the iteration log of the optimizer
+        lin_with_covs: bool = False,  # weight the linear fit with pred["log_covs"]
+        nonlin_opt_w_covs: bool = False,  # weight the nonlinear refinement
+        cov_guided_sampling: bool = False,  # RANSAC sampling probs from the covs
+        lut_size: int = 0,  # positive -> (un)project iteratively-solved models via LUTs
     ):
         # subsampling
         self.rm_borders = rm_borders
@@ -87,11 +99,18 @@ class Calibrator:
         assert self.sample_size != 0, "Sample size must be non-zero"
         if self.sample_size > 0:
             raise NotImplementedError("Subsampling not implemented yet")
+        # per-pixel covariances of the predicted rays
+        self.lin_with_covs = lin_with_covs
+        self.nonlin_opt_w_covs = nonlin_opt_w_covs
+        self.cov_guided_sampling = cov_guided_sampling
+        # lookup tables for the camera models without closed-form (un)projection
+        self.lut_size = lut_size
         # initialization/fallback via RANSAC
         self.init_with_sac = init_with_sac
         self.fallback_to_sac = fallback_to_sac
         self.ransac = RANSAC(ransac_conf)
         # nonlinear refinement
+        self.return_optim_log = return_optim_log
         if nonlin_opt_method == "gauss_newton":
             self.optimizer = GaussNewtonCalib(nonlin_opt_conf)
         elif nonlin_opt_method == "lev_mar":
@@ -102,9 +121,20 @@ class Calibrator:
                 f"However, got: {nonlin_opt_method}"
             )
 
-    def __call__(self, pred: dict, data: dict) -> dict:
+    @property
+    def uses_covs(self) -> bool:
+        """Whether the per-pixel covariances, pred["log_covs"], are used."""
+        return self.lin_with_covs or self.nonlin_opt_w_covs or self.cov_guided_sampling
+
+    def __call__(self, pred: dict, data: dict, return_l2_cost: bool = False) -> dict:
+        """Fit the intrinsics of the cameras in data["cam_id"] to the predicted fields.
+
+        With `return_l2_cost`, the output also contains the unweighted, non-robust
+        "l2_cost" of each fit (e.g. for model selection). If the optimizer minimizes a
+        robust or covariance-weighted cost, this requires an extra residual pass.
+        """
         optimizer = self.optimizer
-        cams = get_cam_list(data)
+        cams = get_cam_list(data, self.lut_size)
         _, _, h, w = data["image"].shape
         rays: Tensor = pred["rays"]
         # image coords corresponding to rays. Add 0.5 to get coords at pixel *centers*
@@ -112,50 +142,91 @@ class Calibrator:
         # observations for nonlinear optimization
         obs = pred["tangent_coords"] if optimizer.res_tangent == "z1" else rays
 
+        # optional (B, H*W) mask of valid pixels, e.g. those inside the image circle
+        valid = data.get("valid_mask", None)
+        valid = None if valid is None else valid.reshape(-1, h * w, 1)
+        # optional (B, H*W, 2) log-covariances of the predicted tangent coordinates
+        log_covs = pred.get("log_covs", None) if self.uses_covs else None
+        assert not self.uses_covs or log_covs is not None, "Missing pred['log_covs']"
+
         # remove borders and subsample
         if self.rm_borders > 0:
             rays: Tensor
             obs: Tensor | list[None]
             im_coords: Tensor
-            rays, obs, im_coords = remove_borders(
-                h, w, self.rm_borders, rays, obs, im_coords
+            rays, obs, im_coords, valid, log_covs = remove_borders(
+                h, w, self.rm_borders, rays, obs, im_coords, valid, log_covs
             )
         if self.sample_size > 0:
             rays: Tensor
             obs: Tensor | list[None]
             im_coords: Tensor
-            rays, obs, im_coords = subsample(
-                self.sample_size, h, w, rays, obs, im_coords
+            rays, obs, im_coords, valid, log_covs = subsample(
+                self.sample_size, h, w, rays, obs, im_coords, valid, log_covs
             )
+        valid = [None] * len(cams) if valid is None else valid[..., 0]
+        log_covs = [None] * len(cams) if log_covs is None else log_covs
 
         # control optimization of principal point
         cxcy = data.get("cxcy", None)
         fix_cxcy = cxcy is not None
         cxcy = [None] * len(cams) if cxcy is None else cxcy
 
-        intrinsics, success, intrinsics_icovs = [], [], []
+        intrinsics, success, intrinsics_icovs, costs, logs = [], [], [], [], []
+        # unweighted, non-robust costs, e.g. for model selection
+        l2_costs = []
+        cost_is_l2 = optimizer.loss == "l2" and not self.nonlin_opt_w_covs
         # iterate over batch since cams may be of different models
-        for rays_, cam_, cxcy_, obs_ in zip(rays, cams, cxcy, obs):
+        for rays_, cam_, cxcy_, obs_, valid_, log_covs_ in zip(
+            rays, cams, cxcy, obs, valid, log_covs
+        ):
             success_ = rays_.new_ones((), dtype=torch.bool)
+            im_coords_ = im_coords
+            if valid_ is not None:
+                # only keep the correspondences of valid pixels
+                rays_, obs_, im_coords_ = rays_[valid_], obs_[valid_], im_coords[valid_]
+                log_covs_ = None if log_covs_ is None else log_covs_[valid_]
+            # RANSAC samples confident pixels more often
+            probs = (
+                torch.exp(-log_covs_.mean(-1))
+                if self.cov_guided_sampling and log_covs_ is not None
+                else None
+            )
             # initialization
             if self.init_with_sac:
-                intrinsics_, _ = self.ransac(cam_, im_coords, rays_)
+                intrinsics_, _ = self.ransac(cam_, im_coords_, rays_, probs, cxcy_)
             else:
-                intrinsics_, info = cam_.fit(im_coords, rays_, cxcy_)  # (D,)
+                intrinsics_, info = cam_.fit(im_coords_, rays_, cxcy_)  # (D,)
                 success_ = (info == 0) and intrinsics_.isfinite().all()
+                if success_ and self.lin_with_covs:
+                    intrinsics_ = self.fit_with_covs(
+                        cam_, im_coords_, rays_, cxcy_, log_covs_, intrinsics_
+                    )
                 if not success_:
                     print(f"WARNING: Linear fit failed, {info=}")
                     if self.fallback_to_sac:
-                        intrinsics_, _ = self.ransac(cam_, im_coords, rays_)
+                        intrinsics_, _ = self.ransac(
+                            cam_, im_coords_, rays_, probs, cxcy_
+                        )
                     else:
                         intrinsics.append(torch.ones_like(intrinsics_))
                         success.append(success_)
+                        costs.append(rays_.new_full((), float("inf")))
+                        l2_costs.append(costs[-1])
+                        logs.append(None)
                         continue
 
             # nonlinear refinement
-            intrinsics_opt, cost0, cost, intrins_icovs_ = optimizer(
-                cam_, intrinsics_, im_coords, obs_, None, fix_cxcy
+            intrinsics_opt, cost0, cost, intrins_icovs_, *log = optimizer(
+                cam_,
+                intrinsics_,
+                im_coords_,
+                obs_,
+                torch.exp(-log_covs_) if self.nonlin_opt_w_covs else None,
+                fix_cxcy,
+                return_log=self.return_optim_log,
             )
+            logs.append(log[0] if log else None)
             success_ = success_ and cost < cost0
             intrinsics_icovs.append(intrins_icovs_)
             if cost > cost0:
@@ -167,120 +238,132 @@ class Calibrator:
 
             intrinsics.append(intrinsics_)
             success.append(success_)
+            costs.append(torch.minimum(cost0, cost))
+            if return_l2_cost:
+                l2_costs.append(
+                    costs[-1]
+                    if cost_is_l2
+                    else optimizer.l2_cost(cam_, intrinsics_, im_coords_, obs_)
+                )
 
-        out = {"intrinsics": intrinsics, "success": torch.stack(success)}
+        out = {
+            "intrinsics": intrinsics,
+            "success": torch.stack(success),
+            "cost": torch.stack(costs),
+        }
+        if return_l2_cost:
+            out["l2_cost"] = torch.stack(l2_costs)
+        if self.return_optim_log:
+            out["optim_logs"] = logs
         return (
             out if optimizer is None else out | {"intrinsics_icovs": intrinsics_icovs}
         )
 
+    @staticmethod
+    def fit_with_covs(
+        cam: BaseCamera,
+        im_coords: Tensor,
+        rays: Tensor,
+        cxcy: Tensor | None,
+        log_covs: Tensor,
+        intrinsics0: Tensor,
+    ) -> Tensor:
+        """Refit the intrinsics weighting each correspondence by its covariance.
+
+        The unweighted fit, `intrinsics0`, is used to propagate the covariances to the
+        error space of the linear fit. It is returned unchanged if the camera model
+        does not support weighted fits or if the weighted fit fails.
+        """
+        try:
+            intrinsics, info = cam.fit(
+                im_coords, rays, cxcy, log_covs.exp(), intrinsics0
+            )
+        except NotImplementedError:
+            return intrinsics0
+        if info != 0 or not intrinsics.isfinite().all():
+            return intrinsics0
+        return intrinsics
 
-class AnyCalib(torch.nn.Module):
-    """AnyCalib class.
 
-    Args for instantiation:
-        model_id: one of {'anycalib_pinhole', 'anycalib_gen', 'anycalib_dist', 'anycalib_edit'}.
-            Each model differes in the type of images they seen during training:
-                * 'anycalib_pinhole': Perspective (pinhole) images,
-                * 'anycalib_gen': General images, including perspective, distorted and
-                    strongly distorted images, and
-                * 'anycalib_dist': Distorted images using the Brown-Conrady camera model
-                    and strongly distorted images, using the EUCM camera model,
-                * 'anycalib_edit': Trained on edited (stretched and cropped) perspective
-                    images.
-            Default: 'anycalib_pinhole'.
-        nonlin_opt_method: nonlinear optimization method: 'gauss_newton' or 'lev_mar'.
-            Default: 'gauss_newton'
-        nonlin_opt_conf: nonlinear optimization configuration.
-            This config can be used to control the number of iterations and the space
-            where the residuals are minimized. See the classes `GaussNewtonCalib` or
-            `LevMarCalib` under anycalib/optim for details. Default: None.
-        init_with_sac: use RANSAC instead of nonminimal fit for initializating the
-            intrinsics. Default: False.
-        fallback_to_sac: use RANSAC if nonminimal fit fails. Default: True.
-        ransac_conf: RANSAC configuration. This config can be used to control e.g. the
-            inlier threshold or the number of minimal samples to try. See the class
-            `RANSAC` in anycalib/ransac.py for details. Default: None.
-        rm_borders: border size of the dense FoV fields to ignore during fitting.
-            Default: 0.
-        sample_size: approximate number of 2D-3D correspondences to use for fitting the
-            intrinsics. Negative value -> no subsampling. Default: -1.
+class AnyCalibBase:
+    """Pre-processing, fusion of test-time augmentations, calibration and
+    post-processing shared by `AnyCalib` and the exported models (see
+    `anycalib.model.export.ExportedAnyCalib`).
+
+    Subclasses provide `compute_fields`, which maps the (B, 3, H, W) resized images to
+    their (B, H*W, 3) rays and (B, H*W, 2) tangent_coords, the `calibrator` and the
+    `tta` flag.
     """
 
     EDGE_DIVISIBLE_BY = 14
     AR_RANGE = (0.5, 2)  # H/W range seen during training
     RESOLUTION = 102_400  # resolution seen during training
 
-    AVAILABLE_MODELS = {
-        "anycalib_pinhole",
-        "anycalib_dist",
-        "anycalib_gen",
-        "anycalib_edit",
-    }
+    calibrator: Calibrator
+    tta: bool
 
-    def __init__(
-        self,
-        model_id: str | None = None,
-        nonlin_opt_method: str = "gauss_newton",
-        nonlin_opt_conf: dict | None = None,
-        init_with_sac: bool = False,
-        fallback_to_sac: bool = True,
-        ransac_conf: dict | None = None,
-        rm_borders: int = 0,
-        sample_size: int = -1,
-    ):
-        super().__init__()
+    def compute_fields(self, image: Tensor) -> dict[str, Tensor]:
+        raise NotImplementedError
 
-        self.backbone = DINOv2(model_name="dinov2_vitl14")
-        self.decoder = LightDPTDecoder(embed_dim=self.backbone.embed_dim)
-        self.head = ConvexTangentDecoder(in_channels=self.decoder.out_channels)
-        self.calibrator = Calibrator(
-            nonlin_opt_method=nonlin_opt_method,
-            nonlin_opt_conf=nonlin_opt_conf,
-            init_with_sac=init_with_sac,
-            fallback_to_sac=fallback_to_sac,
-            ransac_conf=ransac_conf,
-            rm_borders=rm_borders,
-            sample_size=sample_size,
-        )
+    def compute_fields_tta(self, image: Tensor) -> dict[str, Tensor]:
+        """Predict the fields of the images and of their flipped versions in a single
+        batch, and fuse them.
 
-        if model_id is not None:
-            # load pretrained weights
-            if model_id not in self.AVAILABLE_MODELS:
-                raise ValueError(
-                    f"Invalid model id: {model_id=}. Available models:\n\n".join(
-                        self.AVAILABLE_MODELS
-                    )
-                )
+        A horizontal flip of the image mirrors the field along the width and changes
+        the sign of the x-coordinates of the rays (and tangent coordinates), and
+        analogously for vertical flips.
 
-            url = f"https://github.com/javrtg/AnyCalib/releases/download/v1.0.0/{model_id}.pt"
-            model_dir = f"{torch.hub.get_dir()}/anycalib"
-            state_dict = torch.hub.load_state_dict_from_url(
-                url, model_dir, map_location="cpu", file_name=f"{model_id}.pt"
-            )
-            self.load_state_dict(state_dict, strict=True)
-            self.eval()
+        Args:
+            image: (B, 3, H, W) input image with RGB values in [0, 1].
+
+        Returns:
+            Dict with the (B, H*W, 3) rays, (B, H*W, 2) tangent_coords/fov_field and
+                their (B, H*W, 2) log_covs.
+        """
+        b, _, h, w = image.shape
+        flips = ((), (-1,), (-2,))  # none, horizontal, vertical
+        batch = torch.cat([image.flip(dims) if dims else image for dims in flips])
+        tcoords = self.compute_fields(batch)["tangent_coords"]
+        tcoords = tcoords.view(len(flips), b, h, w, 2).permute(0, 1, 4, 2, 3)
+        # undo the flips: (K, B, 2, H, W)
+        signs = tcoords.new_tensor([[1, 1], [-1, 1], [1, -1]])[:, None, :, None, None]
+        tcoords = torch.stack(
+            [t.flip(dims) if dims else t for t, dims in zip(tcoords, flips)]
+        )
+        tcoords, log_covs = fuse_tangent_fields(signs * tcoords)
+        tcoords = tcoords.permute(0, 2, 3, 1).reshape(b, h * w, 2)
+        return {
+            "rays": Unit3.expmap_at_z1(tcoords),
+            "tangent_coords": tcoords,
+            "fov_field": tcoords,
+            "log_covs": log_covs.permute(0, 2, 3, 1).reshape(b, h * w, 2),
+        }
 
     def forward(self, data):
         # get ray and FoV fields
-        out = self.backbone(data["image"])
-        out: dict[str, Tensor] = self.head(self.decoder(out))
-        # reshape to (B, H*W, {3, 2})
-        b, _, h, w = data["image"].shape
-        out["rays"] = out["rays"].permute(0, 2, 3, 1).view(b, h * w, 3)
-        out["tangent_coords"] = out["fov_field"] = (
-            out["tangent_coords"].permute(0, 2, 3, 1).view(b, h * w, 2)
-        )
+        out = self.compute_fields(data["image"])
         out |= self.calibrator(out, data)
         return out
 
     @torch.inference_mode()
-    def predict(self, im: Tensor, cam_id: str | list[str]) -> dict:
+    def predict(
+        self,
+        im: Tensor,
+        cam_id: str | list[str],
+        field_cache: RayFieldCache | None = None,
+        valid_mask: Tensor | None = None,
+    ) -> dict:
         """Single-view camera calibration
 
         Args:
             im: (B, 3, H, W) or (3, H, W) input image with RGB values in [0, 1].
             cam_id: string containing the camera id or list of string cam ids. If a
                 string, the same camera id is used for all images in the batch.
+            field_cache: optional on-disk cache of the predicted fields. If given, the
+                network is only run for images that are not already cached.
+            valid_mask: (B, H, W) or (H, W) boolean mask of the pixels whose rays are
+                used for calibration, e.g. those inside the image circle of a fisheye
+                lens (see `anycalib.image_circle`). Default: all pixels.
         """
         non_batched = im.dim() == 3
         if non_batched:
@@ -289,12 +372,13 @@ class AnyCalib(torch.nn.Module):
             cam_id = [cam_id] * im.shape[0]
         assert len(cam_id) == im.shape[0], f"{len(cam_id)=} != {im.shape[0]=}"
 
-        ho, wo = im.shape[-2:]
-        target_ar = max(self.AR_RANGE[0], min(ho / wo, self.AR_RANGE[1]))
-        target_size = self.compute_target_size(self.RESOLUTION, target_ar)
-
-        im, scale_xy, shift_xy = self.set_im_size(im, target_size)
-        pred = self.forward({"image": im, "cam_id": cam_id})
+        im, fields, scale_xy, shift_xy, target_size = self.predict_fields(
+            im, field_cache
+        )
+        data = {"image": im, "cam_id": cam_id}
+        if valid_mask is not None:
+            data["valid_mask"] = self.resize_mask(valid_mask, target_size)
+        pred = fields | self.calibrator(fields, data)
 
         # based on the initial resize, correct focal length and principal point
         for i, (intrins, cam_id_) in enumerate(zip(pred["intrinsics"], cam_id)):
@@ -307,14 +391,132 @@ class AnyCalib(torch.nn.Module):
         pred |= {"pred_size": target_size}
         return pred
 
+    @torch.inference_mode()
+    def predict_sweep(
+        self,
+        im: Tensor,
+        cam_ids: list[str] | tuple[str, ...] = DEFAULT_SWEEP_CAM_IDS,
+        criterion: str = "bic",
+        num_workers: int = 0,
+        field_cache: RayFieldCache | None = None,
+        valid_mask: Tensor | None = None,
+    ) -> dict:
+        """Single-view camera calibration with automatic selection of the camera model.
+
+        The fields are predicted once per image and all the candidate camera models are
+        fit to them in parallel. The fits are ranked by their (unweighted, non-robust)
+        l2 cost plus a complexity penalty given by `criterion`.
+
+        Args:
+            im: (B, 3, H, W) or (3, H, W) input image with RGB values in [0, 1].
+            cam_ids: identifiers of the candidate camera models.
+            criterion: 'bic' or 'aic'. Default: 'bic'.
+            num_workers: number of threads for fitting the candidates. Default (0): one
+                per candidate.
+            field_cache: optional on-disk cache of the predicted fields.
+            valid_mask: (B, H, W) or (H, W) boolean mask of the pixels whose rays are
+                used for calibration. Default: all pixels.
+
+        Returns:
+            Dict with the following key-value pairs (lists if the input is batched):
+                - intrinsics: (D,) intrinsics of the selected camera model.
+                - cam_id: identifier of the selected camera model.
+                - ranking: fits of all the candidates, sorted from best to worst. See
+                    `sweep_camera_models` in anycalib/model/model_selection.py.
+        """
+        non_batched = im.dim() == 3
+        if non_batched:
+            im = im.unsqueeze(0)
+
+        im, fields, scale_xy, shift_xy, target_size = self.predict_fields(
+            im, field_cache
+        )
+        if valid_mask is not None:
+            valid_mask = self.resize_mask(valid_mask, target_size)
+        rankings = []
+        for i in range(im.shape[0]):
+            fields_ = {k: fields[k][i : i + 1] for k in ("rays", "tangent_coords")}
+            ranking = sweep_camera_models(
+                self.calibrator,
+                fields_,
+                im[i : i + 1],
+                cam_ids,
+                criterion,
+                num_workers,
+                None if valid_mask is None else valid_mask[i : i + 1],
+            )
+            # based on the initial resize, correct focal length and principal point
+            for fit in ranking:
+                cam = CameraFactory.create_from_id(fit["cam_id"])
+                fit["intrinsics"] = cam.reverse_scale_and_shift(
+                    fit["intrinsics"], scale_xy, shift_xy
+                )
+            rankings.append(ranking)
+
+        pred = {
+            "intrinsics": [ranking[0]["intrinsics"] for ranking in rankings],
+            "cam_id": [ranking[0]["cam_id"] for ranking in rankings],
+            "ranking": rankings,
+        }
+        if non_batched:
+            pred = {k: v[0] for k, v in pred.items()}
+        pred |= {"pred_size": target_size}
+        return pred
+
+    def predict_fields(
+        self, im: Tensor, field_cache: RayFieldCache | None = None
+    ) -> tuple[Tensor, dict[str, Tensor], Tensor, Tensor, tuple[int, int]]:
+        """Resize the (B, 3, H, W) input image and predict its fields.
+
+        Returns:
+            (B, 3, H', W') resized image fed to the network.
+            Dict with the (B, H'*W', 3) rays and (B, H'*W', 2) tangent_coords/fov_field,
+                and, if used by the calibrator or with test-time augmentation, their
+                (B, H'*W', 2) log_covs.
+            (2,) scales and (2,) shifts for undoing the resizing on the intrinsics.
+            (H', W') target size.
+        """
+        ho, wo = im.shape[-2:]
+        target_ar = max(self.AR_RANGE[0], min(ho / wo, self.AR_RANGE[1]))
+        target_size = self.compute_target_size(self.RESOLUTION, target_ar)
+
+        im_orig = im
+        im, scale_xy, shift_xy = self.set_im_size(im, target_size)
+        compute_fields = self.compute_fields_tta if self.tta else self.compute_fields
+        if field_cache is None:
+            fields = compute_fields(im)
+        else:
+            fields = field_cache.get(
+                im_orig,
+                target_size,
+                lambda: compute_fields(im),
+                tag="tta" if self.tta else "",
+            )
+        if self.calibrator.uses_covs and "log_covs" not in fields:
+            b, (h, w) = im.shape[0], target_size
+            tcoords = fields["tangent_coords"].view(b, h, w, 2).permute(0, 3, 1, 2)
+            log_covs = field_spread_log_covs(tcoords)
+            fields["log_covs"] = log_covs.permute(0, 2, 3, 1).reshape(b, h * w, 2)
+        return im, fields, scale_xy, shift_xy, target_size
+
+    @classmethod
+    def resize_mask(cls, mask: Tensor, target_size: tuple[int, int]) -> Tensor:
+        """Transform a (B, H, W) or (H, W) boolean mask of the input image(s) to the
+        (B, *target_size) mask of the images fed to the network (see `set_im_size`).
+        """
+        mask = mask.reshape(-1, 1, *mask.shape[-2:]).float()
+        mask, _, _ = cls.set_im_size(mask, target_size)
+        return mask[:, 0] > 0.5
+
+    @classmethod
     def compute_target_size(
-        self, target_res: float, target_ar: float
+        cls, target_res: float, target_ar: float
     ) -> tuple[int, int]:
         """Compute the target image size given the target resolution and aspect ratio."""
         w = sqrt(target_res / target_ar)
         h = target_ar * w
         # closest image size satisfying `edge_divisible_by` constraint
-        div = self.EDGE_DIVISIBLE_BY
+        div = cls.EDGE_DIVISIBLE_BY
         target_size = (round(h / div) * div, round(w / div) * div)
         return target_size
 
@@ -396,6 +598,134 @@ class AnyCalib(torch.nn.Module):
         shift_xy = shift_xy * scale_2_xy
         return im, scale_xy, shift_xy
 
+
+class AnyCalib(AnyCalibBase, torch.nn.Module):
+    """AnyCalib class.
+
+    Args for instantiation:
+        model_id: one of {'anycalib_pinhole', 'anycalib_gen', 'anycalib_dist', 'anycalib_edit'}.
+            Each model differes in the type of images they seen during training:
+                * 'anycalib_pinhole': Perspective (pinhole) images,
+                * 'anycalib_gen': General images, including perspective, distorted and
+                    strongly distorted images, and
+                * 'anycalib_dist': Distorted images using the Brown-Conrady camera model
+                    and strongly distorted images, using the EUCM camera model,
+                * 'anycalib_edit': Trained on edited (stretched and cropped) perspective
+                    images.
+            Default: 'anycalib_pinhole'.
+        nonlin_opt_method: nonlinear optimization method: 'gauss_newton' or 'lev_mar'.
+            Default: 'gauss_newton'
+        nonlin_opt_conf: nonlinear optimization configuration.
+            This config can be used to control the number of iterations and the space
+            where the residuals are minimized. See the classes `GaussNewtonCalib` or
+            `LevMarCalib` under anycalib/optim for details. Default: None.
+        init_with_sac: use RANSAC instead of nonminimal fit for initializating the
+            intrinsics. Default: False.
+        fallback_to_sac: use RANSAC if nonminimal fit fails. Default: True.
+        ransac_conf: RANSAC configuration. This config can be used to control e.g. the
+            inlier threshold or the number of minimal samples to try. See the class
+            `RANSAC` in anycalib/ransac.py for details. Default: None.
+        rm_borders: border size of the dense FoV fields to ignore during fitting.
+            Default: 0.
+        sample_size: approximate number of 2D-3D correspondences to use for fitting the
+            intrinsics. Negative value -> no subsampling. Default: -1.
+        use_covs: estimate per-pixel covariances of the predicted tangent coordinates
+            from their local spread (see `field_spread_log_covs`) and use them to
+            weight the linear fit and the nonlinear refinement, and to guide the
+            RANSAC sampling. Default: False.
+        tta: test-time augmentation. The input images are predicted together with
+            their horizontally and vertically flipped versions in a single batch, and
+            the un-flipped fields are fused (see `fuse_tangent_fields`). The variance
+            of the fused field weights the calibration as with `use_covs`.
+            Default: False.
+        lut_size: if positive, the camera models whose (un)projection requires an
+            iterative solver (e.g. 'kb', 'radial' or 'division') use a lookup table
+            with this number of nodes during calibration. Default: 0 (exact solvers).
+        tile_rows: if positive, the convex upsampling of the head is computed in bands
+            of `tile_rows` rows of the decoder resolution to reduce the peak memory at
+            large input sizes (see `ConvexTangentDecoder`). Default: 0 (no tiling).
+    """
+
+    AVAILABLE_MODELS = {
+        "anycalib_pinhole",
+        "anycalib_dist",
+        "anycalib_gen",
+        "anycalib_edit",
+    }
+
+    def __init__(
+        self,
+        model_id: str | None = None,
+        nonlin_opt_method: str = "gauss_newton",
+        nonlin_opt_conf: dict | None = None,
+        init_with_sac: bool = False,
+        fallback_to_sac: bool = True,
+        ransac_conf: dict | None = None,
+        rm_borders: int = 0,
+        sample_size: int = -1,
+        use_covs: bool = False,
+        tta: bool = False,
+        lut_size: int = 0,
+        tile_rows: int = 0,
+    ):
+        super().__init__()
+
+        self.backbone = DINOv2(model_name="dinov2_vitl14")
+        self.decoder = LightDPTDecoder(embed_dim=self.backbone.embed_dim)
+        self.head = ConvexTangentDecoder(
+            in_channels=self.decoder.out_channels, tile_rows=tile_rows
+        )
+        self.calibrator = Calibrator(
+            nonlin_opt_method=nonlin_opt_method,
+            nonlin_opt_conf=nonlin_opt_conf,
+            init_with_sac=init_with_sac,
+            fallback_to_sac=fallback_to_sac,
+            ransac_conf=ransac_conf,
+            rm_borders=rm_borders,
+            sample_size=sample_size,
+            lin_with_covs=use_covs or tta,
+            nonlin_opt_w_covs=use_covs or tta,
+            cov_guided_sampling=use_covs or tta,
+            lut_size=lut_size,
+        )
+        self.tta = tta
+
+        if model_id is not None:
+            # load pretrained weights
+            if model_id not in self.AVAILABLE_MODELS:
+                raise ValueError(
+                    f"Invalid model id: {model_id=}. Available models:\n\n".join(
+                        self.AVAILABLE_MODELS
+                    )
+                )
+
+            url = f"https://github.com/javrtg/AnyCalib/releases/download/v1.0.0/{model_id}.pt"
+            model_dir = f"{torch.hub.get_dir()}/anycalib"
+            state_dict = torch.hub.load_state_dict_from_url(
+                url, model_dir, map_location="cpu", file_name=f"{model_id}.pt"
+            )
+            self.load_state_dict(state_dict, strict=True)
+            self.eval()
+
+    def compute_fields(self, image: Tensor) -> dict[str, Tensor]:
+        """Predict the ray and FoV fields.
+
+        Args:
+            image: (B, 3, H, W) input image with RGB values in [0, 1].
+
+        Returns:
+            Dict with the (B, H*W, 3) rays and (B, H*W, 2) tangent_coords/fov_field.
+        """
+        out = self.backbone(image)
+        out: dict[str, Tensor] = self.head(self.decoder(out))
+        # reshape to (B, H*W, {3, 2})
+        b, _, h, w = image.shape
+        out["rays"] = out["rays"].permute(0, 2, 3, 1).view(b, h * w, 3)
+        out["tangent_coords"] = out["fov_field"] = (
+            out["tangent_coords"].permute(0, 2, 3, 1).view(b, h * w, 2)
+        )
+        return out
+
     def load_weights_from_ckpt(self, ckpt_path: str) -> "AnyCalib":
         """Load model from training checkpoint."""
         assert ckpt_path.endswith(".tar")
@@ -2,9 +2,18 @@ import torch
 import torch.nn as nn
 from torch import Tensor
 
-from anycalib.model.vision_transformer import DinoVisionTransformer, vit_large
+from anycalib.model.vision_transformer import (
+    DinoVisionTransformer,
+    vit_large,
+    vit_small,
+)
 
 DINOV2_CFG = {
+    "dinov2_vits14": {
+        "embed_dim": 384,
+        "constructor": vit_small,
+        "out_index": [2, 5, 8, 11],
+    },
     "dinov2_vitl14": {
         "embed_dim": 1024,
         "constructor": vit_large,
@@ -0,0 +1,344 @@
+"""Export of the ray-field network to standalone TorchScript/ONNX artefacts.
+
+The exported graph contains the DINOv2 backbone, the `LightDPTDecoder` and the
+`ConvexTangentDecoder`, i.e. it maps a (B, 3, H, W) image (RGB values in [0, 1]) to the
+(B, 3, H, W) ray and (B, 2, H, W) tangent-coordinate fields. H and W are dynamic (they
+only need to be divisible by 14). The intrinsics are then fitted outside of the graph
+with the usual `Calibrator` (see `ExportedAnyCalib`).
+
+Usage:
+    python -m anycalib.model.export --model_id anycalib_dist -o anycalib_dist.onnx
+    python -m anycalib.model.export --model_id anycalib_dist -o anycalib_dist.pt
+"""
+
+import argparse
+import os
+from math import sqrt
+
+import torch
+import torch.nn as nn
+from torch import Tensor
+
+from anycalib.model.anycalib_pretrained import AnyCalib, AnyCalibBase, Calibrator
+from anycalib.model.dinov2 import DINOv2
+from anycalib.model.dinov2_layers import attention, block
+from anycalib.model.dpt_light_decoder import LightDPTDecoder
+from anycalib.model.ray_decoder import ConvexTangentDecoder
+
+EXPORT_FORMATS = {".onnx": "onnx", ".pt": "torchscript", ".ts": "torchscript"}
+
+
+def bicubic_weights(n_out: Tensor | int, n_in: int, offset: float) -> Tensor:
+    """Matrix form of the 1D bicubic interpolation used by `F.interpolate`.
+
+    Reproduces `F.interpolate(..., mode="bicubic", align_corners=False)` when called
+    with `scale_factor=(n_out + offset) / n_in`, as done by DINOv2 to interpolate the
+    positional embeddings. Unlike `F.interpolate`, the scale factor is here computed
+    from traced sizes, so the interpolation remains dynamic in the exported graphs.
+
+    Args:
+        n_out: number of output samples. It may be a traced size.
+        n_in: number of input samples.
+        offset: offset added to `n_out` to obtain the scale factor.
+
+    Returns:
+        (n_out, n_in) interpolation matrix.
+    """
+    a = -0.75  # same coefficient as in PyTorch
+    i = torch.arange(n_out, dtype=torch.float64)
+    src = (i + 0.5) * (n_in / (n_out + offset)) - 0.5
+    src0 = torch.floor(src)
+    t = (src - src0).unsqueeze(-1) + torch.arange(1, -3, -1, dtype=torch.float64)
+    t = t.abs()  # distances to the 4 neighbouring samples
+    w_near = ((a + 2) * t - (a + 3)) * t * t + 1  # |t| <= 1
+    w_far = ((a * t - 5 * a) * t + 8 * a) * t - 4 * a  # 1 < |t| < 2
+    w = torch.where(t <= 1, w_near, w_far)  # (n_out, 4)
+    idx = (src0.long().unsqueeze(-1) + torch.arange(-1, 3)).clamp(0, n_in - 1)
+    onehot = idx.unsqueeze(-1) == torch.arange(n_in)  # (n_out, 4, n_in)
+    return (w.unsqueeze(-1) * onehot).sum(-2).float()
+
+
+class RayFieldNet(nn.Module):
+    """Ray-field network (backbone + decoder + head) in an export-friendly form.
+
+    The forward pass is numerically equivalent to the one of `AnyCalib` prior to the
+    calibration step, but it avoids the shape-dependent Python logic of DINOv2 (the
+    interpolation of positional embeddings), so that traced graphs admit dynamic H/W.
+
+    Args:
+        backbone: DINOv2 backbone.
+        decoder: DPT decoder.
+        head: ray/tangent-coordinates decoder.
+    """
+
+    def __init__(
+        self, backbone: DINOv2, decoder: LightDPTDecoder, head: ConvexTangentDecoder
+    ):
+        super().__init__()
+        if backbone.with_registers:
+            # DINOv2 itself does not support them yet (see `DINOv2.__init__`)
+            raise ValueError(
+                "Backbones with register tokens cannot be exported: their positional "
+                "embeddings are interpolated with antialiasing, which `bicubic_weights` "
+                "does not reproduce, and `backbone_forward` does not insert the register "
+                "tokens nor strip them from the outputs."
+            )
+        self.backbone = backbone
+        self.decoder = decoder
+        self.head = head
+
+    @classmethod
+    def from_anycalib(cls, model: AnyCalib) -> "RayFieldNet":
+        return cls(model.backbone, model.decoder, model.head)
+
+    def pos_encoding(self, h0: int, w0: int) -> Tensor:
+        """Positional embeddings for a grid of (h0, w0) patches.
+
+        Args:
+            h0: number of patches along the vertical axis.
+            w0: number of patches along the horizontal axis.
+
+        Returns:
+            (1, 1 + h0*w0, embed_dim) positional embeddings.
+        """
+        vit = self.backbone.model
+        pos_embed = vit.pos_embed.float()
+        m = round(sqrt(pos_embed.shape[1] - 1))
+        offset = vit.interpolate_offset
+        patch_pos_embed = pos_embed[0, 1:].reshape(m, m, -1)
+        wy = bicubic_weights(h0, m, offset).to(pos_embed.device)
+        wx = bicubic_weights(w0, m, offset).to(pos_embed.device)
+        patch_pos_embed = torch.einsum("ia,jb,abc->ijc", wy, wx, patch_pos_embed)
+        return torch.cat(
+            (pos_embed[:, :1], patch_pos_embed.reshape(1, -1, pos_embed.shape[-1])),
+            dim=1,
+        ).to(vit.pos_embed.dtype)
+
+    def backbone_forward(self, image: Tensor) -> dict[str, list[Tensor]]:
+        """Same as `DINOv2.forward` but with traceable positional embeddings."""
+        backbone, vit = self.backbone, self.backbone.model
+        b, _, h, w = image.shape
+        p = backbone.patch_size
+        x = (image - backbone.image_mean) / backbone.image_std
+        x = vit.patch_embed(x)
+        x = torch.cat((vit.cls_token.expand(x.shape[0], -1, -1), x), dim=1)
+        x = x + self.pos_encoding(h // p, w // p)
+
+        outputs: list[Tensor] = []
+        for i, blk in enumerate(vit.blocks):
+            x = blk(x)
+            if i in backbone.out_index:
+                outputs.append(x)
+        if backbone.norm_layer:
+            outputs = [vit.norm(out) for out in outputs]
+        outputs = [
+            out[:, 1:]
+            .reshape(b, h // p, w // p, backbone.embed_dim)
+            .permute(0, 3, 1, 2)
+            .contiguous()
+            for out in outputs
+        ]
+        return {"outputs": outputs}
+
+    def forward(self, image: Tensor) -> tuple[Tensor, Tensor]:
+        """Predict the ray and tangent-coordinate fields.
+
+        Args:
+            image: (B, 3, H, W) input image with RGB values in [0, 1].
+
+        Returns:
+            (B, 3, H, W) rays.
+            (B, 2, H, W) tangent coordinates at (0, 0, 1).
+        """
+        out = self.head(self.decoder(self.backbone_forward(image)))
+        return out["rays"], out["tangent_coords"]
+
+
+class _NoXFormers:
+    """Context manager for tracing the graph with the pure PyTorch attention."""
+
+    def __enter__(self):
+        self.prev = attention.XFORMERS_AVAILABLE, block.XFORMERS_AVAILABLE
+        attention.XFORMERS_AVAILABLE = block.XFORMERS_AVAILABLE = False
+
+    def __exit__(self, *args):
+        attention.XFORMERS_AVAILABLE, block.XFORMERS_AVAILABLE = self.prev
+
+
+def export_ray_field(
+    model: AnyCalib | RayFieldNet,
+    path: str,
+    fmt: str | None = None,
+    example_size: tuple[int, int] | None = None,
+    opset_version: int = 17,
+) -> str:
+    """Export the ray-field network of AnyCalib to TorchScript or ONNX.
+
+    Args:
+        model: AnyCalib model or its `RayFieldNet`.
+        path: output path of the exported artefact.
+        fmt: "onnx" or "torchscript". If None, it is inferred from the extension of
+            `path` (.onnx -> onnx, .pt/.ts -> torchscript).
+        example_size: (H, W) size of the example input used for tracing. Sizes are
+            dynamic in the exported graph, so this only affects tracing. By default,
+            the size corresponding to the training resolution and a 1:1 aspect ratio.
+        opset_version: ONNX opset version.
+
+    Returns:
+        Path of the exported artefact.
+    """
+    fmt = fmt or EXPORT_FORMATS.get(os.path.splitext(path)[1])
+    if fmt not in ("onnx", "torchscript"):
+        raise ValueError(
+            f"Unknown export format {fmt=}. Use 'onnx' or 'torchscript' (or a path "
+            f"with one of the extensions: {list(EXPORT_FORMATS)})."
+        )
+    net = model if isinstance(model, RayFieldNet) else RayFieldNet.from_anycalib(model)
+    net = net.eval()
+    if example_size is None:
+        example_size = AnyCalib.compute_target_size(AnyCalib.RESOLUTION, 1.0)
+    param = next(net.parameters())
+    example = torch.rand(1, 3, *example_size, device=param.device, dtype=param.dtype)
+
+    with _NoXFormers(), torch.no_grad():
+        if fmt == "torchscript":
+            traced = torch.jit.trace(net, example, check_trace=False)
+            traced = torch.jit.freeze(traced)
+            torch.jit.save(traced, path)
+        else:
+            dyn = {0: "batch", 2: "height", 3: "width"}
+            torch.onnx.export(
+                net,
+                (example,),
+                path,
+                input_names=["image"],
+                output_names=["rays", "tangent_coords"],
+                dynamic_axes={"image": dyn, "rays": dyn, "tangent_coords": dyn},
+                opset_version=opset_version,
+                dynamo=False,
+            )
+    return path
+
+
+class ExportedAnyCalib(AnyCalibBase):
+    """AnyCalib inference with an exported ray-field network.
+
+    This class shares the `predict` API of `AnyCalib` (see `AnyCalibBase`) but,
+    instead of instantiating the network and downloading its weights, it runs an
+    artefact exported with `export_ray_field`. ONNX artefacts are run with ONNX Runtime
+    (which must be installed), and TorchScript artefacts with `torch.jit`.
+
+    Args:
+        path: path to the exported artefact (.onnx, .pt or .ts).
+        device: device where the fields are returned and the calibration takes place.
+        providers: ONNX Runtime execution providers. Default: ["CPUExecutionProvider"].
+        num_threads: number of intra-op threads for ONNX Runtime. Default (0): ONNX
+            Runtime's default.
+        tta: test-time augmentation with flipped images, see `AnyCalib`.
+        calib_kwargs: arguments for the `Calibrator`, see `AnyCalib` for details.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        device: str | torch.device = "cpu",
+        providers: list[str] | None = None,
+        num_threads: int = 0,
+        tta: bool = False,
+        **calib_kwargs,
+    ):
+        self.path = path
+        self.tta = tta
+        self.device = torch.device(device)
+        self.fmt = EXPORT_FORMATS.get(os.path.splitext(path)[1])
+        if self.fmt == "onnx":
+            import onnxruntime as ort
+
+            opts = ort.SessionOptions()
+            opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            opts.intra_op_num_threads = num_threads
+            self.session = ort.InferenceSession(
+                path, opts, providers=providers or ["CPUExecutionProvider"]
+            )
+        elif self.fmt == "torchscript":
+            self.net = torch.jit.load(path, map_location=self.device).eval()
+        else:
+            raise ValueError(f"Unknown format of the exported artefact: {path}")
+        # same defaults as AnyCalib
+        defaults = {"fallback_to_sac": True}
+        if tta:
+            defaults |= dict.fromkeys(
+                ("lin_with_covs", "nonlin_opt_w_covs", "cov_guided_sampling"), True
+            )
+        self.calibrator = Calibrator(**(defaults | calib_kwargs))
+
+    def ray_field(self, image: Tensor) -> tuple[Tensor, Tensor]:
+        """Run the exported network.
+
+        Args:
+            image: (B, 3, H, W) input image with RGB values in [0, 1].
+
+        Returns:
+            (B, 3, H, W) rays.
+            (B, 2, H, W) tangent coordinates at (0, 0, 1).
+        """
+        if self.fmt == "torchscript":
+            return self.net(image.to(self.device))
+        im = image.detach().float().cpu().numpy()
+        rays, tcoords = self.session.run(None, {"image": im})
+        return (
+            torch.from_numpy(rays).to(self.device),
+            torch.from_numpy(tcoords).to(self.device),
+        )
+
+    def compute_fields(self, image: Tensor) -> dict[str, Tensor]:
+        rays, tangent_coords = self.ray_field(image)
+        # reshape to (B, H*W, {3, 2})
+        b, _, h, w = image.shape
+        out = {
+            "rays": rays.permute(0, 2, 3, 1).reshape(b, h * w, 3),
+            "tangent_coords": tangent_coords.permute(0, 2, 3, 1).reshape(b, h * w, 2),
+        }
+        out["fov_field"] = out["tangent_coords"]
+        return out
+
+    def __call__(self, data: dict) -> dict:
+        return self.forward(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export the ray-field network of AnyCalib to ONNX/TorchScript."
+    )
+    parser.add_argument("--model_id", type=str, default="anycalib_pinhole")
+    parser.add_argument("--ckpt", type=str, default=None, help="Training checkpoint.")
+    parser.add_argument("-o", "--output", type=str, required=True)
+    parser.add_argument("--format", type=str, default=None, help="onnx/torchscript")
+    parser.add_argument("--size", type=int, nargs=2, default=None, metavar=("H", "W"))
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--check", action="store_true", help="Check parity.")
+    args = parser.parse_args()
+
+    if args.ckpt is None:
+        model = AnyCalib(model_id=args.model_id)
+    else:
+        model = AnyCalib().load_weights_from_ckpt(args.ckpt)
+    model.eval()
+    path = export_ray_field(model, args.output, args.format, args.size, args.opset)
+    print(f"Exported ray-field network to: {path}")
+
+    if args.check:
+        # parity w.r.t. the PyTorch model at a size different from the traced one
+        size = AnyCalib.compute_target_size(AnyCalib.RESOLUTION, 0.75)
+        im = torch.rand(1, 3, *size)
+        with torch.no_grad():
+            ref = model.head(model.decoder(model.backbone(im)))
+        rays, tcoords = ExportedAnyCalib(path).ray_field(im)
+        print(
+            f"Max abs. diff. at {size=}: rays={(rays - ref['rays']).abs().max():.2e}, "
+            f"tangent_coords={(tcoords - ref['tangent_coords']).abs().max():.2e}"
+        )
+
+
+if __name__ == "__main__":
+    main()
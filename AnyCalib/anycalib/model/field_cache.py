@@ -0,0 +1,94 @@
+import hashlib
+import os
+from typing import Callable
+
+import torch
+from torch import Tensor
+
+
+class RayFieldCache:
+    """On-disk cache of the ray and tangent-coordinate fields predicted by AnyCalib.
+
+    The network forward pass is by far the most expensive part of `AnyCalib.predict`,
+    but it only depends on the image, the network weights and the inference size.
+    Caching its output allows to re-run only the `Calibrator` when experimenting with
+    different camera models or optimization settings for the same images.
+
+    Entries are keyed by a hash of the image content, the model id and the inference
+    size (and an optional tag, e.g. for fields fused from test-time augmentations).
+    Since the weights are only identified by `model_id`, a different id must be
+    used e.g. for weights loaded from a training checkpoint.
+
+    Args:
+        cache_dir: directory where the fields are stored.
+        model_id: identifier of the network weights used to predict the fields.
+    """
+
+    def __init__(self, cache_dir: str, model_id: str):
+        self.cache_dir = cache_dir
+        self.model_id = model_id
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def hash_image(im: Tensor) -> str:
+        """Hash of the content, shape and dtype of an image tensor."""
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f"{tuple(im.shape)}{im.dtype}".encode())
+        h.update(im.detach().cpu().contiguous().view(torch.uint8).numpy().data)
+        return h.hexdigest()
+
+    def path(self, im_hash: str, size: tuple[int, int], tag: str = "") -> str:
+        """Path of the entry corresponding to an image hash and inference size."""
+        tag = f"_{tag}" if tag else ""
+        name = f"{self.model_id}_{im_hash}_{size[0]}x{size[1]}{tag}.pt"
+        return os.path.join(self.cache_dir, name)
+
+    def load(self, path: str, device: torch.device) -> dict[str, Tensor] | None:
+        if not os.path.exists(path):
+            return None
+        try:
+            fields = torch.load(path, map_location=device, weights_only=True)
+        except Exception as e:  # e.g. truncated file
+            print(f"WARNING: Could not load cached fields from {path}: {e}")
+            return None
+        fields["fov_field"] = fields["tangent_coords"]
+        return fields
+
+    def save(self, path: str, fields: dict[str, Tensor]):
+        to_save = {
+            k: fields[k].cpu()
+            for k in ("rays", "tangent_coords", "log_covs")
+            if k in fields
+        }
+        # write to a temporary file first so that interrupted writes are not reused
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        torch.save(to_save, tmp_path)
+        os.replace(tmp_path, path)
+
+    def get(
+        self,
+        im: Tensor,
+        size: tuple[int, int],
+        compute_fields: Callable[[], dict[str, Tensor]],
+        tag: str = "",
+    ) -> dict[str, Tensor]:
+        """Load the fields of an image or compute and store them if not cached.
+
+        Args:
+            im: image used for computing the hash of the entry. It is recommended to
+                pass the original image, before resizing, to avoid hashing resampled
+                values.
+            size: (H, W) inference size.
+            compute_fields: function returning the fields when they are not cached.
+            tag: identifier of how the fields are computed, e.g. "tta".
+
+        Returns:
+            Dict with the (B, H*W, 3) rays and (B, H*W, 2) tangent_coords/fov_field
+                (and log_covs if returned by `compute_fields`).
+        """
+        path = self.path(self.hash_image(im), size, tag)
+        fields = self.load(path, im.device)
+        if fields is None:
+            fields = compute_fields()
+            self.save(path, fields)
+        return fields
@@ -0,0 +1,133 @@
+from concurrent.futures import ThreadPoolExecutor
+from math import log
+
+import torch
+from torch import Tensor
+
+# candidate camera models of the sweep
+DEFAULT_SWEEP_CAM_IDS = (
+    "kb:1",
+    "kb:2",
+    "kb:3",
+    "kb:4",
+    "ucm",
+    "eucm",
+    "division:1",
+    "division:2",
+    "division:3",
+    "radial:1",
+    "radial:2",
+    "radial:3",
+)
+
+
+def information_criterion(
+    cost: float, num_params: int, num_obs: int, criterion: str = "bic"
+) -> float:
+    """Information criterion of a fit assuming i.i.d. Gaussian residuals.
+
+    The criterion is only valid for, and comparable across models with, the plain l2
+    cost. Costs of robust losses or weighted with covariances are not Gaussian
+    log-likelihoods: use the `l2_cost` output of the `Calibrator` instead (see its
+    `return_l2_cost` argument).
+
+    Args:
+        cost: mean squared (2D) residual of the fit, without weights nor robust loss.
+        num_params: number of intrinsic parameters of the camera model.
+        num_obs: number of scalar residuals.
+        criterion: 'bic' (Bayesian) or 'aic' (Akaike).
+
+    Returns:
+        Value of the criterion (lower is better), up to an additive constant.
+    """
+    if not cost > 0:  # nan, inf or a perfect fit
+        return float("inf") if cost != 0 else float("-inf")
+    # log-likelihood term: n log(RSS / n), with RSS / n = cost / 2 (2D residuals)
+    fit_term = num_obs * log(0.5 * cost)
+    if criterion == "bic":
+        return fit_term + num_params * log(num_obs)
+    if criterion == "aic":
+        return fit_term + 2 * num_params
+    raise ValueError(
+        f"`criterion` must be 'bic' or 'aic'. However, got: '{criterion}'."
+    )
+
+
+def sweep_camera_models(
+    calibrator,
+    fields: dict[str, Tensor],
+    image: Tensor,
+    cam_ids: list[str] | tuple[str, ...] = DEFAULT_SWEEP_CAM_IDS,
+    criterion: str = "bic",
+    num_workers: int = 0,
+    valid_mask: Tensor | None = None,
+) -> list[dict]:
+    """Fit several camera models to the fields of a single image and rank them.
+
+    Since the predicted fields are camera-model agnostic, all the candidates are fit
+    to the output of the same forward pass. The fits are independent and dominated by
+    PyTorch kernels, which release the GIL, so they are run in a thread pool. The
+    fits are ranked with the unweighted l2 cost of the fitted intrinsics, even if the
+    calibrator minimizes a robust or covariance-weighted cost.
+
+    Args:
+        calibrator: `Calibrator` instance used for fitting each model.
+        fields: dict with the (1, H*W, 3) rays and (1, H*W, 2) tangent_coords.
+        image: (1, 3, H, W) image for which the fields were predicted.
+        cam_ids: identifiers of the candidate camera models.
+        criterion: 'bic' or 'aic', used for ranking the fits.
+        num_workers: number of threads. Default (0): one per candidate.
+        valid_mask: (1, H, W) boolean mask of the pixels used for fitting.
+
+    Returns:
+        List with one dict per candidate, sorted from best to worst, with keys:
+            - cam_id: camera model identifier.
+            - intrinsics: (D,) fitted intrinsics, at the resolution of `image`.
+            - success: whether the fit succeeded.
+            - cost: final cost of the nonlinear optimization.
+            - l2_cost: unweighted, non-robust cost, used for the criterion.
+            - score: value of the information criterion.
+    """
+    assert image.shape[0] == 1, "Model selection is done independently per image."
+    _, _, h, w = image.shape
+    border = calibrator.rm_borders
+    if valid_mask is None:
+        num_pixels = (h - 2 * border) * (w - 2 * border)
+    else:
+        num_pixels = int(
+            valid_mask[..., border : h - border, border : w - border].sum()
+        )
+    # each (2D) residual contributes with two scalar observations
+    num_obs = 2 * num_pixels
+    data = {"image": image}
+    if valid_mask is not None:
+        data["valid_mask"] = valid_mask
+
+    def fit(cam_id: str) -> dict:
+        out = calibrator(fields, data | {"cam_id": [cam_id]}, return_l2_cost=True)
+        intrinsics, l2_cost = out["intrinsics"][0], out["l2_cost"][0].item()
+        return {
+            "cam_id": cam_id,
+            "intrinsics": intrinsics,
+            "success": bool(out["success"][0]),
+            "cost": out["cost"][0].item(),
+            "l2_cost": l2_cost,
+            "score": information_criterion(
+                l2_cost, intrinsics.shape[-1], num_obs, criterion
+            ),
+        }
+
+    num_workers = len(cam_ids) if num_workers <= 0 else num_workers
+    if num_workers == 1:
+        fits = [fit(cam_id) for cam_id in cam_ids]
+    else:
+        # inference mode is thread-local
+        inference = torch.is_inference_mode_enabled()
+
+        def fit_in_thread(cam_id: str) -> dict:
+            with torch.inference_mode(inference):
+                return fit(cam_id)
+
+        with ThreadPoolExecutor(min(num_workers, len(cam_ids))) as pool:
+            fits = list(pool.map(fit_in_thread, cam_ids))
+    return sorted(fits, key=lambda f: f["score"])
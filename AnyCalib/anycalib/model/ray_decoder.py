@@ -1,3 +1,5 @@
+from typing import Callable
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -6,6 +8,28 @@ from torch import Tensor
 from anycalib.manifolds import Unit3
 
 
+def convex_combination(mask: Tensor, up_x: Tensor) -> Tensor:
+    """Convex combination of the 3x3 neighbours: sum_i mask_i * up_x_i.
+
+    The 9 terms are accumulated sequentially, in a fixed order, instead of with
+    `torch.sum`, whose summation order depends on the layout and size of the reduced
+    tensor. This makes each output element independent of the extent of the processed
+    tensors, i.e. the result of the tiled upsampling does not depend on the size of the
+    bands. It also avoids materializing the (N, C, 9, k, k, H, W) product.
+
+    Args:
+        mask: (N, 1, 9, k, k, H', W') already softmaxed mask tensor.
+        up_x: (N, C, 9, 1, 1, H', W') unfolded input tensor.
+
+    Returns:
+        (N, C, k, k, H', W') convex combinations.
+    """
+    out = mask[:, :, 0] * up_x[:, :, 0]
+    for i in range(1, 9):
+        out = out + mask[:, :, i] * up_x[:, :, i]
+    return out
+
+
 def cvx_upsample(x: Tensor, mask: Tensor, up_factor: int = 7) -> Tensor:
     """Upsample [H/k, W/k, C] -> [H, W, C] using convex combination of 3x3 patches.
 
@@ -25,6 +49,122 @@ def cvx_upsample(x: Tensor, mask: Tensor, up_factor: int = 7) -> Tensor:
     return up_x.reshape(N, C, up_factor * H, up_factor * W)
 
 
+def cvx_upsample_tiled(
+    x: Tensor,
+    mask: Tensor | Callable[[int, int], Tensor],
+    up_factor: int = 7,
+    band_rows: int = 8,
+) -> Tensor:
+    """Memory-bounded version of `cvx_upsample` processing bands of rows.
+
+    The convex combinations are computed for bands of `band_rows` (low resolution)
+    rows and directly written into the output. If the mask is given as a function of
+    the rows of the band, the only full-size intermediate tensor is the output. The
+    result does not depend on `band_rows` and matches the one of `cvx_upsample` up to
+    floating point rounding (see `convex_combination`).
+
+    Args:
+        x: (N, C, H, W) input tensor
+        mask: (N, 1, 9, k, k, H, W) already softmaxed mask tensor, or function
+            returning its rows [r0, r1) given (r0, r1).
+        up_factor: upsample factor
+        band_rows: number of rows of `x` processed at once.
+    """
+    assert band_rows > 0, f"`band_rows` must be positive, got {band_rows=}."
+    N, C, H, W = x.shape
+    up_x = F.unfold(x, (3, 3), padding=1)
+    up_x = up_x.view(N, C, 9, 1, 1, H, W)
+    get_mask = mask if callable(mask) else lambda r0, r1: mask[..., r0:r1, :]
+    out = None
+    for r0 in range(0, H, band_rows):
+        r1 = min(r0 + band_rows, H)
+        band = convex_combination(get_mask(r0, r1), up_x[..., r0:r1, :])
+        if out is None:
+            out = x.new_empty((N, C, H, up_factor, W, up_factor), dtype=band.dtype)
+        out[:, :, r0:r1] = band.permute(0, 1, 4, 2, 5, 3)
+    return out.view(N, C, up_factor * H, up_factor * W)
+
+
+def savgol_weights(size: int, dtype: torch.dtype, device: torch.device) -> Tensor:
+    """Weights of the (1-D) Savitzky-Golay filter that evaluates, at the center of a
+    window of `size` samples, the least-squares quadratic fit to them. By symmetry,
+    the fit is also exact for cubic signals."""
+    x = torch.arange(size, dtype=torch.float64) - size // 2
+    A = torch.stack((torch.ones_like(x), x, x**2), dim=-1)
+    return torch.linalg.pinv(A)[0].to(dtype=dtype, device=device)
+
+
+def field_spread_log_covs(
+    tangent_coords: Tensor, kernel_size: int = 7, min_std: float = 1e-3
+) -> Tensor:
+    """Per-pixel covariances of the tangent coordinates from their local spread.
+
+    The predicted tangent field is smooth for any central camera, but it is curved for
+    distorted ones, so its local spread is measured as the residual against a smooth
+    model fitted locally: at each pixel, a polynomial of degree 3 in each image axis is
+    fitted by least squares to the `kernel_size` x `kernel_size` window around it
+    (a separable Savitzky-Golay filter). The residual of a noise-free field is then
+    given by its (negligible) 4th-order derivatives, regardless of its curvature.
+    For i.i.d. errors with variance σ^2, the variance of the residual is
+    σ^2 (1 - s_c^2), with s_c the central weight of the 1-D filter, so σ^2 is
+    estimated as the local mean of the squared residuals, over windows of
+    `kernel_size` pixels, divided by (1 - s_c^2). The default window matches the
+    upsampling factor of `ConvexTangentDecoder`, i.e. the resolution at which the
+    field is actually predicted. Pixels closer than `kernel_size // 2` to the borders
+    take the covariances of the closest pixel with a full window.
+
+    Args:
+        tangent_coords: (B, 2, H, W) tangent coordinates at (0, 0, 1).
+        kernel_size: size of the fitting and averaging windows (odd).
+        min_std: lower bound of the standard deviations, to avoid overconfident weights
+            in perfectly smooth regions.
+
+    Returns:
+        (B, 2, H, W) logarithm of the diagonal elements of the covariances.
+    """
+    assert kernel_size % 2 == 1, f"`kernel_size` must be odd, got {kernel_size=}."
+    B, C, H, W = tangent_coords.shape
+    assert min(H, W) >= kernel_size, f"Field smaller than {kernel_size=}: {H=}, {W=}."
+    pad = kernel_size // 2
+    s = savgol_weights(kernel_size, tangent_coords.dtype, tangent_coords.device)
+    t = tangent_coords.reshape(B * C, 1, H, W)
+    smooth = F.conv2d(F.conv2d(t, s.view(1, 1, 1, -1)), s.view(1, 1, -1, 1))
+    res = t[..., pad:-pad, pad:-pad] - smooth if pad > 0 else t - smooth
+    var = F.avg_pool2d(
+        res**2, kernel_size, stride=1, padding=pad, count_include_pad=False
+    )
+    var = F.pad(var, (pad,) * 4, mode="replicate").view(B, C, H, W)
+    return (var / (1 - s[pad] ** 2)).clamp(min=min_std**2).log()
+
+
+def fuse_tangent_fields(
+    tangent_coords: Tensor, min_std: float = 1e-3
+) -> tuple[Tensor, Tensor]:
+    """Fuse several predictions of the same tangent field, e.g. from test-time
+    augmentations, into a single field and its per-pixel variance.
+
+    Each prediction is weighted by the inverse of its local variance (see
+    `field_spread_log_covs`). The variance of the fused field is that of the weighted
+    mean plus the weighted variance of the predictions around it, so that pixels
+    where the predictions disagree are down-weighted even if each of them is smooth.
+
+    Args:
+        tangent_coords: (K, B, 2, H, W) K predictions of the tangent coordinates.
+        min_std: lower bound of the standard deviations.
+
+    Returns:
+        (B, 2, H, W) fused tangent coordinates.
+        (B, 2, H, W) logarithm of the diagonal elements of their covariances.
+    """
+    log_var = field_spread_log_covs(tangent_coords.flatten(0, 1), min_std=min_std)
+    weights = torch.exp(-log_var.view_as(tangent_coords))
+    weights_sum = weights.sum(0)
+    fused = (weights * tangent_coords).sum(0) / weights_sum
+    spread = (weights * (tangent_coords - fused) ** 2).sum(0) / weights_sum
+    var = 1 / weights_sum + spread
+    return fused, var.clamp(min=min_std**2).log()
+
+
 class ConvexTangentDecoder(nn.Module):
     """Convex Tangent Coordinates Decoder.
 
@@ -35,12 +175,17 @@ class ConvexTangentDecoder(nn.Module):
     Args:
         in_channels: number of input channels
         up_factor: upsampling factor
+        tile_rows: if positive, the upsampling weights and the convex upsampling are
+            computed in bands of `tile_rows` rows (of the input resolution) to reduce
+            the peak memory at large resolutions. The output matches the non-tiled one
+            up to floating point rounding.
     """
 
-    def __init__(self, in_channels: int = 256, up_factor: int = 7):
+    def __init__(self, in_channels: int = 256, up_factor: int = 7, tile_rows: int = 0):
         super().__init__()
         self.in_channels = in_channels
         self.up_factor = up_factor
+        self.tile_rows = tile_rows
 
         # tangent head
         self.tangent_head = nn.Sequential(
@@ -59,12 +204,30 @@ class ConvexTangentDecoder(nn.Module):
             nn.Softmax(dim=2),
         )
 
+    def band_upsampling_weights(self, x: Tensor, r0: int, r1: int) -> Tensor:
+        """Upsampling weights of the rows [r0, r1) of the (B, C, H/7, W/7) features.
+
+        The weights head is run on the band plus a halo of one row on each side,
+        needed by its 3x3 convolution.
+        """
+        start, end = max(r0 - 1, 0), min(r1 + 1, x.shape[-2])
+        weights = self.upsampling_weights_head(x[..., start:end, :])
+        return weights[..., r0 - start : r1 - start, :]
+
     def forward(self, x: Tensor) -> dict[str, Tensor | float]:
         # head
         tangent_pred = self.tangent_head(x)  # (B, 5, H/7, W/7)
-        weights = self.upsampling_weights_head(x)
         # upsample
-        tangent_pred = cvx_upsample(tangent_pred, weights, self.up_factor)
+        if self.tile_rows > 0:
+            tangent_pred = cvx_upsample_tiled(
+                tangent_pred,
+                lambda r0, r1: self.band_upsampling_weights(x, r0, r1),
+                self.up_factor,
+                self.tile_rows,
+            )
+        else:
+            weights = self.upsampling_weights_head(x)
+            tangent_pred = cvx_upsample(tangent_pred, weights, self.up_factor)
         # postprocess
         tangent_coords = tangent_pred[:, :2]
         rays = Unit3.expmap_at_z1(tangent_coords.permute(0, 2, 3, 1)).permute(
@@ -1,9 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import torch
 from torch import Tensor
 
 from anycalib import utils as ut
 from anycalib.cameras.base import BaseCamera
 from anycalib.manifolds import Unit3
+from anycalib.optim.robust import ROBUST_LOSSES, robust_loss
 
 
 def expand_updates(delta: Tensor, optim_idx: list[int] | None, dim: int) -> Tensor:
@@ -16,12 +19,40 @@ def expand_updates(delta: Tensor, optim_idx: list[int] | None, dim: int) -> Tens
 
 
 class GaussNewtonCalib:
-    """Gauss-Newton nonlinear optimization for single-view camera calibration."""
+    """Gauss-Newton nonlinear optimization for single-view camera calibration.
+
+    By default, the residuals and (..., N, 2, D) Jacobians of all the correspondences
+    are materialized on each iteration. If `chunk_size` > 0, the correspondences are
+    instead processed in chunks of this size, and only the (..., D, D) normal matrix,
+    the (..., D) gradient and the cost are accumulated, optionally across a pool of
+    `num_threads` threads. This bounds the peak memory and keeps the working set in
+    cache, at the expense of not supporting the 'qr' solver.
+
+    The iterations of each batch element stop, i.e. its parameters are no longer
+    updated, once it meets any of the enabled (> 0) stopping criteria:
+        - `cost_rtol`: the cost decreases by less than `cost_rtol * cost`.
+        - `step_tol`: ||Δ|| < step_tol * (||params|| + step_tol).
+        - `grad_tol`: the infinity norm of the gradient of the cost is below `grad_tol`.
+    The optimization ends when all elements have converged or after `max_iters`.
+
+    Outlying rays can be downweighted with the robust `loss` "huber", "cauchy" or
+    "tukey" (see `robust_loss`), whose `loss_scale` is given in the units of the
+    (weighted) residual norms. The robust cost is then minimized by iteratively
+    reweighted least squares, i.e. the weights passed to the solvers are updated with
+    the residuals of each iteration.
+    """
 
     DEFAULT_CONF = {
         "max_iters": 10,
         "res_tangent": "fitted",
         "solver": "normal",
+        "chunk_size": 0,
+        "num_threads": 1,
+        "cost_rtol": 0.0,
+        "step_tol": 0.0,
+        "grad_tol": 0.0,
+        "loss": "l2",
+        "loss_scale": 0.01,
     }
 
     def __init__(self, cfg: dict | None = None):
@@ -58,6 +89,27 @@ class GaussNewtonCalib:
             raise ValueError(
                 "`solver` must be 'normal' or 'qr'. However, got: " f"'{self.solver=}'."
             )
+        self.chunk_size = cfg["chunk_size"]
+        self.num_threads = cfg["num_threads"]
+        if self.chunk_size > 0 and self.solver == "qr":
+            raise ValueError("The 'qr' solver requires `chunk_size` <= 0.")
+        self.set_stopping_criteria(cfg)
+        self.set_loss(cfg)
+
+    def set_stopping_criteria(self, cfg: dict):
+        self.cost_rtol = cfg["cost_rtol"]
+        self.step_tol = cfg["step_tol"]
+        self.grad_tol = cfg["grad_tol"]
+        self.early_stop = self.cost_rtol > 0 or self.step_tol > 0 or self.grad_tol > 0
+
+    def set_loss(self, cfg: dict):
+        if cfg["loss"] not in ROBUST_LOSSES:
+            raise ValueError(
+                f"`loss` must be one of {ROBUST_LOSSES}. However, got: '{cfg['loss']}'."
+            )
+        assert cfg["loss_scale"] > 0, "loss_scale must be positive"
+        self.loss = cfg["loss"]
+        self.loss_scale = cfg["loss_scale"]
 
     def __call__(
         self,
@@ -68,7 +120,11 @@ class GaussNewtonCalib:
         weights: None | Tensor = None,
         fix_cxcy: bool = False,
         fix_params: None | tuple[str, ...] | list[str] = None,
-    ) -> tuple[Tensor, Tensor, Tensor, Tensor]:
+        return_log: bool = False,
+    ) -> (
+        tuple[Tensor, Tensor, Tensor, Tensor]
+        | tuple[Tensor, Tensor, Tensor, Tensor, dict]
+    ):
         """Iterative refinement of intrinsic parameters using Gauss-Newton
 
         Args:
@@ -83,16 +139,20 @@ class GaussNewtonCalib:
             fix_idx: parameter names to maintain fixed during the optimization.
                 If None, all parameters are optimized unless `fix_cxcy` is True. In which
                 case, the principal point is fixed.
+            return_log: whether to also return the iteration log.
 
         Returns:
             (..., D) refined intrinsic parameters.
             (...,) initial cost.
             (...,) final cost.
             (..., D, D) approximate covariance inverse of the solution.
+            If `return_log`, dictionary with the (T+1, ...) "cost" of the T performed
+                iterations (initial cost first), their (T, ...) "step_norm" and
+                "grad_norm", and the (...,) "n_iters" (parameter updates) and
+                "converged" flag of each batch element.
         """
         assert observations.shape[-1] in (2, 3), f"Invalid {observations.shape[-1]=}"
         params = params0
-        weights_ = None if weights is None else weights[..., None]  # (..., N, 2, 1)
 
         # obtain indexes of parameters to be optimized
         if fix_cxcy:
@@ -110,24 +170,238 @@ class GaussNewtonCalib:
             ]
         )
 
+        if self.chunk_size > 0:
+            out = self.optimize_chunked(
+                cam, params, im_coords, observations, weights, optim_idx, return_log
+            )
+            return out if return_log else out[:4]
+
         # current estimates
         residuals, jac, valid = self.res_jac_fun(cam, observations, params, im_coords)
         jac = cam.get_optim_jac(jac, params)  # Jacobian needed during optimization
         jac = jac if optim_idx is None else jac[..., optim_idx]
-        cost0 = self.compute_cost(residuals, weights, valid)
+        cost0, weights_ = self.cost_and_weights(residuals, weights, valid)
+        cost = cost0
+        active = torch.ones_like(cost0, dtype=torch.bool)
+        log = self.init_log(cost0) if return_log else None
 
         for _ in range(self.max_iters):
             # solve normal equations J^T W J delta = -J^T W r and update state
             delta = self.compute_update(jac, -residuals, weights_, valid)  # (..., D)
-            params = cam.get_optim_update(params, expand_updates(delta, optim_idx, dim))
+            if self.grad_tol > 0 or log is not None:
+                grad = self.cost_gradient(jac, residuals, weights_, valid)
+                active = self.check_gradient(grad, active, log)
+            delta = torch.where(active[..., None], delta, 0)
+            new_params = cam.get_optim_update(
+                params, expand_updates(delta, optim_idx, dim)
+            )
+            new_params = torch.where(active[..., None], new_params, params)
             residuals, jac, valid = self.res_jac_fun(
-                cam, observations, params, im_coords
+                cam, observations, new_params, im_coords
             )
-            jac = cam.get_optim_jac(jac, params)
+            jac = cam.get_optim_jac(jac, new_params)
             jac = jac if optim_idx is None else jac[..., optim_idx]
-        final_cost = self.compute_cost(residuals, weights, valid)
+            new_cost, weights_ = self.cost_and_weights(residuals, weights, valid)
+            active = self.check_step(cost, new_cost, params, delta, active, log)
+            params, cost = new_params, new_cost
+            if self.early_stop and not active.any():
+                break
         icovs = self.estimate_inverse_covariance(jac, valid, weights_)
-        return params, cost0, final_cost, icovs
+        if return_log:
+            return params, cost0, cost, icovs, self.finalize_log(log, active)
+        return params, cost0, cost, icovs
+
+    def optimize_chunked(
+        self,
+        cam: BaseCamera,
+        params: Tensor,
+        im_coords: Tensor,
+        observations: Tensor,
+        weights: Tensor | None,
+        optim_idx: list[int] | None,
+        return_log: bool = False,
+    ) -> tuple[Tensor, Tensor, Tensor, Tensor, dict | None]:
+        """Gauss-Newton iterations with the normal equations accumulated in chunks.
+
+        See `__call__` for the arguments and outputs. The log is None if not
+        `return_log`.
+        """
+        dim = params.shape[-1]
+        JtWJ, neg_JtWr, cost0, _, count = self.accumulate_normal_eqs(
+            cam, observations, params, im_coords, weights, optim_idx
+        )
+        cost = cost0
+        active = torch.ones_like(cost0, dtype=torch.bool)
+        log = self.init_log(cost0) if return_log else None
+        for _ in range(self.max_iters):
+            delta = self.solve_accumulated(JtWJ, neg_JtWr)  # (..., D)
+            if self.grad_tol > 0 or log is not None:
+                grad = -2 * neg_JtWr / count[..., None]
+                active = self.check_gradient(grad, active, log)
+            delta = torch.where(active[..., None], delta, 0)
+            new_params = cam.get_optim_update(
+                params, expand_updates(delta, optim_idx, dim)
+            )
+            new_params = torch.where(active[..., None], new_params, params)
+            JtWJ, neg_JtWr, new_cost, _, count = self.accumulate_normal_eqs(
+                cam, observations, new_params, im_coords, weights, optim_idx
+            )
+            active = self.check_step(cost, new_cost, params, delta, active, log)
+            params, cost = new_params, new_cost
+            if self.early_stop and not active.any():
+                break
+        log = None if log is None else self.finalize_log(log, active)
+        return params, cost0, cost, JtWJ, log
+
+    def accumulate_normal_eqs(
+        self,
+        cam: BaseCamera,
+        observations: Tensor,
+        params: Tensor,
+        im_coords: Tensor,
+        weights: Tensor | None,
+        optim_idx: list[int] | None,
+    ) -> tuple[Tensor, Tensor, Tensor, Tensor]:
+        """Accumulate the normal equations over chunks of correspondences.
+
+        Args:
+            cam: camera model.
+            observations: (..., N, {2, 3}) observations.
+            params: (..., D) intrinsic parameters.
+            im_coords: (..., N, 2) image coordinates of observed points.
+            weights: (..., N, 2) diagonal elements of the *inverse* covariances.
+            optim_idx: indexes of the optimized parameters (None for all).
+
+        Returns:
+            (..., D', D) normal matrix J^T W J of the D' optimized parameters, with W
+                including the IRLS weights of the robust loss.
+            (..., D') *negative* gradient -J^T W r.
+            (...,) cost (see `cost_and_weights`).
+            (...,) squared Frobenius norm of the Jacobian (unweighted).
+            (...,) number of valid observations.
+        """
+        n = im_coords.shape[-2]
+        starts = range(0, n, self.chunk_size)
+
+        def chunk_normal_eqs(start: int) -> tuple[Tensor, ...]:
+            sl = slice(start, start + self.chunk_size)
+            residuals, jac, valid = self.res_jac_fun(
+                cam, observations[..., sl, :], params, im_coords[..., sl, :]
+            )
+            jac = cam.get_optim_jac(jac, params)
+            jac = jac if optim_idx is None else jac[..., optim_idx]
+            w = None if weights is None else weights[..., sl, :]
+            cost, w = self.robustify(residuals, w)  # (..., n), (..., n, 2)
+            WJs = jac if w is None else w[..., None] * jac  # (..., n, 2, D')
+            WJs = WJs if valid is None else WJs * valid[..., None, None]
+            JtW = WJs.flatten(-3, -2).transpose(-1, -2)  # (..., D', 2*n)
+            JtWJ = JtW @ jac.flatten(-3, -2)
+            JtWr = (JtW @ residuals.flatten(-2, -1)[..., None]).squeeze(-1)
+            if valid is None:
+                cost_sum = cost.sum(-1)
+                count = cost.new_full(cost.shape[:-1], cost.shape[-1])
+            else:
+                cost_sum, count = (cost * valid).sum(-1), valid.sum(-1).to(cost)
+            return JtWJ, JtWr, cost_sum, count, (jac**2).sum((-3, -2, -1))
+
+        if self.num_threads > 1 and len(starts) > 1:
+            # grad and inference modes are thread-local
+            grad, inference = torch.is_grad_enabled(), torch.is_inference_mode_enabled()
+
+            def chunk_in_thread(start: int) -> tuple[Tensor, ...]:
+                with torch.inference_mode(inference), torch.set_grad_enabled(grad):
+                    return chunk_normal_eqs(start)
+
+            with ThreadPoolExecutor(min(self.num_threads, len(starts))) as pool:
+                chunks = list(pool.map(chunk_in_thread, starts))
+        else:
+            chunks = [chunk_normal_eqs(start) for start in starts]
+        # sum in a fixed order for reproducibility
+        JtWJ, JtWr, cost_sum, count, jac_sq = (
+            torch.stack(terms).sum(0) for terms in zip(*chunks)
+        )
+        return JtWJ, -JtWr, cost_sum / count, jac_sq, count
+
+    def solve_accumulated(self, JtWJ: Tensor, neg_JtWr: Tensor) -> Tensor:
+        """Solve accumulated GN normal equations: J^TWJ Δ = -J^TW r
+
+        Args:
+            JtWJ: (..., D, D) normal matrix.
+            neg_JtWr: (..., D) *negative* gradient.
+
+        Returns:
+            (..., D) Gauss-Newton step.
+        """
+        if self.solver == "pinv":
+            return (torch.linalg.pinv(JtWJ) @ neg_JtWr[..., None]).squeeze(-1)
+        delta, info = torch.linalg.solve_ex(JtWJ, neg_JtWr)  # (..., D)
+        return torch.where((info == 0)[..., None], delta.nan_to_num(0, 0, 0), 0)
+
+    def check_gradient(
+        self, grad: Tensor, active: Tensor, log: dict | None = None
+    ) -> Tensor:
+        """Deactivate the batch elements whose cost gradient is below `grad_tol`.
+
+        Args:
+            grad: (..., D) gradient of the cost at the current parameters.
+            active: (...,) boolean mask of the elements still being optimized.
+            log: iteration log (see `init_log`), if any.
+
+        Returns:
+            (...,) updated mask of active elements.
+        """
+        grad_norm = grad.abs().amax(-1)
+        if log is not None:
+            log["grad_norm"].append(grad_norm)
+        if self.grad_tol > 0:
+            active = active & ~(grad_norm < self.grad_tol)
+        return active
+
+    def check_step(
+        self,
+        cost: Tensor,
+        new_cost: Tensor,
+        params: Tensor,
+        delta: Tensor,
+        active: Tensor,
+        log: dict | None = None,
+    ) -> Tensor:
+        """Deactivate the batch elements that meet the cost or step criteria.
+
+        Args:
+            cost: (...,) cost before the step.
+            new_cost: (...,) cost after the step.
+            params: (..., D) parameters before the step.
+            delta: (..., D') step, zero for inactive elements.
+            active: (...,) boolean mask of the elements still being optimized.
+            log: iteration log (see `init_log`), if any.
+
+        Returns:
+            (...,) updated mask of active elements.
+        """
+        if log is not None:
+            log["cost"].append(new_cost)
+            log["step_norm"].append(delta.norm(dim=-1))
+            log["n_iters"] = log["n_iters"] + active
+        if self.cost_rtol > 0:
+            decrease = cost - new_cost
+            active = active & ~((decrease >= 0) & (decrease < self.cost_rtol * cost))
+        if self.step_tol > 0:
+            tol = self.step_tol * (params.norm(dim=-1) + self.step_tol)
+            active = active & ~(delta.norm(dim=-1) < tol)
+        return active
+
+    @staticmethod
+    def init_log(cost0: Tensor) -> dict:
+        """Initialize the iteration log with the (...,) initial cost."""
+        n_iters = torch.zeros_like(cost0, dtype=torch.long)
+        return {"cost": [cost0], "step_norm": [], "grad_norm": [], "n_iters": n_iters}
+
+    @staticmethod
+    def finalize_log(log: dict, active: Tensor) -> dict:
+        """Stack the per-iteration entries of the log along the first dimension."""
+        log = {k: torch.stack(v) if isinstance(v, list) else v for k, v in log.items()}
+        return log | {"converged": ~active}
 
     @staticmethod
     def res_and_jac_in_obs_tangent(
@@ -332,10 +606,48 @@ class GaussNewtonCalib:
         return delta
 
     @staticmethod
-    def compute_cost(
-        res: Tensor, weights: Tensor | None, mask: Tensor | None
+    def cost_gradient(
+        Js: Tensor, res: Tensor, Ws: Tensor | None = None, mask: Tensor | None = None
     ) -> Tensor:
-        """Compute cost with optional weights and mask.
+        """Gradient of the cost (see `cost_and_weights`) w.r.t. the optimized params.
+
+        Args:
+            Js: (..., N, 2, D) stacked Jacobian for each tangent-space 2D error.
+            res: (..., N, 2) residuals.
+            Ws: (..., N, 2, 1) *diagonal* of the weight matrices for each 2D error.
+            mask: (..., N) boolean mask for valid observations.
+
+        Returns:
+            (..., D) gradient: 2 J^T W r / (number of valid observations).
+        """
+        WJs = Js if Ws is None else Ws * Js  # (..., N, 2, D)
+        WJs = WJs if mask is None else WJs * mask[..., None, None]
+        JtWr = WJs.flatten(-3, -2).transpose(-1, -2) @ res.flatten(-2, -1)[..., None]
+        count = res.shape[-2] if mask is None else mask.sum(-1, keepdim=True).to(res)
+        return 2 * JtWr.squeeze(-1) / count
+
+    def robustify(self, res: Tensor, weights: Tensor | None) -> tuple[Tensor, Tensor]:
+        """Robust cost of each observation and IRLS weights.
+
+        Args:
+            res: (..., N, 2) residuals.
+            weights: (..., N, 2) diagonal elements of the *inverse* weight matrices.
+
+        Returns:
+            (..., N) robust cost of each observation.
+            (..., N, 2) weights scaled by the IRLS weights (`weights` if "l2" loss).
+        """
+        sq_norms = (res**2).sum(-1) if weights is None else (res**2 * weights).sum(-1)
+        if self.loss == "l2":
+            return sq_norms, weights
+        cost, irls_weights = robust_loss(sq_norms, self.loss, self.loss_scale)
+        irls_weights = irls_weights[..., None].expand_as(res)
+        return cost, irls_weights if weights is None else irls_weights * weights
+
+    def cost_and_weights(
+        self, res: Tensor, weights: Tensor | None, mask: Tensor | None
+    ) -> tuple[Tensor, Tensor | None]:
+        """Robust cost (see `robust_loss`) and weights for the solvers.
 
         Args:
             res: (..., N, 2) residuals.
@@ -344,10 +656,45 @@ class GaussNewtonCalib:
 
         Returns:
             (...,) cost.
+            (..., N, 2, 1) *diagonal* of the (IRLS) weight matrices, or None.
         """
-        cost = (res**2).sum(-1) if weights is None else (res**2 * weights).sum(-1)
+        cost, weights = self.robustify(res, weights)
         cost = cost.mean(-1) if mask is None else (cost * mask).sum(-1) / mask.sum(-1)
-        return cost
+        return cost, None if weights is None else weights[..., None]
+
+    def l2_cost(
+        self, cam: BaseCamera, params: Tensor, im_coords: Tensor, observations: Tensor
+    ) -> Tensor:
+        """Mean squared norm of the residuals, without weights nor robust loss.
+
+        Contrary to the cost minimized with a robust `loss` or with weights, this is
+        the Gaussian log-likelihood assumed by information criteria, and it is
+        comparable across camera models. Computed in chunks if `chunk_size` > 0.
+
+        Args:
+            cam: camera model.
+            params: (..., D) intrinsic parameters.
+            im_coords: (..., N, 2) image coordinates of observed points.
+            observations: (..., N, {2, 3}) observations.
+
+        Returns:
+            (...,) cost.
+        """
+        n = im_coords.shape[-2]
+        chunk_size = n if self.chunk_size <= 0 else self.chunk_size
+        sq_sum, count = 0, 0
+        for start in range(0, n, chunk_size):
+            sl = slice(start, start + chunk_size)
+            residuals, _, valid = self.res_jac_fun(
+                cam, observations[..., sl, :], params, im_coords[..., sl, :]
+            )
+            sq_norms = (residuals**2).sum(-1)
+            if valid is None:
+                sq_sum, count = sq_sum + sq_norms.sum(-1), count + sq_norms.shape[-1]
+            else:
+                sq_sum = sq_sum + (sq_norms * valid).sum(-1)
+                count = count + valid.sum(-1)
+        return sq_sum / count
 
     @staticmethod
     def estimate_inverse_covariance(
@@ -15,12 +15,24 @@ def expand_updates(delta: Tensor, optim_idx: list[int] | None, dim: int) -> Tens
 
 
 class LevMarCalib(GaussNewtonCalib):
-    """Levenberg-Marquardt nonlinear optimization for single-view camera calibration."""
+    """Levenberg-Marquardt nonlinear optimization for single-view camera calibration.
+
+    See `GaussNewtonCalib` for the chunked accumulation, the stopping criteria and the
+    robust losses. The iteration log additionally contains the (T, ...) "damping" used
+    on each iteration.
+    """
 
     DEFAULT_CONF = {
         "max_iters": 10,
         "res_tangent": "fitted",
         "solver": "normal",
+        "chunk_size": 0,
+        "num_threads": 1,
+        "cost_rtol": 0.0,
+        "step_tol": 0.0,
+        "grad_tol": 0.0,
+        "loss": "l2",
+        "loss_scale": 0.01,
     }
 
     def __init__(self, cfg: dict | None = None):
@@ -45,6 +57,10 @@ class LevMarCalib(GaussNewtonCalib):
 
         self.solver = "normal"  # cfg["solver"]
         self.compute_update = self.solve_normal_eqs
+        self.chunk_size = cfg["chunk_size"]
+        self.num_threads = cfg["num_threads"]
+        self.set_stopping_criteria(cfg)
+        self.set_loss(cfg)
 
     def __call__(
         self,
@@ -55,7 +71,11 @@ class LevMarCalib(GaussNewtonCalib):
         weights: None | Tensor = None,
         fix_cxcy: bool = False,
         fix_params: None | tuple[str, ...] | list[str] = None,
-    ) -> tuple[Tensor, Tensor, Tensor, Tensor]:
+        return_log: bool = False,
+    ) -> (
+        tuple[Tensor, Tensor, Tensor, Tensor]
+        | tuple[Tensor, Tensor, Tensor, Tensor, dict]
+    ):
         """Iterative refinement of intrinsic parameters using Gauss-Newton
 
         Args:
@@ -70,16 +90,18 @@ class LevMarCalib(GaussNewtonCalib):
             fix_idx: parameter names to maintain fixed during the optimization.
                 If None, all parameters are optimized unless `fix_cxcy` is True. In which
                 case, the principal point is fixed.
+            return_log: whether to also return the iteration log.
 
         Returns:
             (..., D) refined intrinsic parameters.
             (...,) initial cost.
             (...,) final cost.
             (..., D, D) approximate covariance inverse of the solution.
+            If `return_log`, iteration log (see `GaussNewtonCalib.__call__`) including
+                the (T, ...) "damping" of each iteration.
         """
         assert observations.shape[-1] in (2, 3), f"Invalid {observations.shape[-1]=}"
         params = params0
-        weights_ = None if weights is None else weights[..., None]  # (..., N, 2, 1)
 
         # obtain indexes of parameters to be optimized
         if fix_cxcy:
@@ -97,30 +119,118 @@ class LevMarCalib(GaussNewtonCalib):
             ]
         )
 
+        if self.chunk_size > 0:
+            out = self.optimize_chunked(
+                cam, params, im_coords, observations, weights, optim_idx, return_log
+            )
+            return out if return_log else out[:4]
+
         # current estimates
         residuals, jac, valid = self.res_jac_fun(cam, observations, params, im_coords)
         jac = cam.get_optim_jac(jac, params)  # Jacobian needed during optimization
         jac = jac if optim_idx is None else jac[..., optim_idx]
-        cost0 = cost = self.compute_cost(residuals, weights, valid)
+        cost0, weights_ = self.cost_and_weights(residuals, weights, valid)
+        cost = cost0
         damping = self.init_damping(jac)
+        active = torch.ones_like(cost0, dtype=torch.bool)
+        log = self.init_log(cost0) | {"damping": []} if return_log else None
 
         for _ in range(self.max_iters):
             # solve normal equations J^T W J delta = -J^T W r and update state
             delta = self.compute_update(jac, -residuals, damping, weights_, valid)  # (..., D) # fmt: skip
-            params = cam.get_optim_update(params, expand_updates(delta, optim_idx, dim))
+            if self.grad_tol > 0 or log is not None:
+                grad = self.cost_gradient(jac, residuals, weights_, valid)
+                active = self.check_gradient(grad, active, log)
+            delta = torch.where(active[..., None], delta, 0)
+            new_params = cam.get_optim_update(
+                params, expand_updates(delta, optim_idx, dim)
+            )
+            new_params = torch.where(active[..., None], new_params, params)
             residuals, jac, valid = self.res_jac_fun(
-                cam, observations, params, im_coords
+                cam, observations, new_params, im_coords
             )
-            jac = cam.get_optim_jac(jac, params)
+            jac = cam.get_optim_jac(jac, new_params)
             jac = jac if optim_idx is None else jac[..., optim_idx]
-            # update damping term
-            new_cost = self.compute_cost(residuals, weights, valid)
-            damping = damping * torch.where((new_cost < cost).unsqueeze(-1), 0.1, 10)
-            cost = new_cost
+            new_cost, weights_ = self.cost_and_weights(residuals, weights, valid)
+            if log is not None:
+                log["damping"].append(damping[..., 0])
+            # update damping term of the active elements
+            factor = torch.where(new_cost < cost, 0.1, 10)
+            damping = damping * torch.where(active, factor, 1).unsqueeze(-1)
+            active = self.check_step(cost, new_cost, params, delta, active, log)
+            params, cost = new_params, new_cost
+            if self.early_stop and not active.any():
+                break
 
         icovs = self.estimate_inverse_covariance(jac, valid, weights_)
+        if return_log:
+            return params, cost0, cost, icovs, self.finalize_log(log, active)
         return params, cost0, cost, icovs
 
+    def optimize_chunked(
+        self,
+        cam: BaseCamera,
+        params: Tensor,
+        im_coords: Tensor,
+        observations: Tensor,
+        weights: Tensor | None,
+        optim_idx: list[int] | None,
+        return_log: bool = False,
+    ) -> tuple[Tensor, Tensor, Tensor, Tensor, dict | None]:
+        """Levenberg-Marquardt iterations with the normal equations accumulated in
+        chunks. See `__call__` for the arguments and outputs. The log is None if not
+        `return_log`.
+        """
+        dim = params.shape[-1]
+        JtWJ, neg_JtWr, cost0, jac_sq, count = self.accumulate_normal_eqs(
+            cam, observations, params, im_coords, weights, optim_idx
+        )
+        cost = cost0
+        # same initialization as `init_damping`
+        damping = 1e-3 * jac_sq[..., None] / JtWJ.shape[-1]
+        active = torch.ones_like(cost0, dtype=torch.bool)
+        log = self.init_log(cost0) | {"damping": []} if return_log else None
+        for _ in range(self.max_iters):
+            delta = self.solve_accumulated(JtWJ, neg_JtWr, damping)  # (..., D)
+            if self.grad_tol > 0 or log is not None:
+                grad = -2 * neg_JtWr / count[..., None]
+                active = self.check_gradient(grad, active, log)
+            delta = torch.where(active[..., None], delta, 0)
+            new_params = cam.get_optim_update(
+                params, expand_updates(delta, optim_idx, dim)
+            )
+            new_params = torch.where(active[..., None], new_params, params)
+            JtWJ, neg_JtWr, new_cost, _, count = self.accumulate_normal_eqs(
+                cam, observations, new_params, im_coords, weights, optim_idx
+            )
+            if log is not None:
+                log["damping"].append(damping[..., 0])
+            factor = torch.where(new_cost < cost, 0.1, 10)
+            damping = damping * torch.where(active, factor, 1).unsqueeze(-1)
+            active = self.check_step(cost, new_cost, params, delta, active, log)
+            params, cost = new_params, new_cost
+            if self.early_stop and not active.any():
+                break
+        log = None if log is None else self.finalize_log(log, active)
+        return params, cost0, cost, JtWJ, log
+
+    @staticmethod
+    def solve_accumulated(JtWJ: Tensor, neg_JtWr: Tensor, damping: Tensor) -> Tensor:
+        """Solve accumulated, damped, normal equations:
+            ( J^TWJ + μ*diag(J^TWJ) ) Δ = -J^TW r
+
+        Args:
+            JtWJ: (..., D, D) normal matrix.
+            neg_JtWr: (..., D) *negative* gradient.
+            damping: (..., 1) damping term.
+
+        Returns:
+            (..., D) Levenberg-Marquardt step.
+        """
+        JtWJ = JtWJ + (damping * JtWJ.diagonal(dim1=-2, dim2=-1)).diag_embed()
+        delta, info = torch.linalg.solve_ex(JtWJ, neg_JtWr)  # (..., D)
+        return torch.where((info == 0)[..., None], delta, 0)
+
     @staticmethod
     def init_damping(jac: Tensor) -> Tensor:
         """Initialize damping term
@@ -132,7 +242,7 @@ class LevMarCalib(GaussNewtonCalib):
             (..., 1) initial damping term.
         """
         # based on [Hartley, Zisserman, 2004]:  1e-3 * (trace(JTWJ) / D)
-        return 1e-3 * (jac**2).sum((-3, -2, -1)) / jac.shape[-1]
+        return 1e-3 * (jac**2).sum((-3, -2, -1))[..., None] / jac.shape[-1]
 
     @staticmethod
     def solve_normal_eqs(
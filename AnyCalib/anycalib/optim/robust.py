@@ -0,0 +1,41 @@
+import torch
+from torch import Tensor
+
+ROBUST_LOSSES = ("l2", "huber", "cauchy", "tukey")
+
+
+def robust_loss(sq_norms: Tensor, loss: str, scale: float) -> tuple[Tensor, Tensor]:
+    """Robust kernel ρ and its derivative ρ' evaluated at squared residual norms.
+
+    The kernels are expressed as functions of the squared norm s = ||r||^2, so that
+    minimizing Σ ρ(s_i) with Gauss-Newton amounts to iteratively reweighted least
+    squares (IRLS) with weights ρ'(s_i). All kernels satisfy ρ(s) ≈ s for ||r|| << c,
+    with c=`scale`, so their costs are comparable with the squared loss:
+        - huber: s if ||r|| <= c, else 2c||r|| - c^2.
+        - cauchy: c^2 log(1 + s/c^2).
+        - tukey: c^2/3 (1 - (1 - s/c^2)^3) if ||r|| <= c, else c^2/3.
+
+    Args:
+        sq_norms: (...,) squared (weighted) residual norms.
+        loss: one of "l2", "huber", "cauchy" or "tukey".
+        scale: residual norm c beyond which observations are downweighted.
+
+    Returns:
+        (...,) robust costs ρ(s).
+        (...,) IRLS weights ρ'(s).
+    """
+    c2 = scale**2
+    if loss == "l2":
+        return sq_norms, torch.ones_like(sq_norms)
+    if loss == "huber":
+        inlier = sq_norms <= c2
+        norms = sq_norms.sqrt()
+        rho = torch.where(inlier, sq_norms, 2 * scale * norms - c2)
+        drho = torch.where(inlier, 1, scale / norms.clamp(min=scale))
+        return rho, drho
+    if loss == "cauchy":
+        return c2 * torch.log1p(sq_norms / c2), 1 / (1 + sq_norms / c2)
+    if loss == "tukey":
+        u = (1 - sq_norms / c2).clamp(min=0)
+        return c2 / 3 * (1 - u**3), u**2
+    raise ValueError(f"`loss` must be one of {ROBUST_LOSSES}. However, got: '{loss}'.")
@@ -0,0 +1,339 @@
+import hashlib
+import json
+import os
+from math import pi, radians
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch import Tensor
+
+from anycalib.cameras import CameraFactory
+from anycalib.cameras.base import BaseCamera
+
+PROJECTIONS = ("equirect", "cubemap")
+
+
+def rotation_from_ypr(yaw: float, pitch: float, roll: float) -> Tensor:
+    """Rotation from the camera to the rig frame given yaw, pitch and roll in degrees.
+
+    Both frames follow the camera convention: x right, y down, z forward. A positive
+    yaw turns the optical axis to the right (+x), a positive pitch turns it up (-y)
+    and the roll is applied around the optical axis.
+    """
+    y, p, r = (
+        torch.tensor(radians(a), dtype=torch.float64) for a in (yaw, pitch, roll)
+    )
+    zero, one = torch.zeros_like(y), torch.ones_like(y)
+    R_yaw = torch.stack(
+        (y.cos(), zero, y.sin(), zero, one, zero, -y.sin(), zero, y.cos())
+    ).view(3, 3)
+    R_pitch = torch.stack(
+        (one, zero, zero, zero, p.cos(), -p.sin(), zero, p.sin(), p.cos())
+    ).view(3, 3)
+    R_roll = torch.stack(
+        (r.cos(), -r.sin(), zero, r.sin(), r.cos(), zero, zero, zero, one)
+    ).view(3, 3)
+    return R_yaw @ R_pitch @ R_roll
+
+
+def load_rig(path: str) -> dict[str, Tensor]:
+    """Load the rotations of the lenses of a rig from a JSON file.
+
+    The file maps each image name to either the (3, 3) rotation "R" from the camera
+    to the rig frame or to "ypr_deg": [yaw, pitch, roll] in degrees, e.g.:
+        {"lenses": {"origin_1.jpg": {"ypr_deg": [0, 0, 0]}, ...}}
+    Translations are ignored since the panoramas are rendered at infinity.
+
+    Returns:
+        Dict mapping image names to (3, 3) float64 rotations.
+    """
+    with open(path) as f:
+        lenses = json.load(f)["lenses"]
+    rig = {}
+    for name, lens in lenses.items():
+        if "R" in lens:
+            rig[name] = torch.tensor(lens["R"], dtype=torch.float64)
+        else:
+            rig[name] = rotation_from_ypr(*lens["ypr_deg"])
+    return rig
+
+
+def load_intrinsics(path: str, cam_id: str) -> dict[str, tuple[str, Tensor]]:
+    """Load the intrinsics written by predict_insta360.py.
+
+    Args:
+        path: JSON file mapping image names to intrinsics, or to dicts with "cam_id"
+            and "intrinsics" (camera model sweep).
+        cam_id: camera model of the entries without "cam_id".
+
+    Returns:
+        Dict mapping image names to (cam_id, (D,) float64 intrinsics).
+    """
+    with open(path) as f:
+        results = json.load(f)
+    intrinsics = {}
+    for name, res in results.items():
+        if isinstance(res, dict):
+            intrinsics[name] = (res["cam_id"], torch.tensor(res["intrinsics"]).double())
+        else:
+            intrinsics[name] = (cam_id, torch.tensor(res).double())
+    return intrinsics
+
+
+def pano_rays(projection: str, out_size: tuple[int, int]) -> Tensor:
+    """Unit rays, in the rig frame, of the pixel centers of a panorama.
+
+    Equirectangular panoramas span longitudes [-180, 180) deg., from left to right,
+    with the forward direction (+z) at the center, and latitudes [-90, 90] deg., from
+    top (-y) to bottom. Cubemaps are (S, 6S) horizontal strips with the faces: front
+    (+z), right (+x), back (-z), left (-x), up (-y) and down (+y).
+
+    Args:
+        projection: "equirect" or "cubemap".
+        out_size: (H, W) size of the panorama. For cubemaps, W must be 6 * H.
+
+    Returns:
+        (H*W, 3) float64 unit rays.
+    """
+    h, w = out_size
+    if projection == "equirect":
+        lon = (torch.arange(w, dtype=torch.float64) + 0.5) * (2 * pi / w) - pi
+        lat = (torch.arange(h, dtype=torch.float64) + 0.5) * (pi / h) - pi / 2
+        lat, lon = torch.meshgrid(lat, lon, indexing="ij")
+        rays = torch.stack(
+            (lat.cos() * lon.sin(), lat.sin(), lat.cos() * lon.cos()), dim=-1
+        )
+        return rays.view(-1, 3)
+    if projection != "cubemap":
+        raise ValueError(f"`projection` must be one of {PROJECTIONS}: {projection}.")
+    assert w == 6 * h, f"Cubemaps are (S, 6S) strips, got {out_size=}."
+    # face coordinates in [-1, 1]: a (right), b (down)
+    ab = (torch.arange(h, dtype=torch.float64) + 0.5) * (2 / h) - 1
+    b, a = torch.meshgrid(ab, ab, indexing="ij")
+    one = torch.ones_like(a)
+    faces = (
+        (a, b, one),  # front
+        (one, b, -a),  # right
+        (-a, b, -one),  # back
+        (-one, b, a),  # left
+        (a, -one, b),  # up
+        (a, one, -b),  # down
+    )
+    rays = torch.cat([torch.stack(face, dim=-1) for face in faces], dim=1)
+    return F.normalize(rays, dim=-1).view(-1, 3)
+
+
+class PanoramaStitcher:
+    """Render panoramas from the images of a calibrated multi-lens rig.
+
+    For each panorama projection and size, a lookup map from output pixels to
+    (lens, x, y) with blend weights is built once and reused for every set of
+    images. Each output pixel is blended from (at most) the `max_lenses` lenses that
+    see it best. The weight of a lens decreases linearly with the angle between the
+    ray and its optical axis, up to `max_angle`, and is feathered over `feather`
+    pixels near the image borders.
+
+    The maps are stored sparsely, per lens: flat indices of the output pixels that
+    the lens contributes to, their sampling coordinates and their weights. Rendering
+    is then a `grid_sample` and an `index_add_` per lens.
+
+    Args:
+        cams: camera model of each lens.
+        params: (D_l,) intrinsic parameters of each lens.
+        rotations: (3, 3) rotation from the camera to the rig frame of each lens.
+        in_sizes: (H, W) image size of each lens.
+        max_lenses: maximum number of lenses blended per output pixel. 1 for hard
+            seams.
+        max_angle: maximum angle (deg.) between a ray and the optical axis of a lens
+            for the lens to contribute to it.
+        feather: width, in pixels, of the weight ramp at the image borders.
+        cache_dir: if given, the maps are also cached on disk in this directory.
+    """
+
+    def __init__(
+        self,
+        cams: list[BaseCamera],
+        params: list[Tensor],
+        rotations: list[Tensor],
+        in_sizes: list[tuple[int, int]],
+        max_lenses: int = 2,
+        max_angle: float = 100.0,
+        feather: float = 32.0,
+        cache_dir: str | None = None,
+    ):
+        assert len(cams) == len(params) == len(rotations) == len(in_sizes)
+        self.cams = cams
+        self.params = [p.double() for p in params]
+        self.rotations = [R.double() for R in rotations]
+        self.in_sizes = [tuple(s) for s in in_sizes]
+        self.max_lenses = max_lenses
+        self.max_angle = max_angle
+        self.feather = feather
+        self.cache_dir = cache_dir
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._maps: dict[str, list[dict[str, Tensor]]] = {}
+
+    @classmethod
+    def from_files(
+        cls,
+        intrinsics_file: str,
+        rig_file: str,
+        in_sizes: dict[str, tuple[int, int]],
+        cam_id: str = "kb:4",
+        lut_size: int = 0,
+        **kwargs,
+    ) -> "PanoramaStitcher":
+        """Create a stitcher for the lenses listed in `in_sizes`.
+
+        Args:
+            intrinsics_file: JSON file with the intrinsics (see `load_intrinsics`).
+            rig_file: JSON file with the rotations of the lenses (see `load_rig`).
+            in_sizes: (H, W) image size of each lens, keyed by image name.
+            cam_id: camera model of the intrinsics without an explicit one.
+            lut_size: if positive, size of the lookup tables used to (un)project with
+                the camera models that support them. Default: 0 (exact solvers).
+            **kwargs: remaining arguments of the constructor.
+        """
+        intrinsics = load_intrinsics(intrinsics_file, cam_id)
+        rig = load_rig(rig_file)
+        names = list(in_sizes)
+        return cls(
+            [CameraFactory.create_from_id(intrinsics[n][0], lut_size) for n in names],
+            [intrinsics[n][1] for n in names],
+            [rig[n] for n in names],
+            [in_sizes[n] for n in names],
+            **kwargs,
+        )
+
+    def _key(self, projection: str, out_size: tuple[int, int]) -> str:
+        h = hashlib.blake2b(digest_size=16)
+        for cam, params, R, size in zip(
+            self.cams, self.params, self.rotations, self.in_sizes
+        ):
+            h.update(f"{cam.id}{size}".encode())
+            h.update(params.numpy().tobytes())
+            h.update(R.numpy().tobytes())
+        h.update(
+            f"{projection}{out_size}{self.max_lenses}{self.max_angle}{self.feather}"
+            .encode()
+        )  # fmt: skip
+        return h.hexdigest()
+
+    def maps(
+        self, projection: str, out_size: tuple[int, int]
+    ) -> list[dict[str, Tensor]]:
+        """Lookup maps of a panorama, built on first use and cached.
+
+        Returns:
+            List with, for each lens, a dict with the (N_l,) int64 "out_idx" of the
+            output pixels it contributes to, their (N_l, 2) float32 "grid" sampling
+            coordinates, normalized as in `grid_sample`, and their (N_l,) float32
+            blend "weight".
+        """
+        out_size = tuple(out_size)
+        key = self._key(projection, out_size)
+        if key in self._maps:
+            return self._maps[key]
+        path = None
+        if self.cache_dir is not None:
+            path = os.path.join(self.cache_dir, f"pano_{key}.pt")
+            if os.path.exists(path):
+                try:
+                    self._maps[key] = torch.load(path, weights_only=True)
+                    return self._maps[key]
+                except Exception as e:  # e.g. truncated file
+                    print(f"WARNING: Could not load panorama maps from {path}: {e}")
+        maps = self.build_maps(projection, out_size)
+        if path is not None:
+            # write to a temporary file first so that interrupted writes are not reused
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            torch.save(maps, tmp_path)
+            os.replace(tmp_path, path)
+        self._maps[key] = maps
+        return maps
+
+    @torch.no_grad()
+    def build_maps(
+        self, projection: str, out_size: tuple[int, int]
+    ) -> list[dict[str, Tensor]]:
+        """Build the lookup maps of a panorama. See `maps` for the output format."""
+        rays = pano_rays(projection, out_size)  # (N, 3)
+        max_angle = radians(self.max_angle)
+        grids, weights = [], []
+        for cam, params, R, (h, w) in zip(
+            self.cams, self.params, self.rotations, self.in_sizes
+        ):
+            rays_cam = rays @ R  # R^T @ ray
+            theta = torch.acos(rays_cam[:, 2].clamp(-1, 1))
+            xy, valid = cam.project(params, rays_cam)
+            # distance to the closest image border
+            border = torch.minimum(
+                torch.minimum(xy[:, 0], w - xy[:, 0]),
+                torch.minimum(xy[:, 1], h - xy[:, 1]),
+            ).nan_to_num(-1)
+            weight = (max_angle - theta).clamp(min=0) * (border / self.feather).clamp(
+                0, 1
+            )
+            if valid is not None:
+                weight = torch.where(valid, weight, 0)
+            grids.append(2 * xy / xy.new_tensor((w, h)) - 1)
+            weights.append(weight)
+        weights = torch.stack(weights)  # (L, N)
+
+        # keep the best lenses of each pixel
+        k = min(self.max_lenses, len(self.cams))
+        top_w, top_idx = weights.topk(k, dim=0)  # (k, N)
+        if k == 1:
+            top_w = (top_w > 0).to(top_w)
+        top_w = top_w / top_w.sum(dim=0).clamp(min=torch.finfo(top_w.dtype).tiny)
+        maps = []
+        for lens, grid in enumerate(grids):
+            mask = (top_idx == lens) & (top_w > 0)  # (k, N)
+            weight = (top_w * mask).sum(dim=0)
+            out_idx = mask.any(dim=0).nonzero().squeeze(-1)
+            maps.append(
+                {
+                    "out_idx": out_idx,
+                    "grid": grid[out_idx].float(),
+                    "weight": weight[out_idx].float(),
+                }
+            )
+        return maps
+
+    @torch.no_grad()
+    def render(
+        self,
+        images: list[Tensor | np.ndarray],
+        projection: str = "equirect",
+        out_size: tuple[int, int] = (1920, 3840),
+    ) -> Tensor:
+        """Render a panorama.
+
+        Args:
+            images: (H_l, W_l, C) uint8 image of each lens, in the order of the lenses.
+            projection: "equirect" or "cubemap".
+            out_size: (H, W) size of the panorama. For cubemaps, W must be 6 * H.
+
+        Returns:
+            (H, W, C) uint8 panorama. Pixels not seen by any lens are set to 0.
+        """
+        assert len(images) == len(self.cams), "Expected one image per lens."
+        maps = self.maps(projection, out_size)
+        c = images[0].shape[-1]
+        out = torch.zeros((c, out_size[0] * out_size[1]))
+        for im, lens_map in zip(images, maps):
+            if len(lens_map["out_idx"]) == 0:
+                continue
+            im = torch.as_tensor(im).permute(2, 0, 1)[None].float()
+            samples = F.grid_sample(
+                im,
+                lens_map["grid"].view(1, 1, -1, 2),
+                mode="bilinear",
+                padding_mode="border",
+                align_corners=False,
+            )[0, :, 0]
+            out.index_add_(1, lens_map["out_idx"], samples * lens_map["weight"])
+        out = out.round_().clamp_(0, 255).to(torch.uint8)
+        return out.view(c, *out_size).permute(1, 2, 0)
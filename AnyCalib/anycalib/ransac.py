@@ -1,4 +1,6 @@
-from math import comb, pi
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil, comb, inf, log, log1p, pi
+from time import perf_counter
 
 import torch
 from torch import Tensor
@@ -9,7 +11,7 @@ from anycalib.manifolds import Unit3
 
 
 class RANSAC:
-    """Simple parallel RANSAC
+    """Simple parallel RANSAC with optional adaptive termination
 
     Args:
         cfg: Configuration dictionary with the following key-value pairs:
@@ -25,6 +27,19 @@ class RANSAC:
             - max_correspondences (int): Maximum number of correspondences to consider.
                 If the number of correspondences is larger than this value, a random
                 subset of this size will be used.
+            - adaptive (bool): Stop drawing hypotheses once, with probability
+                `confidence`, an all-inlier sample has been drawn given the inlier ratio
+                of the best model so far. Hypotheses are then generated and scored in
+                chunks of `adaptive_chunk_size`. If all of them are rejected by the
+                T(d,d) test, all the hypotheses are scored as in non-adaptive mode.
+            - confidence (float): Confidence for the adaptive stopping criterion.
+            - adaptive_chunk_size (int): Number of models per chunk in adaptive mode.
+            - n_preverify (int): Number d of random correspondences used in adaptive
+                mode for the T(d,d) pre-verification test: only hypotheses for which
+                all d correspondences are inliers are scored against all the
+                correspondences. 0 disables the test.
+            - num_threads (int): Number of CPU threads scoring chunks concurrently in
+                adaptive mode.
     """
 
     __slots__ = "cfg"
@@ -35,6 +50,11 @@ class RANSAC:
         "n_samples": 2_048,
         "chunk_size": 1_024,
         "max_correspondences": 20_000,
+        "adaptive": False,
+        "confidence": 0.9999,
+        "adaptive_chunk_size": 128,
+        "n_preverify": 1,
+        "num_threads": 4,
     }
 
     # cam ids for which msac scores will correspond to angular errors. Recommended for
@@ -58,7 +78,8 @@ class RANSAC:
         bearings: Tensor,
         probs: Tensor | None = None,
         cxcy: Tensor | None = None,
-    ) -> tuple[Tensor, Tensor]:
+        return_info: bool = False,
+    ) -> tuple[Tensor, Tensor] | tuple[Tensor, Tensor, dict]:
         """Estimate camera intrinsics using RANSAC.
 
         Args:
@@ -68,29 +89,61 @@ class RANSAC:
             probs: (..., N) optional probabilities/weights for sampling. Must be
                 non-negative and may not sum to 1.
             cxcy: (..., 2) already known principal point.
+            return_info: whether to also return a dict with the number of hypotheses
+                drawn (n_hypotheses), the number of them scored against all the
+                correspondences (n_scored) and the wall time in seconds (time).
 
         Returns:
             intrinsics: (..., D) estimated intrinsics.
             inliers: (..., N) boolean mask of inliers.
+            info: (optional) dict with statistics of the estimation.
         """
-        sample_dim = cam_sac.get_min_sample_size(cxcy is not None)
+        tic = perf_counter()
+        if self.cfg["adaptive"]:
+            best_model, inliers, info = self.adaptive(
+                cam_sac, im_coords, bearings, probs, cxcy
+            )
+        else:
+            best_model, inliers, info = self.fixed(
+                cam_sac, im_coords, bearings, probs, cxcy
+            )
+        if return_info:
+            return best_model, inliers, info | {"time": perf_counter() - tic}
+        return best_model, inliers
 
+    def _get_error_fun(self, cam_sac: BaseCamera):
         if cam_sac.id in self.ANG_ERROR_CAMS:
-            th = self.cfg["th_ang_error"]
-            err_fun = self._ang_error
-        else:
-            th = self.cfg["th_reproj_error"]
-            err_fun = self._sq_reproj_error
+            return self._ang_error, self.cfg["th_ang_error"]
+        return self._sq_reproj_error, self.cfg["th_reproj_error"]
 
-        n_samples = self.cfg["n_samples"]
-        chunk_size = self.cfg["chunk_size"]
+    def _limit_correspondences(
+        self, im_coords: Tensor, bearings: Tensor, probs: Tensor | None
+    ) -> tuple[Tensor, Tensor, Tensor | None]:
         max_c = self.cfg["max_correspondences"]
-
         if max_c is not None and max_c < bearings.shape[-2]:
             idx = torch.randperm(bearings.shape[-2], device=bearings.device)[:max_c]
             bearings = bearings[..., idx, :]
             im_coords = im_coords[..., idx, :]
             probs = None if probs is None else probs[..., idx]
+        return im_coords, bearings, probs
+
+    def fixed(
+        self,
+        cam_sac: BaseCamera,
+        im_coords: Tensor,
+        bearings: Tensor,
+        probs: Tensor | None = None,
+        cxcy: Tensor | None = None,
+    ) -> tuple[Tensor, Tensor, dict]:
+        """RANSAC evaluating all the `n_samples` hypotheses (see `__call__`)."""
+        sample_dim = cam_sac.get_min_sample_size(cxcy is not None)
+
+        err_fun, th = self._get_error_fun(cam_sac)
+        n_samples = self.cfg["n_samples"]
+        chunk_size = self.cfg["chunk_size"]
+        im_coords, bearings, probs = self._limit_correspondences(
+            im_coords, bearings, probs
+        )
 
         # limit the number of samples to the number of possible combinations
         n_samples = min(n_samples, comb(bearings.shape[-2], sample_dim))
@@ -110,6 +163,7 @@ class RANSAC:
         # intrinsics (model) for each sample
         cxcy = None if cxcy is None else cxcy.view(*batch_size, 1, 2)
         models = cam_sac.fit_minimal(im_coords_, bearings_, cxcy)  # (..., n_models, D)
+        info = {"n_hypotheses": n_samples, "n_scored": n_samples}
 
         if chunk_size <= 0 or chunk_size >= n_samples:
             # NOTE: unsqueeze(-3) below assumes that cam.(un)project will do broadcasting.
@@ -123,7 +177,7 @@ class RANSAC:
             best_idx = msac_scores.argmin(dim=-1)[..., None, None]  # (..., 1, 1)
             best_model = models.take_along_dim(best_idx, dim=-2).squeeze(-2)
             inliers = scores.take_along_dim(best_idx, dim=-2).squeeze(-2) < th
-            return best_model, inliers
+            return best_model, inliers, info
 
         # Computing the error of all tentative models w.r.t. all N points leads to
         # O(n_models * N) memory complexity, which can lead to OOM or to a memory
@@ -152,7 +206,157 @@ class RANSAC:
         best_model = models.take_along_dim(best_idx, dim=-2).squeeze(-2)  # (..., D)
         scores, valid = err_fun(best_model, bearings, im_coords, cam_sac, True)
         inliers = scores < th
-        return best_model, inliers if valid is None else inliers & valid
+        return best_model, inliers if valid is None else inliers & valid, info
+
+    def adaptive(
+        self,
+        cam_sac: BaseCamera,
+        im_coords: Tensor,
+        bearings: Tensor,
+        probs: Tensor | None = None,
+        cxcy: Tensor | None = None,
+    ) -> tuple[Tensor, Tensor, dict]:
+        """RANSAC with early termination and T(d,d) pre-verification.
+
+        Chunks of hypotheses are generated and scored concurrently by `num_threads`
+        CPU threads (PyTorch kernels release the GIL). After each round of chunks, the
+        number of hypotheses needed for finding an all-inlier sample with probability
+        `confidence` is updated with the inlier ratio w of the best model so far:
+            k = log(1 - confidence) / log(1 - w^(sample_dim + n_preverify)),
+        where the exponent accounts for good hypotheses rejected by the T(d,d) test.
+        Batched inputs are processed sequentially.
+        """
+        batch_size = im_coords.shape[:-2]
+        if len(batch_size) > 0:
+            # subsample once so that all the elements share the same correspondences
+            im_coords, bearings, probs = self._limit_correspondences(
+                im_coords, bearings, probs
+            )
+            n = im_coords.shape[-2]
+            im_coords_, bearings_ = im_coords.reshape(-1, n, 2), bearings.reshape(
+                -1, n, 3
+            )
+            probs_ = [None] * len(im_coords_) if probs is None else probs.reshape(-1, n)
+            cxcy_ = [None] * len(im_coords_) if cxcy is None else cxcy.reshape(-1, 2)
+            outs = [
+                self.adaptive(cam_sac, *args)
+                for args in zip(im_coords_, bearings_, probs_, cxcy_)
+            ]
+            best_model = torch.stack([o[0] for o in outs]).view(*batch_size, -1)
+            inliers = torch.stack([o[1] for o in outs]).view(*batch_size, n)
+            info = {k: sum(o[2][k] for o in outs) for k in outs[0][2]}
+            return best_model, inliers, info
+
+        sample_dim = cam_sac.get_min_sample_size(cxcy is not None)
+        err_fun, th = self._get_error_fun(cam_sac)
+        im_coords, bearings, probs = self._limit_correspondences(
+            im_coords, bearings, probs
+        )
+        n = bearings.shape[-2]
+        n_samples = min(self.cfg["n_samples"], comb(n, sample_dim))
+        ch_s = self.cfg["adaptive_chunk_size"]
+        n_pre = self.cfg["n_preverify"]
+        n_threads = max(1, self.cfg["num_threads"])
+        log_failure = log(1 - self.cfg["confidence"])
+
+        # draw all samples upfront so that the result does not depend on n_threads
+        indices = self.sampler(bearings[..., 0], n_samples, sample_dim, probs)
+        n_chunks = ceil(n_samples / ch_s)
+        pre_indices = torch.randint(n, (n_chunks, n_pre), device=bearings.device)
+        cxcy_b = None if cxcy is None else cxcy.view(1, 2)
+        bearings_b, im_coords_b = bearings.unsqueeze(-3), im_coords.unsqueeze(-3)
+
+        def score_chunk(c: int) -> tuple[Tensor, Tensor, int] | None:
+            idx = indices[c * ch_s : (c + 1) * ch_s]  # (n_models, sample_dim)
+            models = cam_sac.fit_minimal(im_coords[idx], bearings[idx], cxcy_b)
+            if n_pre > 0:
+                # T(d,d) test: discard models with any outlier in the random subset
+                pre_idx = pre_indices[c]
+                pre_scores: Tensor = err_fun(  # type: ignore
+                    models,
+                    bearings_b[..., pre_idx, :],
+                    im_coords_b[..., pre_idx, :],
+                    cam_sac,
+                )
+                models = models[(pre_scores < th).all(dim=-1)]
+                if len(models) == 0:
+                    return None
+            msac_scores = (
+                err_fun(models, bearings_b, im_coords_b, cam_sac)
+                .clamp(max=th)  # type: ignore
+                .sum(dim=-1)
+                .nan_to_num(inf)
+            )
+            best = msac_scores.argmin()
+            return models[best], msac_scores[best], len(models)
+
+        # thread-local autograd state of the caller
+        inference, grad = torch.is_inference_mode_enabled(), torch.is_grad_enabled()
+
+        def score_chunk_in_thread(c: int):
+            with torch.inference_mode(inference), torch.set_grad_enabled(grad):
+                return score_chunk(c)
+
+        best_model, best_score = None, inf
+        n_required, n_hypotheses, n_scored = n_samples, 0, 0
+        pool = ThreadPoolExecutor(n_threads) if n_threads > 1 else None
+        try:
+            for c0 in range(0, n_chunks, n_threads):
+                chunks = range(c0, min(c0 + n_threads, n_chunks))
+                results = (
+                    map(score_chunk, chunks)
+                    if pool is None
+                    else pool.map(score_chunk_in_thread, chunks)
+                )
+                improved = False
+                for res in results:  # results are in chunk order -> deterministic
+                    if res is None:
+                        continue
+                    n_scored += res[2]
+                    if res[1].item() < best_score:
+                        best_model, best_score, improved = res[0], res[1].item(), True
+                n_hypotheses = min(chunks[-1] + 1, n_chunks) * ch_s
+                n_hypotheses = min(n_hypotheses, n_samples)
+                if improved:
+                    scores = err_fun(best_model, bearings, im_coords, cam_sac)
+                    w = (scores < th).float().mean().item()  # type: ignore
+                    n_required = self.required_hypotheses(
+                        w, sample_dim + n_pre, log_failure
+                    )
+                if n_hypotheses >= n_required:
+                    break
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        if best_model is None:
+            # every hypothesis was rejected by the T(d,d) test: score all of them
+            return self.fixed(cam_sac, im_coords, bearings, probs, cxcy)
+        info = {"n_hypotheses": n_hypotheses, "n_scored": n_scored}
+        scores, valid = err_fun(best_model, bearings, im_coords, cam_sac, True)
+        inliers = scores < th
+        return best_model, inliers if valid is None else inliers & valid, info
+
+    @staticmethod
+    def required_hypotheses(
+        inlier_ratio: float, sample_dim: int, log_failure: float
+    ) -> float:
+        """Number of hypotheses needed to draw an all-inlier sample.
+
+        Args:
+            inlier_ratio: estimated ratio of inliers.
+            sample_dim: number of correspondences that must be inliers.
+            log_failure: log(1 - confidence).
+
+        Returns:
+            Number of hypotheses (inf if the inlier ratio is zero).
+        """
+        p_good = inlier_ratio**sample_dim
+        if p_good <= 0:
+            return inf
+        if p_good >= 1:
+            return 0
+        return ceil(log_failure / log1p(-p_good))
 
     @staticmethod
     def sampler(
@@ -254,4 +458,3 @@ class RANSAC:
         if return_valid:
             return ang_dist, valid
         return ang_dist
-
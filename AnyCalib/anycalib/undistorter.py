@@ -0,0 +1,182 @@
+from typing import Iterable, Iterator
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch import Tensor
+
+from anycalib.cameras.base import BaseCamera
+
+
+class Undistorter:
+    """Reusable undistortion of uint8 frames with a precomputed sampling grid.
+
+    `BaseCamera.undistort_image` computes the sampling grid, i.e. the projections of
+    the rays of the undistorted pixels, on every call. For videos, the camera and its
+    intrinsics are fixed, so the grid is computed once at construction, for a given
+    input size, and stored in one of the formats:
+        - "fixed" (default): integer pixel coordinates (int16) and fractional parts
+          quantized to `frac_bits` bits (uint8), similar to OpenCV's fixed-point remap
+          maps. It takes 6 bytes per pixel and is decoded once per batch of frames.
+        - "float32": normalized sampling coordinates (8 bytes per pixel).
+
+    Frames are expected as (B, H, W, C) or (H, W, C) uint8 arrays/tensors, i.e. in the
+    channels-last layout of decoded video frames.
+
+    Args:
+        cam: camera model.
+        params: (D,) or (1, D) intrinsic parameters.
+        in_size: (H, W) size of the distorted frames.
+        out_size: (H', W') size of the undistorted frames. Default: `in_size`.
+        scale: scaling factor for the focal length(s).
+        target_proj: target projection model for the undistortion. See options in
+            `BaseCamera.ideal_unprojection`.
+        grid_format: "fixed" (default) or "float32".
+        interp_mode: interpolation mode of `grid_sample`: "bilinear" (default),
+            "nearest" or "bicubic".
+        outside_value: value of the pixels that fall outside the input frames.
+        frac_bits: bits of the fractional part of the fixed-point coordinates (<= 8).
+    """
+
+    GRID_FORMATS = ("fixed", "float32")
+
+    def __init__(
+        self,
+        cam: BaseCamera,
+        params: Tensor,
+        in_size: tuple[int, int],
+        out_size: tuple[int, int] | None = None,
+        scale: float = 1.0,
+        target_proj: str = "perspective",
+        grid_format: str = "fixed",
+        interp_mode: str = "bilinear",
+        outside_value: int = 0,
+        frac_bits: int = 7,
+    ):
+        if grid_format not in self.GRID_FORMATS:
+            raise ValueError(
+                f"`grid_format` must be one of {self.GRID_FORMATS}, got: {grid_format}."
+            )
+        assert 0 < frac_bits <= 8, f"`frac_bits` must be in [1, 8], got {frac_bits=}."
+        assert (
+            grid_format != "fixed" or max(in_size) < 2**15
+        ), "Fixed-point grids are limited to int16 coordinates."
+        self.in_size = tuple(in_size)
+        self.out_size = self.in_size if out_size is None else tuple(out_size)
+        self.grid_format = grid_format
+        self.interp_mode = interp_mode
+        self.outside_value = outside_value
+        self.frac_bits = frac_bits
+
+        params = params.reshape(1, -1)
+        with torch.no_grad():
+            map_xy, _ = cam.undistortion_map(
+                params, self.in_size, self.out_size, scale, target_proj
+            )
+        map_xy = map_xy[0].float()  # (H', W', 2)
+        if grid_format == "fixed":
+            self.xy_int, self.xy_frac = self._to_fixed_point(map_xy)
+        else:
+            self.grid = map_xy
+
+    @property
+    def device(self) -> torch.device:
+        return (self.xy_int if self.grid_format == "fixed" else self.grid).device
+
+    def nbytes(self) -> int:
+        """Memory footprint of the precomputed grid."""
+        if self.grid_format == "fixed":
+            return self.xy_int.nbytes + self.xy_frac.nbytes
+        return self.grid.nbytes
+
+    def _to_fixed_point(self, map_xy: Tensor) -> tuple[Tensor, Tensor]:
+        """Split normalized sampling coordinates into integer and fractional parts.
+
+        Args:
+            map_xy: (H', W', 2) sampling coordinates normalized to [-1, 1].
+
+        Returns:
+            (H', W', 2) int16 integer parts of the pixel coordinates.
+            (H', W', 2) uint8 fractional parts, in units of 2^-frac_bits pixels.
+        """
+        h, w = self.in_size
+        size = map_xy.new_tensor((w, h))
+        # pixel coordinates, with the origin at the top-left corner of the image.
+        # Coordinates beyond one pixel outside the image are sampled as outside
+        xy = (0.5 * (map_xy + 1) * size).nan_to_num(-1)
+        xy = torch.minimum(xy.clamp(min=-1), size + 1)
+        xy = (xy * (1 << self.frac_bits)).round()
+        xy_int = xy.div(1 << self.frac_bits, rounding_mode="floor")
+        xy_frac = xy - xy_int * (1 << self.frac_bits)
+        return xy_int.to(torch.int16), xy_frac.to(torch.uint8)
+
+    def sampling_grid(self) -> Tensor:
+        """(H', W', 2) float32 sampling coordinates normalized to [-1, 1]."""
+        if self.grid_format == "float32":
+            return self.grid
+        h, w = self.in_size
+        xy = self.xy_int + self.xy_frac * 2.0**-self.frac_bits
+        return xy * xy.new_tensor((2 / w, 2 / h)) - 1
+
+    @torch.no_grad()
+    def __call__(self, frames: Tensor) -> Tensor:
+        """Undistort a batch of frames.
+
+        Args:
+            frames: (B, H, W, C) or (H, W, C) uint8 frames.
+
+        Returns:
+            (B, H', W', C) or (H', W', C) uint8 undistorted frames.
+        """
+        assert frames.dtype == torch.uint8, f"Expected uint8 frames, got {frames.dtype}"
+        is_batched = frames.ndim == 4
+        if not is_batched:
+            frames = frames[None]
+        assert (
+            tuple(frames.shape[1:3]) == self.in_size
+        ), f"Expected frames of size {self.in_size}, got {tuple(frames.shape[1:3])}."
+        b = frames.shape[0]
+        im = frames.to(self.device).permute(0, 3, 1, 2).float() - self.outside_value
+        out = self.outside_value + F.grid_sample(
+            im,
+            self.sampling_grid().expand(b, -1, -1, -1),
+            mode=self.interp_mode,
+            padding_mode="zeros",
+            align_corners=False,
+        )
+        out = out.round_().clamp_(0, 255).to(torch.uint8).permute(0, 2, 3, 1)
+        return out if is_batched else out[0]
+
+    def stream(
+        self, frames: Iterable[Tensor | np.ndarray], batch_size: int = 8
+    ) -> Iterator[Tensor | np.ndarray]:
+        """Undistort a stream of frames, processed in batches.
+
+        Args:
+            frames: iterable of (H, W, C) uint8 frames, e.g. decoded video frames.
+            batch_size: number of frames undistorted at once.
+
+        Yields:
+            (H', W', C) undistorted frames, in the same order and with the same type
+                (NumPy array or tensor) as the input frames.
+        """
+        batch = []
+        for frame in frames:
+            batch.append(frame)
+            if len(batch) == batch_size:
+                yield from self._undistort_list(batch)
+                batch = []
+        if batch:
+            yield from self._undistort_list(batch)
+
+    def _undistort_list(
+        self, frames: list[Tensor | np.ndarray]
+    ) -> list[Tensor | np.ndarray]:
+        is_numpy = isinstance(frames[0], np.ndarray)
+        batch = torch.stack(
+            [torch.from_numpy(f) if is_numpy else f for f in frames]
+        ).to(self.device, non_blocking=True)
+        out = self(batch)
+        if is_numpy:
+            return list(out.cpu().numpy())
+        return list(out)
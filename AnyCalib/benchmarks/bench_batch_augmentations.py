@@ -0,0 +1,95 @@
+"""Time per batch (ms) of the photometric augmentations, per transform.
+
+Each transform is timed when applied per image, as in the DataLoader workers
+(albumentations/OpenCV, if installed), and when applied to the whole batch with
+siclib's batched torch implementation, on CPU and, if available, on GPU.
+
+Usage:
+    python benchmarks/bench_batch_augmentations.py [--size 320 320] [--batch_size 32]
+"""
+
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from siclib.datasets.batch_augmentations import (
+    BatchAdvancedBlur,
+    BatchColorJitter,
+    BatchRandomAdditiveShade,
+)
+
+
+def per_image_transforms() -> dict:
+    """albumentations counterparts of the batched transforms (empty if unavailable)."""
+    try:
+        import albumentations as A
+
+        from siclib.datasets.augmentations import RandomAdditiveShade
+    except ImportError:
+        return {}
+    return {
+        "color_jitter": A.ColorJitter(0.2, 0.2, 0.2, 0.2, p=1),
+        "shade": RandomAdditiveShade(p=1),
+        "blur": A.AdvancedBlur(
+            blur_limit=(3, 7),
+            sigma_x_limit=(0.2, 1.0),
+            sigma_y_limit=(0.2, 1.0),
+            rotate_limit=(-90, 90),
+            beta_limit=(0.5, 8.0),
+            noise_limit=(0.9, 1.1),
+            p=1,
+        ),
+    }
+
+
+def timeit(fn, repeats: int, sync=lambda: None) -> float:
+    fn()  # warmup
+    sync()
+    tic = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    sync()
+    return 1e3 * (time.perf_counter() - tic) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, nargs=2, default=(320, 320))
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    h, w = args.size
+    images = torch.rand(args.batch_size, 3, h, w)
+    images_np = [im.permute(1, 2, 0).numpy().astype(np.float32) for im in images]
+    batched = {
+        "color_jitter": BatchColorJitter(p=1),
+        "shade": BatchRandomAdditiveShade(p=1),
+        "blur": BatchAdvancedBlur(p=1),
+    }
+    per_image = per_image_transforms()
+    devices = ["cpu"] + (["cuda"] if torch.cuda.is_available() else [])
+
+    header = f"{'transform':>14} {'per-image':>10}" + "".join(
+        f" {d:>10}" for d in devices
+    )
+    print(f"ms per batch of {args.batch_size} {h}x{w} images")
+    print(header)
+    for name, transform in batched.items():
+        row = f"{name:>14}"
+        if name in per_image:
+            t = per_image[name]
+            row += f" {timeit(lambda: [t(image=im) for im in images_np], args.repeats):>10.1f}"
+        else:
+            row += f" {'n/a':>10}"
+        for device in devices:
+            x = images.to(device)
+            sync = torch.cuda.synchronize if device == "cuda" else lambda: None
+            row += f" {timeit(lambda: transform(x), args.repeats, sync):>10.1f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Peak memory and runtime of the convex upsampling of `ConvexTangentDecoder`.
+
+Compares the forward pass of the decoder (upsampling weights and convex upsampling)
+with the full `cvx_upsample` and with the tiled `cvx_upsample_tiled`, for increasing
+inference resolutions. On CPU, each configuration runs in a fresh process and the peak
+memory is measured as the increase of the resident set high-water mark (VmHWM, reset
+through /proc/self/clear_refs). On CUDA, `torch.cuda.max_memory_allocated` is used.
+
+Usage:
+    python benchmarks/bench_cvx_upsample.py [--device cuda] [--band_rows 8]
+"""
+
+import argparse
+import multiprocessing as mp
+import time
+
+import torch
+
+from anycalib.model.ray_decoder import ConvexTangentDecoder
+
+# (H, W) input resolutions (the network sees ~320x320 by default)
+RESOLUTIONS = [(322, 322), (644, 854), (1008, 1344), (1512, 2016), (2002, 2996)]
+METHODS = ["cvx_upsample", "tiled"]
+
+
+def get_inputs(h: int, w: int, device: str, tile_rows: int):
+    torch.manual_seed(0)
+    decoder = ConvexTangentDecoder(tile_rows=tile_rows).to(device).eval()
+    feats = torch.randn(1, decoder.in_channels, h // 7, w // 7, device=device)
+    return decoder, feats
+
+
+def _reset_peak_rss() -> int:
+    """Reset the RSS high-water mark (Linux only) and return the current RSS."""
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+    return _read_status("VmRSS")
+
+
+def _read_status(key: str) -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(key):
+                return int(line.split()[1]) * 1024
+    raise KeyError(key)
+
+
+@torch.no_grad()
+def run(method: str, h: int, w: int, device: str, band_rows: int, repeats: int):
+    decoder, feats = get_inputs(h, w, device, band_rows if method == "tiled" else 0)
+    if device == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated()
+    else:
+        base = _reset_peak_rss()
+    decoder(feats)
+    if device == "cuda":
+        torch.cuda.synchronize()
+        peak = torch.cuda.max_memory_allocated() - base
+    else:
+        peak = _read_status("VmHWM") - base
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        decoder(feats)
+    if device == "cuda":
+        torch.cuda.synchronize()
+    return peak, (time.perf_counter() - t0) / repeats
+
+
+def _worker(queue, *args):
+    queue.put(run(*args))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--band_rows", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+    print(f"{'resolution':>12} {'method':>14} {'peak [MiB]':>11} {'time [ms]':>10}")
+    for h, w in RESOLUTIONS:
+        # check that the tiled version gives the same rays
+        decoder, feats = get_inputs(h, w, args.device, 0)
+        with torch.no_grad():
+            rays = decoder(feats)["rays"]
+            decoder.tile_rows = args.band_rows
+            assert torch.allclose(rays, decoder(feats)["rays"], rtol=0, atol=1e-6)
+        del decoder, feats, rays
+        for method in METHODS:
+            params = (method, h, w, args.device, args.band_rows, args.repeats)
+            if args.device == "cuda":
+                peak, t = run(*params)
+            else:
+                queue = ctx.Queue()
+                p = ctx.Process(target=_worker, args=(queue, *params))
+                p.start()
+                peak, t = queue.get()
+                p.join()
+            print(
+                f"{f'{h}x{w}':>12} {method:>14} {peak / 2**20:>11.1f} {1e3 * t:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
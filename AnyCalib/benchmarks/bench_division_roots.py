@@ -0,0 +1,68 @@
+"""Runtime of the root solvers of the Division model projection.
+
+Compares the closed-form solvers ('quadratic' for num_k=1, 'quartic' for num_k=2)
+with the eigenvalues of the companion matrix, for the forward pass and for the
+forward + backward pass (implicit function theorem), over batches of random rays.
+
+Usage:
+    python benchmarks/bench_division_roots.py [--num_points 100000] [--dtype float32]
+"""
+
+import argparse
+import time
+
+import torch
+
+from anycalib.cameras.division import division_radii
+
+
+def timeit(fun, repeats: int) -> float:
+    fun()  # warm-up
+    tic = time.perf_counter()
+    for _ in range(repeats):
+        fun()
+    return (time.perf_counter() - tic) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_points", type=int, default=100_000)
+    parser.add_argument("--dtype", type=str, default="float32")
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    dtype = getattr(torch, args.dtype)
+
+    theta = torch.rand(args.num_points, dtype=dtype, device=args.device) * 1.4
+    R, Z = torch.sin(theta), torch.cos(theta)
+    cases = {
+        "division:1": (torch.tensor([-0.3]), "quadratic"),
+        "division:2": (torch.tensor([-0.1, 0.01]), "quartic"),
+    }
+    print(
+        f"{'case':>11} {'pass':>9} {'companion [ms]':>15} {'closed [ms]':>12} "
+        f"{'speedup':>8} {'max diff':>9}"
+    )
+    for name, (k, solver) in cases.items():
+        k = k.to(dtype=dtype, device=args.device)
+        for backward in (False, True):
+
+            def run(solver: str) -> torch.Tensor:
+                k_ = k.clone().requires_grad_(backward)
+                r, _ = division_radii(R, Z, k_, solver=solver)
+                if backward:
+                    r.sum().backward()
+                return r.detach()
+
+            t_comp = timeit(lambda: run("companion"), args.repeats)
+            t_closed = timeit(lambda: run(solver), args.repeats)
+            diff = (run("companion") - run(solver))[1:].abs().max().item()
+            print(
+                f"{name:>11} {'fwd+bwd' if backward else 'fwd':>9} "
+                f"{1e3 * t_comp:>15.1f} {1e3 * t_closed:>12.1f} "
+                f"{t_comp / t_closed:>7.1f}x {diff:>9.1e}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Throughput (samples/sec) of siclib's export_predictions.
+
+A dummy model returns dense per-pixel predictions (e.g. ray and tangent fields), and
+performs a configurable amount of compute per batch so that the overlap of the HDF5
+writes with the forward passes is measured. Each configuration of the writer
+(synchronous/background thread, chunking and compression) reports the throughput and
+the size of the resulting file.
+
+Usage:
+    python benchmarks/bench_export_predictions.py [--size 320 320] [--batch_size 8]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import torch
+
+from siclib.utils.export_predictions import export_predictions
+
+
+class DummyModel(torch.nn.Module):
+    def __init__(self, size: tuple[int, int], work: int):
+        super().__init__()
+        self.size = size
+        self.work = work
+
+    def forward(self, data: dict) -> dict:
+        b, (h, w) = len(data["name"]), self.size
+        if self.work > 0:  # simulated forward pass
+            x = torch.randn(self.work, self.work, device=data["image"].device)
+            for _ in range(4):
+                x = torch.tanh(x @ x)
+        # smooth fields, as the predictions are
+        t = torch.linspace(-1, 1, h * w, device=data["image"].device)
+        rays = torch.stack((t, t.flip(0), torch.ones_like(t)), -1).expand(b, -1, -1)
+        return {
+            "rays": rays + 1e-3 * torch.rand_like(rays),
+            "tangent_coords": rays[..., :2].contiguous(),
+            "intrinsics": t.new_ones(b, 6),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, nargs=2, default=(320, 320))
+    parser.add_argument("--num_batches", type=int, default=16)
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument(
+        "--work", type=int, default=512, help="size of simulated matmuls"
+    )
+    args = parser.parse_args()
+
+    model = DummyModel(tuple(args.size), args.work)
+    loader = [
+        {
+            "name": [f"{i}_{j}" for j in range(args.batch_size)],
+            "image": torch.zeros(args.batch_size, 3, 1, 1),
+        }
+        for i in range(args.num_batches)
+    ]
+    num_samples = args.num_batches * args.batch_size
+    configs = {
+        "sync": dict(queue_size=0),
+        "async": dict(queue_size=8),
+        "async chunked": dict(queue_size=8, chunked=True),
+        "async lzf": dict(queue_size=8, compression="lzf"),
+        "async gzip-4": dict(queue_size=8, compression="gzip", compression_opts=4),
+        "async lzf half": dict(queue_size=8, compression="lzf", as_half=True),
+    }
+    print(f"{'writer':>16} {'samples/s':>10} {'size [MB]':>10}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, kwargs in configs.items():
+            path = os.path.join(tmp_dir, f"{name.replace(' ', '_')}.h5")
+            tic = time.perf_counter()
+            export_predictions(loader, model, path, verbose=False, **kwargs)
+            throughput = num_samples / (time.perf_counter() - tic)
+            size = os.path.getsize(path) / 2**20
+            print(f"{name:>16} {throughput:>10.1f} {size:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Peak memory and runtime of the nonlinear refinement of the intrinsics.
+
+Compares GaussNewtonCalib/LevMarCalib materializing the (N, 2, D) Jacobians of all
+the correspondences (chunk_size=0) with accumulating the normal equations over chunks
+of correspondences, sequentially or in a thread pool. Each configuration runs in a
+fresh process and, on CPU, the peak memory is measured as the increase of the
+resident set high-water mark (VmHWM, reset through /proc/self/clear_refs).
+
+Usage:
+    python benchmarks/bench_gauss_newton.py [--num_points 102400] [--num_threads 4]
+"""
+
+import argparse
+import multiprocessing as mp
+import time
+
+import torch
+
+from anycalib.cameras import KannalaBrandt
+from anycalib.optim import GaussNewtonCalib, LevMarCalib
+
+
+def _reset_peak_rss() -> int:
+    """Reset the RSS high-water mark (Linux only) and return the current RSS."""
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+    return _read_status("VmRSS")
+
+
+def _read_status(key: str) -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(key):
+                return int(line.split()[1]) * 1024
+    raise KeyError(key)
+
+
+def get_problem(num_points: int):
+    torch.manual_seed(0)
+    cam = KannalaBrandt(num_k=4)
+    params = torch.tensor([[400.0, 410, 320, 240, 0.05, -0.01, 1e-3, -1e-4]])
+    w = 640
+    h = num_points // w
+    im_coords = cam.pixel_grid_coords(h, w, params, 0.5).view(1, -1, 2)
+    bearings, _ = cam.unproject(params, im_coords)
+    bearings = torch.nn.functional.normalize(
+        bearings + 1e-3 * torch.randn_like(bearings), dim=-1
+    )
+    params0 = params * torch.tensor([1.05, 0.95, 1.01, 0.99, 0.5, 0.5, 0.5, 0.5])
+    return cam, params0, im_coords, bearings
+
+
+def run(method: str, cfg: dict, num_points: int, queue: mp.Queue):
+    torch.set_num_threads(1)  # intra-op threads would compete with the thread pool
+    cam, params0, im_coords, bearings = get_problem(num_points)
+    optimizer = (GaussNewtonCalib if method == "gauss_newton" else LevMarCalib)(cfg)
+    with torch.inference_mode():
+        rss0 = _reset_peak_rss()
+        tic = time.perf_counter()
+        params, _, cost, _ = optimizer(cam, params0, im_coords, bearings)
+        elapsed = time.perf_counter() - tic
+        peak = _read_status("VmHWM") - rss0
+    queue.put((elapsed, peak, cost.item()))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_points", type=int, default=102_400)
+    parser.add_argument("--chunk_size", type=int, default=8192)
+    parser.add_argument("--num_threads", type=int, default=4)
+    args = parser.parse_args()
+
+    configs = {
+        "dense": {},
+        "chunked": {"chunk_size": args.chunk_size},
+        f"chunked x{args.num_threads}": {
+            "chunk_size": args.chunk_size,
+            "num_threads": args.num_threads,
+        },
+    }
+    ctx = mp.get_context("spawn")
+    print(
+        f"{'method':>12} {'mode':>12} {'time [ms]':>10} {'peak [MB]':>10} {'cost':>9}"
+    )
+    for method in ("gauss_newton", "lev_mar"):
+        for name, cfg in configs.items():
+            queue = ctx.Queue()
+            proc = ctx.Process(target=run, args=(method, cfg, args.num_points, queue))
+            proc.start()
+            elapsed, peak, cost = queue.get()
+            proc.join()
+            print(
+                f"{method:>12} {name:>12} {1e3 * elapsed:>10.1f} "
+                f"{peak / 2**20:>10.1f} {cost:>9.2e}"
+            )
+
+
+if __name__ == "__main__":
+    main()
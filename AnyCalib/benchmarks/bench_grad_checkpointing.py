@@ -0,0 +1,105 @@
+"""Memory vs. throughput of activation checkpointing in siclib's DINOv2 backbone.
+
+A training step (forward, backward and AdamW update) of a randomly initialized
+DinoVisionTransformer is timed with activation checkpointing enabled on an increasing
+number of blocks. For each configuration, the report lists the memory of the activations
+saved for the backward pass (measured with autograd hooks, so also on CPU), the peak of
+allocated CUDA memory (on GPU), and the training throughput. The time of the optimizer
+step is also reported for the default, foreach and fused implementations of AdamW.
+
+Usage:
+    python benchmarks/bench_grad_checkpointing.py [--model vit_large] [--size 322 322]
+        [--batch_size 8]
+"""
+
+import argparse
+import time
+
+import torch
+
+from siclib.models.encoders import vision_transformer
+
+
+def saved_activations_mb(step) -> float:
+    """Memory (MB) of the tensors saved for the backward pass during `step()`."""
+    nbytes = 0
+
+    def pack(t):
+        nonlocal nbytes
+        nbytes += t.numel() * t.element_size()
+        return t
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        step()
+    return nbytes / 2**20
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", type=str, default="vit_small")
+    parser.add_argument("--size", type=int, nargs=2, default=(224, 224))
+    parser.add_argument("--batch_size", type=int, default=4)
+    parser.add_argument("--steps", type=int, default=3)
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    sync = torch.cuda.synchronize if device == "cuda" else lambda: None
+    model = getattr(vision_transformer, args.model)(
+        img_size=518, patch_size=14, init_values=1.0, block_chunks=0
+    ).to(device)
+    model.train()
+    params = [p for p in model.parameters() if p.requires_grad]
+    images = torch.randn(args.batch_size, 3, *args.size, device=device)
+
+    def loss() -> torch.Tensor:
+        return model.forward_features(images)["x_norm_patchtokens"].square().mean()
+
+    def timed_steps(optimizer, n_steps) -> tuple[float, float]:
+        """Average time (s) of the forward/backward pass and of the optimizer step."""
+        t_fwd_bwd = t_opt = 0.0
+        for _ in range(n_steps):
+            sync()
+            tic = time.perf_counter()
+            optimizer.zero_grad()
+            loss().backward()
+            sync()
+            toc = time.perf_counter()
+            optimizer.step()
+            sync()
+            t_fwd_bwd += toc - tic
+            t_opt += time.perf_counter() - toc
+        return t_fwd_bwd / n_steps, t_opt / n_steps
+
+    n_blocks = len(model.blocks)
+    print(
+        f"{args.model}, {n_blocks} blocks, batch of {args.batch_size} {args.size} images"
+    )
+    print(f"{'ckpt blocks':>12} {'saved [MB]':>11} {'peak [MB]':>10} {'img/s':>8}")
+    optimizer = torch.optim.AdamW(params, lr=1e-5)
+    for n_ckpt in sorted({0, n_blocks // 4, n_blocks // 2, n_blocks}):
+        model.set_grad_checkpointing(n_ckpt)
+        saved = saved_activations_mb(loss)
+        if device == "cuda":
+            torch.cuda.reset_peak_memory_stats()
+        timed_steps(optimizer, 1)  # warmup
+        t_fwd_bwd, t_opt = timed_steps(optimizer, args.steps)
+        peak = float("nan")
+        if device == "cuda":
+            peak = torch.cuda.max_memory_allocated() / 2**20
+        throughput = args.batch_size / (t_fwd_bwd + t_opt)
+        print(f"{n_ckpt:>12} {saved:>11.1f} {peak:>10.1f} {throughput:>8.2f}")
+
+    print(f"\n{'AdamW impl':>12} {'step [ms]':>10}")
+    model.set_grad_checkpointing(False)
+    for impl in (None, "foreach", "fused"):
+        # as set by `siclib.train.pack_lr_parameters` with `train.optimizer_impl`
+        optimizer = torch.optim.AdamW(
+            params, lr=1e-5, **({} if impl is None else {impl: True})
+        )
+        timed_steps(optimizer, 1)  # warmup (allocates the states)
+        _, t_opt = timed_steps(optimizer, args.steps)
+        print(f"{str(impl):>12} {1e3 * t_opt:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
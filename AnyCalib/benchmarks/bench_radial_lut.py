@@ -0,0 +1,89 @@
+"""Runtime of exact vs. LUT-based radial inversions.
+
+Times KannalaBrandt.unproject, Radial.unproject (Newton iterations),
+Division.project (closed-form quartic) and Division.undistort_image for a
+~1MP grid of pixels, with and without the radial lookup table.
+
+Usage:
+    python benchmarks/bench_radial_lut.py [--lut_size 1024] [--dtype float32]
+"""
+
+import argparse
+import time
+
+import torch
+
+from anycalib.cameras import Division, KannalaBrandt, Radial
+
+H, W = 960, 1280
+
+
+def timeit(fun, repeats: int) -> float:
+    fun()  # warm-up
+    tic = time.perf_counter()
+    for _ in range(repeats):
+        fun()
+    return (time.perf_counter() - tic) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lut_size", type=int, default=1024)
+    parser.add_argument("--dtype", type=str, default="float32")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    dtype = getattr(torch, args.dtype)
+
+    cases = {
+        "kb:4 unproject": (
+            KannalaBrandt,
+            {"num_k": 4},
+            [500.0, 500, 640, 480, -0.04, -0.005, -5e-4, -9e-5],
+            "unproject",
+        ),
+        "radial:2 unproject": (
+            Radial,
+            {"num_k": 2},
+            [900.0, 900, 640, 480, -0.2, 0.05],
+            "unproject",
+        ),
+        "division:2 project": (
+            Division,
+            {"num_k": 2},
+            [500.0, 500, 640, 480, -0.1, 0.01],
+            "project",
+        ),
+        "division:2 undistort": (
+            Division,
+            {"num_k": 2},
+            [500.0, 500, 640, 480, -0.1, 0.01],
+            "undistort",
+        ),
+    }
+    print(f"{'case':>22} {'exact [ms]':>11} {'lut [ms]':>9} {'max diff':>9}")
+    for name, (cam_cls, kwargs, params, op) in cases.items():
+        params = torch.tensor(params, dtype=dtype)
+        exact = cam_cls(**kwargs)
+        lut = cam_cls(**kwargs, lut_size=args.lut_size)
+        im_coords = exact.pixel_grid_coords(H, W, params, 0.5).view(-1, 2)
+        if op == "unproject":
+            inputs = (params, im_coords)
+        elif op == "project":
+            inputs = (params, exact.unproject(params, im_coords)[0])
+        else:
+            inputs = (torch.rand(3, H, W, dtype=dtype), params[None])
+        funs = {
+            cam: getattr(cam, "undistort_image" if op == "undistort" else op)
+            for cam in (exact, lut)
+        }
+        t_exact = timeit(lambda: funs[exact](*inputs), args.repeats)
+        t_lut = timeit(lambda: funs[lut](*inputs), args.repeats)
+        out_exact, out_lut = funs[exact](*inputs), funs[lut](*inputs)
+        if op != "undistort":
+            out_exact, out_lut = out_exact[0], out_lut[0]
+        diff = (out_exact - out_lut).abs().max().item()
+        print(f"{name:>22} {1e3 * t_exact:>11.1f} {1e3 * t_lut:>9.1f} {diff:>9.1e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Hypotheses evaluated and wall time of fixed vs. adaptive RANSAC.
+
+Synthetic 2D-3D correspondences (20k, as `max_correspondences`) are generated for
+several camera models with a given fraction of outliers.
+
+Usage:
+    python benchmarks/bench_ransac.py [--outlier_ratio 0.3] [--num_threads 4]
+"""
+
+import argparse
+
+import torch
+
+from anycalib.cameras.factory import CameraFactory
+from anycalib.ransac import RANSAC
+
+PARAMS = {
+    "pinhole": [600.0, 550, 320, 240],
+    "radial:1": [600.0, 550, 320, 240, -0.1],
+    "kb:4": [400.0, 380, 320, 240, -0.04, -0.005, -5e-4, -9e-5],
+    "eucm": [400.0, 380, 320, 240, 0.6, 1.1],
+    "division:2": [400.0, 380, 320, 240, -0.1, 0.01],
+}
+
+
+def get_correspondences(cam_id: str, outlier_ratio: float, device: str):
+    torch.manual_seed(0)
+    cam = CameraFactory.create_from_id(cam_id)
+    params = torch.tensor(PARAMS[cam_id], device=device)
+    h, w = 120, 160  # 19.2k correspondences
+    im_coords = cam.pixel_grid_coords(h, w, params, 0.5).view(-1, 2) * 640 / w
+    bearings, _ = cam.unproject(params, im_coords)
+    n_out = int(outlier_ratio * len(bearings))
+    outliers = torch.randn(n_out, 3, device=device)
+    outliers[:, 2] = outliers[:, 2].abs() + 0.5
+    bearings[:n_out] = outliers / outliers.norm(dim=-1, keepdim=True)
+    return cam, params, im_coords, bearings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--outlier_ratio", type=float, default=0.3)
+    parser.add_argument("--num_threads", type=int, default=4)
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    variants = {
+        "fixed": RANSAC({"adaptive": False}),
+        "adaptive": RANSAC({"adaptive": True, "num_threads": args.num_threads}),
+    }
+    print(
+        f"{'cam_id':>11} {'variant':>9} {'hypotheses':>11} {'scored':>7} "
+        f"{'time [ms]':>10} {'inliers':>8}"
+    )
+    for cam_id in PARAMS:
+        cam, _, im_coords, bearings = get_correspondences(
+            cam_id, args.outlier_ratio, args.device
+        )
+        for name, ransac in variants.items():
+            ransac(cam, im_coords, bearings)  # warm-up
+            t = 0.0
+            for _ in range(args.repeats):
+                _, inliers, info = ransac(cam, im_coords, bearings, return_info=True)
+                t += info["time"] / args.repeats
+            print(
+                f"{cam_id:>11} {name:>9} {info['n_hypotheses']:>11} "
+                f"{info['n_scored']:>7} {1e3 * t:>10.1f} {inliers.float().mean():>8.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
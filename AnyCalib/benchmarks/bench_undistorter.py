@@ -0,0 +1,74 @@
+"""Throughput (frames/sec) of video undistortion.
+
+Compares BaseCamera.undistort_image, which recomputes the sampling grid for every
+call and works on float images, with an Undistorter, which precomputes the grid once
+and processes batches of uint8 frames, for each grid format.
+
+Usage:
+    python benchmarks/bench_undistorter.py [--size 1440 1440] [--batch_size 8]
+"""
+
+import argparse
+import time
+
+import torch
+
+from anycalib.cameras import KannalaBrandt
+from anycalib.undistorter import Undistorter
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, nargs=2, default=(1440, 1440))
+    parser.add_argument("--num_frames", type=int, default=32)
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+    h, w = args.size
+    device = torch.device(args.device)
+
+    cam = KannalaBrandt()
+    f = 0.3 * max(h, w)
+    params = torch.tensor([f, f, w / 2, h / 2, 0.02, -0.005, 0.001, 0.0], device=device)
+    frames = torch.randint(
+        0, 256, (args.num_frames, h, w, 3), dtype=torch.uint8, device=device
+    )
+
+    def sync():
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+
+    def fps(fun) -> float:
+        fun(frames[: args.batch_size])  # warm-up
+        sync()
+        tic = time.perf_counter()
+        fun(frames)
+        sync()
+        return args.num_frames / (time.perf_counter() - tic)
+
+    def per_frame(frames: torch.Tensor):
+        for frame in frames:
+            im = frame.permute(2, 0, 1).float()
+            cam.undistort_image(im, params[None]).round().clamp(0, 255).byte()
+
+    print(f"{'method':>22} {'grid [MB]':>10} {'init [ms]':>10} {'fps':>8}")
+    print(f"{'undistort_image':>22} {'-':>10} {'-':>10} {fps(per_frame):>8.1f}")
+    for grid_format in Undistorter.GRID_FORMATS:
+        sync()
+        tic = time.perf_counter()
+        undistorter = Undistorter(cam, params, (h, w), grid_format=grid_format)
+        sync()
+        t_init = time.perf_counter() - tic
+
+        def stream(frames: torch.Tensor):
+            for _ in undistorter.stream(frames, args.batch_size):
+                pass
+
+        print(
+            f"{'Undistorter ' + grid_format:>22} {undistorter.nbytes() / 2**20:>10.1f} "
+            f"{1e3 * t_init:>10.1f} {fps(stream):>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
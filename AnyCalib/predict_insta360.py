@@ -23,6 +23,8 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 try:
     from anycalib import AnyCalib
+    from anycalib.model.field_cache import RayFieldCache
+    from anycalib.image_circle import ImageCircleCache, image_circle_mask
 except ImportError:
     print("Error: Could not import AnyCalib.")
     print("Make sure you are in the AnyCalib directory and have installed it with 'pip install -e .'")
@@ -46,10 +48,18 @@ def get_default_config() -> dict:
     """Return default configuration."""
     return {
         "model": {
-            "model_id": "anycalib_gen"
+            "model_id": "anycalib_gen",
+            "tile_rows": 0
         },
         "camera": {
-            "cam_id": "kb:4"
+            "cam_id": "kb:4",
+            "sweep_cam_ids": [
+                "kb:1", "kb:2", "kb:3", "kb:4", "ucm", "eucm",
+                "division:1", "division:2", "division:3",
+                "radial:1", "radial:2", "radial:3"
+            ],
+            "criterion": "bic",
+            "num_workers": 0
         },
         "input": {
             "image_dir": "../photos",
@@ -64,13 +74,37 @@ def get_default_config() -> dict:
         },
         "optimization": {
             "nonlin_opt_method": "gauss_newton",
+            "nonlin_opt_conf": {},
             "init_with_sac": False,
             "fallback_to_sac": True,
             "rm_borders": 0,
-            "sample_size": -1
+            "sample_size": -1,
+            "use_covs": False,
+            "tta": False
         },
         "device": {
             "use_cuda": True
+        },
+        "cache": {
+            "enabled": True,
+            "cache_dir": ".anycalib_cache"
+        },
+        "image_circle": {
+            "enabled": False,
+            "threshold": 0.05,
+            "margin": 0.02,
+            "cache_file": ".anycalib_cache/image_circles.json"
+        },
+        "stitching": {
+            "rig_file": "rig_pro2.json",
+            "projection": "equirect",
+            "height": 1920,
+            "width": 3840,
+            "max_lenses": 2,
+            "max_angle": 100.0,
+            "feather": 32.0,
+            "maps_cache_dir": ".anycalib_cache/pano_maps",
+            "output_file": "anycalib_results/pano_equirect.jpg"
         }
     }
 
@@ -105,10 +139,14 @@ def load_model(config: dict, device: torch.device) -> AnyCalib:
         model = AnyCalib(
             model_id=model_id,
             nonlin_opt_method=opt_config.get("nonlin_opt_method", "gauss_newton"),
+            nonlin_opt_conf=opt_config.get("nonlin_opt_conf") or None,
             init_with_sac=opt_config.get("init_with_sac", False),
             fallback_to_sac=opt_config.get("fallback_to_sac", True),
             rm_borders=opt_config.get("rm_borders", 0),
-            sample_size=opt_config.get("sample_size", -1)
+            sample_size=opt_config.get("sample_size", -1),
+            use_covs=opt_config.get("use_covs", False),
+            tta=opt_config.get("tta", False),
+            tile_rows=model_config.get("tile_rows", 0)
         ).to(device)
         model.eval()
         return model
@@ -117,6 +155,26 @@ def load_model(config: dict, device: torch.device) -> AnyCalib:
         sys.exit(1)
 
 
+def get_field_cache(config: dict):
+    """Create the on-disk cache of predicted ray fields (None if disabled)."""
+    cache_config = config.get("cache", {})
+    if not cache_config.get("enabled", True):
+        return None
+    cache_dir = cache_config.get("cache_dir", ".anycalib_cache")
+    model_id = config.get("model", {}).get("model_id", "anycalib_gen")
+    print(f"Ray-field cache: {cache_dir}")
+    return RayFieldCache(cache_dir, model_id)
+
+
+def get_image_circle_cache(config: dict):
+    """Create the cache of per-lens image circles (None if disabled)."""
+    circle_config = get_default_config()["image_circle"] | config.get("image_circle", {})
+    if not circle_config["enabled"]:
+        return None, circle_config["margin"]
+    cache = ImageCircleCache(circle_config["cache_file"], circle_config["threshold"])
+    return cache, circle_config["margin"]
+
+
 def get_image_paths(config: dict) -> list:
     """Generate list of image paths based on configuration."""
     input_config = config.get("input", {})
@@ -184,13 +242,24 @@ def run_calibration(config: dict):
     
     # Load model
     model = load_model(config, device)
+    field_cache = get_field_cache(config)
+    circle_cache, circle_margin = get_image_circle_cache(config)
     
     # Get image paths
     image_paths = get_image_paths(config)
     
     # Camera model
-    cam_id = config.get("camera", {}).get("cam_id", "kb:4")
+    camera_config = config.get("camera", {})
+    cam_id = camera_config.get("cam_id", "kb:4")
     print(f"Camera model: {cam_id}")
+    sweep = cam_id == "auto"
+    if sweep:
+        sweep_cam_ids = camera_config.get(
+            "sweep_cam_ids", get_default_config()["camera"]["sweep_cam_ids"]
+        )
+        criterion = camera_config.get("criterion", "bic")
+        num_workers = camera_config.get("num_workers", 0)
+        print(f"Selecting among {sweep_cam_ids} with {criterion.upper()}")
     
     # Output settings
     output_config = config.get("output", {})
@@ -221,13 +290,47 @@ def run_calibration(config: dict):
             img_np = np.array(pil_img)
             img_tensor = torch.tensor(img_np, dtype=torch.float32, device=device).permute(2, 0, 1) / 255.0
             
+            # Pixels inside the fisheye image circle (detected once per lens)
+            valid_mask = None
+            if circle_cache is not None:
+                circle = circle_cache.get(f"lens_{idx}", img_tensor)
+                if circle is not None:
+                    valid_mask = image_circle_mask(circle, img_tensor.shape[-2:], circle_margin)
+                    print(f"    Image circle: center=({circle[0]:.1f}, {circle[1]:.1f}), radius={circle[2]:.1f} "
+                          f"({100 * valid_mask.float().mean():.1f}% of the pixels)")
+            
             # Run prediction
             with torch.no_grad():
-                output = model.predict(img_tensor, cam_id=cam_id)
+                if sweep:
+                    output = model.predict_sweep(
+                        img_tensor,
+                        cam_ids=sweep_cam_ids,
+                        criterion=criterion,
+                        num_workers=num_workers,
+                        field_cache=field_cache,
+                        valid_mask=valid_mask,
+                    )
+                else:
+                    output = model.predict(
+                        img_tensor, cam_id=cam_id, field_cache=field_cache, valid_mask=valid_mask
+                    )
             
             # Extract intrinsics
             intrinsics = output["intrinsics"].cpu().numpy()
-            results[filename] = intrinsics.tolist()
+            if sweep:
+                results[filename] = {
+                    "cam_id": output["cam_id"],
+                    "intrinsics": intrinsics.tolist(),
+                    "ranking": [
+                        {"cam_id": fit["cam_id"], "cost": fit["cost"], "score": fit["score"]}
+                        for fit in output["ranking"]
+                    ],
+                }
+                print(f"    Selected camera model: {output['cam_id']}")
+                for fit in output["ranking"]:
+                    print(f"      {fit['cam_id']:>12}: cost={fit['cost']:.3e}, score={fit['score']:.1f}")
+            else:
+                results[filename] = intrinsics.tolist()
             
             # Print results
             print(f"    Intrinsics: fx={intrinsics[0]:.2f}, fy={intrinsics[1]:.2f}, cx={intrinsics[2]:.2f}, cy={intrinsics[3]:.2f}")
@@ -235,7 +338,9 @@ def run_calibration(config: dict):
                 print(f"    Distortion: {[f'{d:.6f}' for d in intrinsics[4:]]}")
             
             # Save undistorted image
-            if save_undistorted:
+            if save_undistorted and sweep and output["cam_id"] != "kb:4":
+                print("    Skipping undistortion (only implemented for kb:4)")
+            elif save_undistorted:
                 save_undistorted_image(filepath, intrinsics, output_dir, undistorted_prefix, idx)
             
         except Exception as e:
@@ -274,6 +379,11 @@ For detailed configuration options, see config.json or the project README.
         default='config.json',
         help='Path to configuration JSON file (default: config.json)'
     )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Do not read/write the on-disk cache of predicted ray fields'
+    )
     parser.add_argument(
         '--print-config',
         action='store_true',
@@ -292,6 +402,8 @@ For detailed configuration options, see config.json or the project README.
     print("="*50)
     
     config = load_config(args.config)
+    if args.no_cache:
+        config.setdefault("cache", {})["enabled"] = False
     run_calibration(config)
 
 
@@ -275,22 +275,30 @@ class DeepCalibAugmentations(BaseAugmentation):
 
 
 class GeoCalibAugmentations(BaseAugmentation):
-    default_conf = {"p": 1.0}
+    default_conf = {
+        "p": 1.0,
+        # set to False when these transforms are applied to whole batches instead (see
+        # `batch_augmentations.disable_batched_transforms`)
+        "color_jitter": True,
+        "blur": True,
+    }
 
     def _init(self, conf):
+        color_jitter = (
+            [A.ColorJitter(brightness=0.2, contrast=0.2, saturation=0.2, hue=0.2, p=0.4)]
+            if conf.color_jitter
+            else []
+        )
         self.color_transforms = [
             A.RandomGamma(gamma_limit=(80, 180), p=0.8),
             A.RandomToneCurve(scale=0.1, p=0.5),
             A.RandomBrightnessContrast(p=0.5),
-            A.ColorJitter(brightness=0.2, contrast=0.2, saturation=0.2, hue=0.2, p=0.4),
+            *color_jitter,
             A.OneOf([A.ToGray(p=0.1), A.ToSepia(p=0.1), IdentityTransform(p=0.8)], p=1),
         ]
 
-        self.noise_transforms = [
-            A.GaussNoise(var_limit=(5.0, 112.0), mean=0, per_channel=True, p=0.75),
-            A.ImageCompression(quality_lower=20, quality_upper=100, p=1),
-            A.ISONoise(color_shift=(0.01, 0.05), intensity=(0.1, 0.5), p=0.5),
-            A.OneOrOther(
+        if conf.blur:
+            blur_and_sharpen = A.OneOrOther(
                 first=A.Compose(
                     [
                         A.AdvancedBlur(
@@ -319,7 +327,15 @@ class GeoCalibAugmentations(BaseAugmentation):
                         ),
                     ]
                 ),
-            ),
+            )
+        else:
+            blur_and_sharpen = A.Sharpen(p=0.5, alpha=(0.2, 0.5), lightness=(0.5, 1.0))
+
+        self.noise_transforms = [
+            A.GaussNoise(var_limit=(5.0, 112.0), mean=0, per_channel=True, p=0.75),
+            A.ImageCompression(quality_lower=20, quality_upper=100, p=1),
+            A.ISONoise(color_shift=(0.01, 0.05), intensity=(0.1, 0.5), p=0.5),
+            blur_and_sharpen,
         ]
 
         self.image_transforms = [
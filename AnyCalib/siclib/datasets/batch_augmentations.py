@@ -0,0 +1,345 @@
+"""Photometric augmentations applied to whole (collated) batches with torch.
+
+The augmentations of `augmentations.py` are applied to each image in the DataLoader workers with
+albumentations/OpenCV, and some of them, e.g. the large Gaussian blurs of `RandomAdditiveShade`,
+dominate the cost of data loading. The transforms of this module sample the parameters of each
+image from the same distributions as their albumentations counterparts, but are applied to the
+whole batch at once, after collation and, typically, on the GPU. All of them take and return
+(B, C, H, W) images with values in [0, 1].
+"""
+
+from math import ceil
+
+import torch
+import torch.nn.functional as F
+from omegaconf import OmegaConf
+from torch import Tensor
+
+# mypy: ignore-errors
+
+
+def uniform(n: int, limits, ref: Tensor) -> Tensor:
+    """(n,) samples of U(limits[0], limits[1])."""
+    return limits[0] + (limits[1] - limits[0]) * torch.rand(n, device=ref.device)
+
+
+def randint(low: Tensor, high: Tensor) -> Tensor:
+    """Random integers in [low, high), as `np.random.randint`, for tensors of bounds."""
+    return low + (torch.rand_like(low.float()) * (high - low)).long()
+
+
+def rgb_to_gray(images: Tensor) -> Tensor:
+    """(B, 1, H, W) luma of RGB images (as OpenCV's RGB2GRAY)."""
+    weights = images.new_tensor([0.299, 0.587, 0.114]).view(1, 3, 1, 1)
+    return (images * weights).sum(1, keepdim=True)
+
+
+def filter2d(images: Tensor, kernels: Tensor) -> Tensor:
+    """Filter each image of a batch with its own kernel.
+
+    Args:
+        images: (B, C, H, W) images.
+        kernels: (B, kh, kw) kernels with odd sizes.
+
+    Returns:
+        (B, C, H, W) filtered images, with reflected borders (OpenCV's BORDER_REFLECT_101).
+    """
+    b, c, h, w = images.shape
+    kh, kw = kernels.shape[-2:]
+    ph, pw = kh // 2, kw // 2
+    mode = "reflect" if ph < h and pw < w else "replicate"
+    x = F.pad(images.reshape(1, b * c, h, w), (pw, pw, ph, ph), mode=mode)
+    weight = kernels.to(images.dtype).repeat_interleave(c, dim=0)[:, None]
+    return F.conv2d(x, weight, groups=b * c).view(b, c, h, w)
+
+
+class BatchTransform:
+    """Transform applied to each image of a batch with probability `p`."""
+
+    def __init__(self, p: float = 0.5):
+        self.p = p
+
+    @torch.no_grad()
+    def __call__(self, images: Tensor) -> Tensor:
+        apply = torch.rand(len(images), device=images.device) < self.p
+        if not apply.any():
+            return images
+        if apply.all():
+            return self.apply(images)
+        images = images.clone()
+        images[apply] = self.apply(images[apply])
+        return images
+
+    def apply(self, images: Tensor) -> Tensor:
+        raise NotImplementedError
+
+
+class BatchRandomAdditiveShade(BatchTransform):
+    """Batched version of `augmentations.RandomAdditiveShade`.
+
+    The ellipses are rasterized and blurred at `1 / downscale` of the image resolution (with a
+    proportionally smaller kernel) and bilinearly upsampled. Since the blur kernels span
+    hundreds of pixels, the resulting masks are practically the same, at a fraction of the cost.
+    """
+
+    def __init__(
+        self,
+        nb_ellipses: int = 10,
+        transparency_limit=(-0.5, 0.8),
+        kernel_size_limit=(150, 350),
+        downscale: int = 4,
+        p: float = 0.5,
+    ):
+        super().__init__(p)
+        self.nb_ellipses = nb_ellipses
+        self.transparency_limit = transparency_limit
+        self.kernel_size_limit = kernel_size_limit
+        self.downscale = downscale
+
+    def apply(self, images: Tensor) -> Tensor:
+        b, _, h, w = images.shape
+        n, s, dev = self.nb_ellipses, self.downscale, images.device
+
+        # ellipses
+        min_dim = min(h, w) / 4
+        ax = (torch.rand(b, n, device=dev) * min_dim).clamp(min=min_dim / 5).long()
+        ay = (torch.rand(b, n, device=dev) * min_dim).clamp(min=min_dim / 5).long()
+        max_rad = torch.maximum(ax, ay)
+        x = randint(max_rad, w - max_rad).float()
+        y = randint(max_rad, h - max_rad).float()
+        angle = torch.deg2rad(torch.rand(b, n, device=dev) * 90)
+
+        # rasterize at low resolution: centers of the low-resolution pixels in image coords.
+        hs, ws = ceil(h / s), ceil(w / s)
+        u = (torch.arange(ws, device=dev) + 0.5) * s - 0.5
+        v = (torch.arange(hs, device=dev) + 0.5) * s - 0.5
+        dx = u.view(1, 1, 1, ws) - x[..., None, None]  # (B, N, 1, ws)
+        dy = v.view(1, 1, hs, 1) - y[..., None, None]  # (B, N, hs, 1)
+        cos, sin = torch.cos(angle)[..., None, None], torch.sin(angle)[..., None, None]
+        du = (cos * dx + sin * dy) / ax[..., None, None]
+        dv = (cos * dy - sin * dx) / ay[..., None, None]
+        mask = ((du**2 + dv**2) <= 1).any(1, keepdim=True).float()  # (B, 1, hs, ws)
+
+        # Gaussian blur with odd kernel sizes and OpenCV's default sigma
+        ks = torch.randint(*self.kernel_size_limit, (b,), device=dev)
+        ks = ks + (ks % 2 == 0)
+        sigma = (0.3 * ((ks - 1) * 0.5 - 1) + 0.8) / s
+        radius = torch.div(ks - 1, 2 * s, rounding_mode="floor")
+        max_radius = int(radius.max())
+        t = torch.arange(-max_radius, max_radius + 1, device=dev).float()
+        kernels = torch.exp(-0.5 * (t / sigma[:, None]) ** 2) * (t.abs() <= radius[:, None])
+        kernels = kernels / kernels.sum(-1, keepdim=True)
+        mask = filter2d(mask, kernels[:, None])  # rows
+        mask = filter2d(mask, kernels[:, :, None])  # columns
+        mask = F.interpolate(mask, size=(h, w), mode="bilinear", align_corners=False)
+
+        transparency = uniform(b, self.transparency_limit, images).view(b, 1, 1, 1)
+        return (images * (1 - transparency * mask)).clamp(0, 1)
+
+
+class BatchAdvancedBlur(BatchTransform):
+    """Batched version of `albumentations.AdvancedBlur`: generalized anisotropic Gaussian
+    kernels with multiplicative noise."""
+
+    def __init__(
+        self,
+        blur_limit=(3, 7),
+        sigma_x_limit=(0.2, 1.0),
+        sigma_y_limit=(0.2, 1.0),
+        rotate_limit=(-90, 90),
+        beta_limit=(0.5, 8.0),
+        noise_limit=(0.9, 1.1),
+        p: float = 0.5,
+    ):
+        super().__init__(p)
+        assert blur_limit[0] % 2 == 1 and blur_limit[1] % 2 == 1, "Kernel sizes must be odd."
+        self.blur_limit = blur_limit
+        self.sigma_x_limit = sigma_x_limit
+        self.sigma_y_limit = sigma_y_limit
+        self.rotate_limit = rotate_limit
+        self.beta_limit = beta_limit
+        self.noise_limit = noise_limit
+
+    def kernels(self, b: int, ref: Tensor) -> Tensor:
+        """(B, K, K) random kernels, zero-padded to the largest possible size."""
+        dev = ref.device
+        lo, hi = self.blur_limit
+        ks = lo + 2 * torch.randint(0, (hi - lo) // 2 + 1, (b,), device=dev)
+        sigma_x = uniform(b, self.sigma_x_limit, ref)
+        sigma_y = uniform(b, self.sigma_y_limit, ref)
+        angle = torch.deg2rad(uniform(b, self.rotate_limit, ref))
+        low_beta = torch.rand(b, device=dev) < 0.5
+        beta = torch.where(
+            low_beta,
+            uniform(b, (self.beta_limit[0], 1), ref),
+            uniform(b, (1, self.beta_limit[1]), ref),
+        )
+
+        # quadratic form of the inverse of the rotated covariance, R diag(sx^2, sy^2) R^T
+        t = torch.arange(-(hi // 2), hi // 2 + 1, device=dev).float()
+        y, x = torch.meshgrid(t, t, indexing="ij")
+        cos, sin = torch.cos(angle).view(b, 1, 1), torch.sin(angle).view(b, 1, 1)
+        u = cos * x + sin * y
+        v = cos * y - sin * x
+        quad = (u / sigma_x.view(b, 1, 1)) ** 2 + (v / sigma_y.view(b, 1, 1)) ** 2
+        kernels = torch.exp(-0.5 * quad ** beta.view(b, 1, 1))
+        kernels = kernels * uniform(b * hi * hi, self.noise_limit, ref).view(b, hi, hi)
+        inside = (x.abs() <= ks.view(b, 1, 1) // 2) & (y.abs() <= ks.view(b, 1, 1) // 2)
+        kernels = kernels * inside
+        return kernels / kernels.sum((-2, -1), keepdim=True)
+
+    def apply(self, images: Tensor) -> Tensor:
+        return filter2d(images, self.kernels(len(images), images)).clamp(0, 1)
+
+
+class BatchColorJitter(BatchTransform):
+    """Batched version of `albumentations.ColorJitter`.
+
+    The brightness, contrast, saturation and hue of each image are changed in a random order,
+    as in albumentations (and torchvision). Saturation and hue are not changed in grayscale
+    images.
+    """
+
+    def __init__(
+        self,
+        brightness: float = 0.2,
+        contrast: float = 0.2,
+        saturation: float = 0.2,
+        hue: float = 0.2,
+        p: float = 0.5,
+    ):
+        super().__init__(p)
+        self.brightness = (max(0, 1 - brightness), 1 + brightness)
+        self.contrast = (max(0, 1 - contrast), 1 + contrast)
+        self.saturation = (max(0, 1 - saturation), 1 + saturation)
+        self.hue = (-hue, hue)
+
+    @staticmethod
+    def adjust_brightness(images: Tensor, factor: Tensor) -> Tensor:
+        return (images * factor).clamp(0, 1)
+
+    @staticmethod
+    def adjust_contrast(images: Tensor, factor: Tensor) -> Tensor:
+        gray = images if images.shape[1] == 1 else rgb_to_gray(images)
+        mean = gray.mean((-3, -2, -1), keepdim=True)
+        return (images * factor + mean * (1 - factor)).clamp(0, 1)
+
+    @staticmethod
+    def adjust_saturation(images: Tensor, factor: Tensor) -> Tensor:
+        if images.shape[1] == 1:
+            return images
+        return (images * factor + rgb_to_gray(images) * (1 - factor)).clamp(0, 1)
+
+    @staticmethod
+    def adjust_hue(images: Tensor, shift: Tensor) -> Tensor:
+        """Shift the hue (in [0, 1), i.e. 1 is 360°) of RGB images."""
+        if images.shape[1] == 1:
+            return images
+        # to HSV (the saturation is implicit in the chroma, V - min(R, G, B))
+        r, g, b = images.unbind(1)
+        v = torch.maximum(torch.maximum(r, g), b)
+        chroma = v - torch.minimum(torch.minimum(r, g), b)
+        inv_chroma = 1 / chroma.clamp(min=1e-12)  # h = 0 for grays, since r = g = b
+        h = torch.where(
+            v == r,
+            (g - b) * inv_chroma,
+            torch.where(v == g, (b - r) * inv_chroma + 2, (r - g) * inv_chroma + 4),
+        )
+        h = (h + 6 * shift[:, 0]) % 6
+        # back to RGB
+        k = (images.new_tensor([5, 3, 1]).view(1, 3, 1, 1) + h[:, None]) % 6
+        return v[:, None] - chroma[:, None] * torch.minimum(k, 4 - k).clamp(0, 1)
+
+    def apply(self, images: Tensor) -> Tensor:
+        b = len(images)
+        adjustments = (
+            (self.adjust_brightness, self.brightness),
+            (self.adjust_contrast, self.contrast),
+            (self.adjust_saturation, self.saturation),
+            (self.adjust_hue, self.hue),
+        )
+        factors = [uniform(b, limits, images).view(b, 1, 1, 1) for _, limits in adjustments]
+        order = torch.rand(b, len(adjustments), device=images.device).argsort(-1)
+        images = images.clone()
+        for step in range(len(adjustments)):
+            for i, (adjust, _) in enumerate(adjustments):
+                selected = order[:, step] == i
+                if selected.any():
+                    images[selected] = adjust(images[selected], factors[i][selected])
+        return images
+
+
+class BatchAugmentation:
+    """Sequence of batched photometric augmentations, each applied with probability `p`."""
+
+    default_conf = {
+        # as in `GeoCalibAugmentations`
+        "color_jitter": {
+            "p": 0.4,
+            "brightness": 0.2,
+            "contrast": 0.2,
+            "saturation": 0.2,
+            "hue": 0.2,
+        },
+        # as in `RandomAdditiveShade` (unused by the default per-image augmentations)
+        "shade": {
+            "p": 0.0,
+            "nb_ellipses": 10,
+            "transparency_limit": [-0.5, 0.8],
+            "kernel_size_limit": [150, 350],
+            "downscale": 4,
+        },
+        # as in `GeoCalibAugmentations`
+        "blur": {
+            "p": 0.5,
+            "blur_limit": [3, 7],
+            "sigma_x_limit": [0.2, 1.0],
+            "sigma_y_limit": [0.2, 1.0],
+            "rotate_limit": [-90, 90],
+            "beta_limit": [0.5, 8.0],
+            "noise_limit": [0.9, 1.1],
+        },
+    }
+
+    transform_classes = {
+        "color_jitter": BatchColorJitter,
+        "shade": BatchRandomAdditiveShade,
+        "blur": BatchAdvancedBlur,
+    }
+
+    def __init__(self, conf={}):
+        default_conf = OmegaConf.create(self.default_conf)
+        OmegaConf.set_struct(default_conf, True)
+        self.conf = OmegaConf.merge(default_conf, conf)
+        self.names = [name for name in self.transform_classes if self.conf[name].p > 0]
+        self.transforms = [
+            self.transform_classes[name](**OmegaConf.to_container(self.conf[name]))
+            for name in self.names
+        ]
+
+    @torch.no_grad()
+    def __call__(self, images: Tensor) -> Tensor:
+        for transform in self.transforms:
+            images = transform(images)
+        return images
+
+
+def disable_batched_transforms(aug_conf, batch_conf, aug_default_conf: dict) -> dict:
+    """Configuration of the per-image augmentations without the transforms that are already
+    applied to whole batches.
+
+    Args:
+        aug_conf: configuration of the per-image augmentations.
+        batch_conf: configuration of the batch augmentations.
+        aug_default_conf: default configuration of the per-image augmentations. The transforms
+            that can be disabled have a boolean entry with the same name as in
+            `BatchAugmentation.transform_classes`, e.g. "color_jitter" or "blur".
+
+    Returns:
+        Per-image configuration with the overlapping transforms set to False.
+    """
+    aug_conf = OmegaConf.to_container(OmegaConf.create(aug_conf))
+    for name in BatchAugmentation(batch_conf).names:
+        if isinstance(aug_default_conf.get(name, None), bool):
+            aug_conf[name] = False
+    return aug_conf
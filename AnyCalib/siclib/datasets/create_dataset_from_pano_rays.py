@@ -1,7 +1,16 @@
-"""Script to create a dataset from panorama images."""
+"""Script to create a dataset from panorama images.
+
+The panoramas of each split are distributed across `n_workers` processes, each of which writes
+the parameters of its images into a partial HDF5 file (<split>.partXXX.h5). The partial files
+record the panoramas that were completely processed, so an interrupted generation is resumed by
+running the script again (with `resume: True`), and are merged into <split>.h5 at the end.
+"""
 
 import hashlib
 import logging
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from math import acos, cos, hypot, pi, sin, sqrt, tan
 from pathlib import Path
 
@@ -31,6 +40,19 @@ DEG2RAD = pi / 180
 # when saving images.
 Image.MAX_IMAGE_PIXELS = None
 
+# group of the partial HDF5 files listing the panoramas that have been fully processed
+DONE_GROUP = "_done_panoramas"
+
+
+def str_seed(seed: str) -> int:
+    """Deterministic 32-bit seed from a string."""
+    return int(hashlib.sha256(seed.encode()).hexdigest(), 16) % (2**32)
+
+
+def save_image(image: np.ndarray, path: Path):
+    """Save a (H, W, 3) uint8 image."""
+    Image.fromarray(image).save(path)
+
 
 def rad2rotmat(roll: float, pitch: float, yaw: float, device: torch.device) -> torch.Tensor:
     """Convert (batched) roll, pitch, yaw angles (in radians) to rotation matrix.
@@ -70,6 +92,57 @@ def rad2rotmat(roll: float, pitch: float, yaw: float, device: torch.device) -> t
     return Rz @ Rx @ Ry
 
 
+class PanoPyramid:
+    """Resolution pyramid of a panorama to resize it to many scales.
+
+    Resizing the full-resolution panorama with antialiasing for each generated view is the
+    bottleneck of the generation. Instead, the panorama is successively downsampled by a factor
+    of 2 (area interpolation, i.e. exact box filtering) and each requested size is resampled
+    (bicubic with antialiasing) from the smallest level that is at least as large, so that the
+    antialiasing filter spans only a few pixels. The levels are built lazily, and the last
+    resized panoramas are cached, since several views may share the same size.
+
+    Args:
+        pano: (1, 3, H, W) panorama.
+        cache_size: number of resized panoramas kept in memory.
+    """
+
+    def __init__(self, pano: Tensor, cache_size: int = 2):
+        self.levels = [pano]
+        self.cache_size = cache_size
+        self.cache: OrderedDict[tuple[int, int], Tensor] = OrderedDict()
+
+    def level_for(self, size: tuple[int, int]) -> Tensor:
+        """Smallest level of the pyramid that is at least as large as `size`."""
+        level = 0
+        while True:
+            h, w = self.levels[level].shape[-2:]
+            if h // 2 < size[0] or w // 2 < size[1]:
+                return self.levels[level]
+            if level + 1 == len(self.levels):
+                self.levels.append(
+                    F.interpolate(self.levels[level], size=(h // 2, w // 2), mode="area")
+                )
+            level += 1
+
+    def resize(self, size: tuple[int, int]) -> Tensor:
+        """(1, 3, h, w) panorama resized to `size` = (h, w)."""
+        if size in self.cache:
+            self.cache.move_to_end(size)
+            return self.cache[size]
+        level = self.level_for(size)
+        if tuple(level.shape[-2:]) == size:
+            resized = level
+        else:
+            resized = F.interpolate(
+                level, size=size, mode="bicubic", align_corners=False, antialias=True
+            ).clamp(0, 1)
+        self.cache[size] = resized
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return resized
+
+
 class DatasetGenerator:
     """Dataset generator class to create datasets from panoramas."""
 
@@ -92,6 +165,10 @@ class DatasetGenerator:
         "images_per_pano": 16,
         "device": "cpu",
         "overwrite": False,
+        "n_workers": 0,  # 0: generate in the main process
+        "resume": True,  # reuse the panoramas processed by an interrupted generation
+        "render_batch_size": 4,  # views of the same camera model rendered at once
+        "io_threads": 4,  # threads encoding and saving the images
         "im_size": (640, 640),
         "resize_factor": {
             "type": "uniform",
@@ -130,7 +207,7 @@ class DatasetGenerator:
         assert len(self.cam_ids) > 0, "No camera models specified."
         assert sum(self.cam_weights) == 1.0, "Camera weights do not sum to 1."
         self.cam_specs = {cam_spec.cam_id: cam_spec for cam_spec in self.conf.intrinsics}
-        self.cam_selector = np.random.default_rng(0)
+        self.io_executor = ThreadPoolExecutor(self.conf.io_threads)
 
     def sample_value(self, param_conf: DictConfig, seed: int | str | None = None) -> float:
         """Sample a value from the specified distribution."""
@@ -140,7 +217,7 @@ class DatasetGenerator:
         generator = None
         if seed:
             if not isinstance(seed, (int, float)):
-                seed = int(hashlib.sha256(seed.encode()).hexdigest(), 16) % (2**32)
+                seed = str_seed(seed)
             generator = np.random.default_rng(seed)
         sampler = getattr(scipy.stats, param_conf.type)
         return float(sampler.rvs(random_state=generator, **param_conf.options))
@@ -160,7 +237,7 @@ class DatasetGenerator:
         }
         for split in ["train", "val", "test"]:
             rows_ = rows[split]
-            with h5py.File(self.conf[f"{split}_h5"], "r") as h5_file:  # type:ignore
+            with h5py.File(self.conf[f"{split}_h5"], "r") as h5_file:  # type: ignore
                 for group in h5_file.values():
                     row_ = base_row.copy()
                     attrs = group.attrs
@@ -296,8 +373,63 @@ class DatasetGenerator:
         else:
             raise NotImplementedError
 
+    def render_views(self, pyramid: PanoPyramid, cam: BaseCamera, views: list[dict]) -> Tensor:
+        """Render, in a batch, several views of a panorama with the same camera model.
+
+        The panorama is resized for each view (see `generate_images_from_pano`). The resized
+        panoramas are padded, replicating their last row and column, to the largest size of the
+        batch, and the sampling coordinates of each view are rescaled accordingly, so that the
+        result is the same as sampling each resized panorama on its own.
+
+        Returns:
+            (B, 3, H, W) images.
+        """
+        h, w = self.conf.im_size
+        dev = self.device
+        params = torch.stack([view["params"] for view in views])  # (B, D)
+
+        # unit bearings in the cameras' reference systems
+        im_coords = cam.pixel_grid_coords(h, w, params, offset=0.5).reshape(1, h * w, 2)
+        bearings, valid = cam.unproject(params, im_coords.expand(len(views), -1, -1))
+        assert valid is None or valid.all(), "Invalid bearings"
+        # rotate according to extrinsics
+        rotmats = torch.stack(
+            [rad2rotmat(view["roll"], view["pitch"], view["yaw"], dev) for view in views]
+        )
+        rotated_bearings = bearings @ rotmats  # (B, H*W, 3)
+        # spherical coordinates
+        lon = torch.atan2(rotated_bearings[..., 0], rotated_bearings[..., 2])
+        lat = torch.atan2(
+            rotated_bearings[..., 1], torch.linalg.norm(rotated_bearings[..., [0, 2]], dim=-1)
+        )
+
+        # map spherical coords. to panoramic coords. normalized to [-1, 1], which do not depend
+        # on the size of the resized panorama
+        grid = torch.stack((lon / pi, 2 * lat / pi), dim=-1).reshape(len(views), h, w, 2)
+        # pad the resized panoramas to a common size and rescale the coordinates to it
+        sizes = torch.tensor([view["size"] for view in views], device=dev, dtype=grid.dtype)
+        h_max, w_max = (int(s) for s in sizes.max(0).values)
+        panos = torch.cat(
+            [
+                F.pad(
+                    pyramid.resize(view["size"]),
+                    (0, w_max - view["size"][1], 0, h_max - view["size"][0]),
+                    mode="replicate",
+                )
+                for view in views
+            ]
+        )
+        scale = (sizes.flip(-1) / sizes.new_tensor([w_max, h_max]))[:, None, None]
+        grid = (grid + 1) * scale - 1
+        ims = F.grid_sample(panos, grid, align_corners=False, padding_mode="border")
+        return ims.clamp(0, 1)
+
     def generate_images_from_pano(self, h5file: h5py.File, pano_path: Path, out_dir: Path):
-        """Generate perspective images from a single panorama."""
+        """Generate perspective images from a single panorama.
+
+        The views with the same camera model are rendered in batches of `render_batch_size`
+        views, and the images are encoded and saved by `io_threads` threads.
+        """
         stem = pano_path.stem
         h, w = self.conf.im_size
         dev = self.device
@@ -305,86 +437,90 @@ class DatasetGenerator:
         pano = torch.tensor(np.array(Image.open(pano_path)), device=dev) / 255
         pano_img = pano.permute(2, 0, 1).unsqueeze(0)  # (1, 3, H, W)
         h_pano, w_pano = pano_img.shape[-2:]
+        pyramid = PanoPyramid(pano_img)
 
         yaws = torch.linspace(0, 2 * pi, self.conf.images_per_pano + 1, device=dev)[:-1]
-        cam_ids = self.cam_selector.choice(
+        # seeded per panorama so that the images do not depend on the processing order
+        cam_selector = np.random.default_rng(str_seed(f"{stem}cam_id"))
+        cam_ids = cam_selector.choice(
             self.cam_ids, size=self.conf.images_per_pano, p=self.cam_weights
         )
+        views = []
         for i, cam_id in enumerate(cam_ids):
-            yaw = yaws[i]
-            cam: BaseCamera = self.cams[cam_id]
-            cam_spec = self.cam_specs[cam_id]
-
             # sample {in,ex}trinsics and resize factor
             res_fac = self.sample_value(self.conf.resize_factor, f"{stem}resize_factor{i}")
             roll = self.sample_value(self.conf.roll, f"{stem}roll{i}")
             pitch = self.sample_value(self.conf.pitch, f"{stem}pitch{i}")
-            params, vfov = self.get_safe_params(cam, cam_spec, (stem, i))
-
-            ## extract image from pano
+            params, vfov = self.get_safe_params(
+                self.cams[cam_id], self.cam_specs[cam_id], (stem, i)
+            )
             # following Geocalib, quote: "resize the panorama such that its fov has the
             # same height as the image"
             scale = pi / vfov * h / h_pano * res_fac
-            h_pano_new, w_pano_new = (int(h_pano * scale), int(w_pano * scale))
-            resized_pano = F.interpolate(
-                pano_img,
-                size=(h_pano_new, w_pano_new),
-                mode="bicubic",
-                align_corners=False,
-                antialias=True,
-            ).clamp(0, 1)
-
-            # unit bearings in the camera's reference system
-            bearings, valid = cam.ray_grid(h, w, params, offset=0.5)
-            assert valid is None or valid.all(), "Invalid bearings"
-            bearings = bearings.reshape(h * w, 3)
-            # rotate according to extrinsics
-            rotated_bearings = bearings @ rad2rotmat(roll, pitch, yaw.item(), dev)
-            # spherical coordinates
-            lon = torch.atan2(rotated_bearings[:, 0], rotated_bearings[:, 2])
-            lat = torch.atan2(
-                rotated_bearings[:, 1],
-                torch.linalg.norm(rotated_bearings[:, [0, 2]], dim=-1),
+            views.append(
+                {
+                    "fname": f"{stem}_{i}.jpg",
+                    "cam_id": str(cam_id),
+                    "params": params,
+                    "vfov": vfov,
+                    "roll": roll,
+                    "pitch": pitch,
+                    "yaw": yaws[i].item(),
+                    "resize_factor": res_fac,
+                    "size": (int(h_pano * scale), int(w_pano * scale)),
+                }
             )
 
-            # project and sample from panorama
-            min_lon, max_lon = -pi, pi
-            min_lat, max_lat = -pi / 2, pi / 2
-            min_x, max_x = 0, w_pano_new - 1
-            min_y, max_y = 0, h_pano_new - 1
-            # map spherical coords. to panoramic coords.
-            nx = (lon - min_lon) / (max_lon - min_lon) * (max_x - min_x) + min_x
-            ny = (lat - min_lat) / (max_lat - min_lat) * (max_y - min_y) + min_y
-            mapx = nx.reshape((1, h, w))
-            mapy = ny.reshape((1, h, w))
-            grid = torch.stack((mapx, mapy), dim=-1)  # (1, H, W, 2)
-            # normalize to [-1, 1]
-            grid = 2 * grid / torch.tensor([w_pano_new - 1, h_pano_new - 1], device=dev) - 1
-            im = F.grid_sample(
-                resized_pano,
-                grid,
-                align_corners=False,
-                padding_mode="border",
-            )[0].clamp(0, 1)  # (3, H, W) # fmt:skip
-
-            # discard images with >=1% black pixels
-            valid = torch.mean((im.sum(0) == 0).float()) < 0.01
-            fname = f"{stem}_{i}.jpg"
-            if not valid:
-                logger.debug(f"[{cam_id}] {fname} has too many black pixels.")
-                continue
-            # save params
-            grp = h5file.create_group(fname)
-            grp.attrs["h"] = h
-            grp.attrs["w"] = w
-            grp.attrs["roll"] = roll  # only true for panos aligned with gravity
-            grp.attrs["pitch"] = pitch  # only true for panos aligned with gravity
-            grp.attrs["vfov"] = vfov
-            grp.attrs["resize_factor"] = res_fac
-            grp.attrs["cam_id"] = str(cam_id)
-            grp.attrs["params"] = params.cpu().numpy()
-            # save image
-            Image.fromarray((255 * im.permute(1, 2, 0)).byte().cpu().numpy()).save(out_dir / fname)
+        saved = []
+        batch_size = self.conf.render_batch_size
+        for cam_id in dict.fromkeys(view["cam_id"] for view in views):
+            # sorted by size to minimize the padding of the batched panoramas
+            cam_views = sorted((v for v in views if v["cam_id"] == cam_id), key=lambda v: v["size"])
+            for k in range(0, len(cam_views), batch_size):
+                batch = cam_views[k : k + batch_size]
+                ims = self.render_views(pyramid, self.cams[cam_id], batch)
+                # discard images with >=1% black pixels
+                valid = torch.mean((ims.sum(1) == 0).float(), dim=(1, 2)) < 0.01
+                ims = (255 * ims.permute(0, 2, 3, 1)).byte().cpu().numpy()
+                for view, im, valid_ in zip(batch, ims, valid.tolist()):
+                    fname = view["fname"]
+                    if not valid_:
+                        logger.debug(f"[{cam_id}] {fname} has too many black pixels.")
+                        continue
+                    # save params (overwriting those of an interrupted run)
+                    if fname in h5file:
+                        del h5file[fname]
+                    grp = h5file.create_group(fname)
+                    grp.attrs["h"] = h
+                    grp.attrs["w"] = w
+                    grp.attrs["roll"] = view["roll"]  # only true for panos aligned with gravity
+                    grp.attrs["pitch"] = view["pitch"]  # only true for panos aligned with gravity
+                    grp.attrs["vfov"] = view["vfov"]
+                    grp.attrs["resize_factor"] = view["resize_factor"]
+                    grp.attrs["cam_id"] = cam_id
+                    grp.attrs["params"] = view["params"].cpu().numpy()
+                    # save image (PIL releases the GIL while encoding)
+                    saved.append(self.io_executor.submit(save_image, im, out_dir / fname))
+        # the panorama is only complete once all its images are written
+        for future in saved:
+            future.result()
+
+    def generate_part(
+        self, pano_paths: list[Path], h5_path: Path, out_dir: Path, progress: bool = False
+    ):
+        """Generate the images of some panoramas, storing their parameters in a partial HDF5.
+
+        Each panorama is recorded in the `DONE_GROUP` of the file after all its images are
+        written, and the panoramas already recorded are skipped.
+        """
+        with h5py.File(h5_path, "a") as h5_file:
+            done = h5_file.require_group(DONE_GROUP)
+            for pano_path in tqdm(pano_paths, disable=not progress):
+                if pano_path.stem in done:
+                    continue
+                self.generate_images_from_pano(h5_file, pano_path, out_dir)
+                done.create_group(pano_path.stem)
+                h5_file.flush()
 
     def generate_split(self, split: str):
         """Generate a single split of a dataset."""
@@ -393,7 +529,7 @@ class DatasetGenerator:
             logger.info(f"Dataset for {split}: {str(h5_path)} already exists.")
             return
 
-        out_dir = Path(self.conf[f"im_{split}"])  # type:ignore
+        out_dir = Path(self.conf[f"im_{split}"])  # type: ignore
         out_dir.mkdir(parents=True, exist_ok=True)
         logger.info(f"Writing images to {str(out_dir)}")
 
@@ -404,9 +540,54 @@ class DatasetGenerator:
                 if not path.name.startswith(".")
             ]
         )
-        with h5py.File(h5_path, "w") as h5_file:
-            for pano_path in tqdm(panorama_paths):
-                self.generate_images_from_pano(h5_file, pano_path, out_dir)
+
+        # partial files of a previous (interrupted) generation
+        part_paths = []
+        done_stems = set()
+        for part_path in sorted(h5_path.parent.glob(f"{h5_path.stem}.part*.h5")):
+            if self.conf.resume and not self.conf.overwrite:
+                try:
+                    with h5py.File(part_path, "r") as part:
+                        done_stems.update(part[DONE_GROUP] if DONE_GROUP in part else ())
+                    part_paths.append(part_path)
+                    continue
+                except OSError:  # the process was killed while writing the file
+                    logger.warning(f"Discarding corrupted partial file {part_path}.")
+            part_path.unlink()
+        todo = [path for path in panorama_paths if path.stem not in done_stems]
+        logger.info(f"{split}: {len(done_stems)} panoramas done, {len(todo)} to process.")
+
+        # contiguous chunks of panoramas, each written into a new partial file
+        n_workers = self.conf.n_workers
+        n_tasks = min(len(todo), 4 * n_workers if n_workers > 0 else 1)
+        chunks = [
+            todo[k * len(todo) // n_tasks : (k + 1) * len(todo) // n_tasks] for k in range(n_tasks)
+        ]
+        new_part_paths = []
+        k = 0
+        while len(new_part_paths) < n_tasks:
+            part_path = h5_path.with_name(f"{h5_path.stem}.part{k:03d}.h5")
+            if part_path not in part_paths:
+                new_part_paths.append(part_path)
+            k += 1
+
+        if n_workers == 0:
+            for chunk, part_path in zip(chunks, new_part_paths):
+                self.generate_part(chunk, part_path, out_dir, progress=True)
+        elif n_tasks > 0:
+            conf = OmegaConf.to_container(self.conf, resolve=True)
+            num_threads = max(1, torch.get_num_threads() // n_workers)
+            # spawn: forking a process that already uses torch (threads, CUDA) is unsafe
+            mp_context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(n_workers, mp_context=mp_context) as executor:
+                futures = [
+                    executor.submit(generate_part, conf, chunk, part_path, out_dir, num_threads)
+                    for chunk, part_path in zip(chunks, new_part_paths)
+                ]
+                for future in tqdm(as_completed(futures), total=n_tasks, desc=split):
+                    future.result()
+
+        merge_parts(part_paths + new_part_paths, h5_path)
 
     def generate_dataset(self):
         """Generate all splits of a dataset."""
@@ -419,13 +600,40 @@ class DatasetGenerator:
             self.generate_split(split=split)
 
         for split in ["train", "val", "test"]:
-            with h5py.File(self.conf[f"{split}_h5"], "r") as h5_file:  # type:ignore
+            with h5py.File(self.conf[f"{split}_h5"], "r") as h5_file:  # type: ignore
                 total = sum(1 for _ in h5_file)
             logger.info(f"Generated {total} {split} images.")
 
         self.plot_distributions()
 
 
+def generate_part(
+    conf: dict, pano_paths: list[Path], h5_path: Path, out_dir: Path, num_threads: int
+):
+    """Entry point of the worker processes (see `DatasetGenerator.generate_part`)."""
+    torch.set_num_threads(num_threads)
+    DatasetGenerator(conf).generate_part(pano_paths, h5_path, out_dir)
+
+
+def merge_parts(part_paths: list[Path], h5_path: Path):
+    """Merge the images of the fully processed panoramas of partial HDF5 files into one file.
+
+    The partial files are removed once the merged file is written.
+    """
+    tmp_path = h5_path.with_name(f"{h5_path.name}.tmp")
+    with h5py.File(tmp_path, "w") as h5_file:
+        for part_path in part_paths:
+            with h5py.File(part_path, "r") as part:
+                done = set(part[DONE_GROUP]) if DONE_GROUP in part else set()
+                for fname in part:
+                    # images are named <stem>_<i>.jpg
+                    if fname != DONE_GROUP and fname.rsplit("_", 1)[0] in done:
+                        part.copy(part[fname], h5_file, name=fname)
+    tmp_path.replace(h5_path)
+    for part_path in part_paths:
+        part_path.unlink()
+
+
 @hydra.main(version_base=None, config_path="configs", config_name="openpano_v2_radial")
 def main(cfg: DictConfig) -> None:
     """Run dataset generation."""
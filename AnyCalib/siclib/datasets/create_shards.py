@@ -0,0 +1,152 @@
+"""Pre-bake the images of a dataset into memory-mapped shards for training.
+
+With `simple_dataset_rays`, every sample of every epoch decodes a JPEG. With the shards created
+by this script, `sharded_dataset_rays` reads the decoded uint8 pixels directly from
+memory-mapped files instead. Each split is stored under <shard_dir>/<split>/ as:
+    - images_<k>.u8: raw HWC uint8 pixels of consecutive images, at most `shard_size` bytes
+        each (unless a single image is larger).
+    - index.npz: name, shard, byte offset, shape, camera model and intrinsics of each image.
+
+Images with more than `max_resolution` pixels are downscaled (area interpolation) and their
+intrinsics are updated accordingly. This bounds the size of the shards to what the training
+resolution pools need: e.g., with `im_geom_transform.resolution: 102_400`, images are always
+downscaled by the data pipeline, so storing 4x that resolution keeps margin for crops.
+
+Usage:
+    python -m siclib.datasets.create_shards --dataset_dir data/openpano_v2/openpano_v2 \
+        --max_resolution 409600 --num_workers 16
+"""
+
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from math import sqrt
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from anycalib.cameras.factory import CameraFactory
+from siclib.datasets.sharded_dataset_rays import SHARD_PATTERN, save_shard_index
+from siclib.datasets.simple_dataset_rays import DataPoint, SimpleDataset
+from siclib.utils.image_rays import read_image
+
+logger = logging.getLogger(__name__)
+
+# mypy: ignore-errors
+
+
+def load_datapoint(
+    datapoint: DataPoint, grayscale: bool, max_resolution: float | None
+) -> tuple[np.ndarray, np.ndarray]:
+    """Decode an image and downscale it (and its intrinsics) if needed.
+
+    Returns:
+        (H, W, C) uint8 image.
+        (D,) intrinsics of the stored image.
+    """
+    image = read_image(Path(datapoint.file_name), grayscale)
+    image = image[..., None] if image.ndim == 2 else image
+    h, w = image.shape[:2]
+    assert (h, w) == (datapoint.h, datapoint.w), f"{(h, w)}, {datapoint.h, datapoint.w}"
+    params = datapoint.params
+    if max_resolution is not None and h * w > max_resolution:
+        scale = sqrt(max_resolution / (h * w))
+        h_, w_ = max(1, round(scale * h)), max(1, round(scale * w))
+        image = cv2.resize(image, (w_, h_), interpolation=cv2.INTER_AREA).reshape(h_, w_, -1)
+        cam = CameraFactory.create_from_id(datapoint.cam_id)
+        params = cam.scale_and_shift(
+            torch.from_numpy(params), torch.tensor([w_ / w, h_ / h]), torch.zeros(2)
+        ).numpy()
+    return np.ascontiguousarray(image), params
+
+
+def create_shards(
+    datapoints: list[DataPoint],
+    split_dir: Path,
+    grayscale: bool = False,
+    max_resolution: float | None = None,
+    shard_size: int = 2**32,
+    num_workers: int = 8,
+):
+    """Decode the images of a split and store them in memory-mapped shards.
+
+    Args:
+        datapoints: information of the images of the split.
+        split_dir: output directory.
+        grayscale: store single-channel images.
+        max_resolution: maximum number of pixels of the stored images.
+        shard_size: maximum size, in bytes, of each shard.
+        num_workers: number of threads decoding and resizing images.
+    """
+    split_dir.mkdir(parents=True, exist_ok=True)
+    index = {k: [] for k in ("name", "cam_id", "shard", "offset", "shape", "params")}
+    shard, offset = 0, 0
+    f = open(split_dir / SHARD_PATTERN.format(shard), "wb")
+
+    def load(datapoint: DataPoint):
+        return load_datapoint(datapoint, grayscale, max_resolution)
+
+    def decoded():
+        # decoding (cv2) releases the GIL. Images are decoded in chunks to bound the memory of
+        # the images waiting to be written, and yielded in order
+        chunk_size = 4 * max(1, num_workers)
+        with ThreadPoolExecutor(max(1, num_workers)) as executor:
+            for i in range(0, len(datapoints), chunk_size):
+                yield from executor.map(load, datapoints[i : i + chunk_size])
+
+    for datapoint, (image, params) in zip(
+        datapoints, tqdm(decoded(), total=len(datapoints), desc=split_dir.name)
+    ):
+        if offset > 0 and offset + image.nbytes > shard_size:
+            f.close()
+            shard, offset = shard + 1, 0
+            f = open(split_dir / SHARD_PATTERN.format(shard), "wb")
+        f.write(image.data)
+        index["name"].append(datapoint.name)
+        index["cam_id"].append(datapoint.cam_id)
+        index["shard"].append(shard)
+        index["offset"].append(offset)
+        index["shape"].append(image.shape)
+        index["params"].append(params)
+        offset += image.nbytes
+    f.close()
+    # the index is written last: shards without index are incomplete
+    save_shard_index(split_dir, index)
+    logger.info(f"Stored {len(datapoints)} images in {shard + 1} shards at {split_dir}.")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset_dir", type=str, required=True)
+    parser.add_argument("--shard_dir", type=str, default=None, help="<dataset_dir>/shards")
+    parser.add_argument("--splits", type=str, nargs="+", default=["train", "val"])
+    parser.add_argument("--max_resolution", type=float, default=None)
+    parser.add_argument("--shard_size_gb", type=float, default=4.0)
+    parser.add_argument("--grayscale", action="store_true")
+    parser.add_argument("--num_workers", type=int, default=8)
+    args = parser.parse_args()
+
+    shard_dir = Path(args.shard_dir or Path(args.dataset_dir) / "shards")
+    dataset = SimpleDataset(
+        {
+            "dataset_dir": args.dataset_dir,
+            "grayscale": args.grayscale,
+            "augmentations": {"name": "identity"},
+        }
+    )
+    for split in args.splits:
+        create_shards(
+            dataset.get_dataset(split).datapoints,
+            shard_dir / split,
+            args.grayscale,
+            args.max_resolution,
+            int(args.shard_size_gb * 2**30),
+            args.num_workers,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Dataset reading decoded images from memory-mapped shards.
+
+The shards are created offline with `create_shards.py`. Compared to `simple_dataset_rays`, no
+image is decoded during training: the uint8 pixels are read directly from the memory-mapped
+shards, whose pages are shared through the page cache by all the DataLoader workers (and
+training processes) of a node. Augmentations, resizing/cropping and the ground-truth rays are
+computed as in `simple_dataset_rays`.
+"""
+
+import logging
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from siclib.datasets.simple_dataset_rays import (
+    MAX_NPARAMS,
+    DataPoint,
+    SimpleDataset,
+    _SimpleDataset,
+)
+
+logger = logging.getLogger(__name__)
+
+# mypy: ignore-errors
+
+
+SHARD_PATTERN = "images_{:03d}.u8"
+INDEX_FILE = "index.npz"
+
+
+def save_shard_index(split_dir: Path, index: dict[str, list]):
+    """Save the index of the images stored in the shards of a split."""
+    params = np.zeros((len(index["params"]), MAX_NPARAMS), dtype=np.float32)
+    for i, p in enumerate(index["params"]):
+        params[i, : len(p)] = p
+    # write to a temporary file first so that interrupted writes are not reused
+    tmp_path = split_dir / f"{INDEX_FILE}.tmp.npz"
+    np.savez(
+        tmp_path,
+        name=np.array(index["name"]),
+        cam_id=np.array(index["cam_id"]),
+        shard=np.array(index["shard"], dtype=np.int32),
+        offset=np.array(index["offset"], dtype=np.int64),
+        shape=np.array(index["shape"], dtype=np.int32).reshape(-1, 3),
+        params=params,
+        nparams=np.array([len(p) for p in index["params"]], dtype=np.int32),
+    )
+    tmp_path.replace(split_dir / INDEX_FILE)
+
+
+class ShardReader:
+    """Zero-copy access to the images of a split stored in memory-mapped shards.
+
+    The shards are mapped lazily, on first access, so that each DataLoader worker maps them
+    itself instead of receiving pickled copies of the arrays. They are mapped copy-on-write, so
+    the returned arrays are writable but the shards are never modified.
+
+    Args:
+        split_dir: directory with the shards and the index of a split.
+    """
+
+    def __init__(self, split_dir: Path):
+        self.split_dir = Path(split_dir)
+        index_path = self.split_dir / INDEX_FILE
+        if not index_path.exists():
+            raise FileNotFoundError(f"No shard index at {index_path}. Run create_shards.py.")
+        with np.load(index_path) as index:
+            self.index = {k: index[k] for k in index.files}
+        self.names = [str(name) for name in self.index["name"]]
+        self.shards = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def datapoints(self, img_root: Path) -> list[DataPoint]:
+        """Information of the images, with the (possibly downscaled) sizes and intrinsics."""
+        index = self.index
+        return [
+            DataPoint(
+                name=name,
+                file_name=str(img_root / name),
+                h=int(index["shape"][i, 0]),
+                w=int(index["shape"][i, 1]),
+                cam_id=str(index["cam_id"][i]),
+                params=index["params"][i, : index["nparams"][i]].copy(),
+            )
+            for i, name in enumerate(self.names)
+        ]
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        """(H, W, C) uint8 image backed by the memory-mapped shard."""
+        if self.shards is None:
+            num_shards = int(self.index["shard"].max()) + 1 if len(self) > 0 else 0
+            self.shards = [
+                np.memmap(self.split_dir / SHARD_PATTERN.format(k), dtype=np.uint8, mode="c")
+                for k in range(num_shards)
+            ]
+        shape = self.index["shape"][i]
+        offset = int(self.index["offset"][i])
+        shard = self.shards[self.index["shard"][i]]
+        return shard[offset : offset + int(np.prod(shape))].reshape(shape)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["shards"] = None  # re-mapped by each worker
+        return state
+
+
+class ShardedDataset(SimpleDataset):
+    """Dataset for images pre-baked into memory-mapped shards with 'create_shards.py'.
+
+    The configuration is the same as for `SimpleDataset`, plus `shard_dir`, the directory with
+    one sub-directory of shards per split.
+    """
+
+    default_conf = {
+        **SimpleDataset.default_conf,
+        "shard_dir": "${.dataset_dir}/shards",
+    }
+
+    def get_dataset(self, split: str) -> "_ShardedDataset":
+        """Return a dataset for a given split."""
+        return _ShardedDataset(self.conf, split)  # type: ignore
+
+
+class _ShardedDataset(_SimpleDataset):
+    """Dataset for images pre-baked into memory-mapped shards with 'create_shards.py'."""
+
+    def _load_datapoints(self) -> list[DataPoint]:
+        self.shards = ShardReader(Path(self.conf.shard_dir) / self.split)
+        self.shard_idx = {name: i for i, name in enumerate(self.shards.names)}
+        logger.info(f"Reading {len(self.shards)} images from {self.shards.split_dir}.")
+        return self.shards.datapoints(self.img_dir)
+
+    def _load_image(self, datapoint: DataPoint) -> torch.Tensor:
+        image = self.shards[self.shard_idx[datapoint.name]]
+        gray = image.shape[-1] == 1
+        assert gray == self.conf.grayscale, f"Shards with {image.shape[-1]} channels."
+        # same layout as `load_image(..., return_tensor=False)`
+        image = torch.from_numpy(image)
+        return image[..., 0][None] if gray else image
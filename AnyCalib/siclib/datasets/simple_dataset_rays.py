@@ -1,4 +1,7 @@
+import hashlib
 import logging
+import os
+from collections import OrderedDict
 from functools import partial
 from math import sqrt
 from pathlib import Path
@@ -19,6 +22,7 @@ from anycalib.cameras.base import BaseCamera
 from anycalib.cameras.factory import CameraFactory
 from siclib.datasets.augmentations import IdentityAugmentation, augmentations
 from siclib.datasets.base_dataset import BaseDataset, collate, worker_init_fn
+from siclib.datasets.batch_augmentations import disable_batched_transforms
 from siclib.utils.conversions import fov2focal
 from siclib.utils.image_rays import ImagePreprocessor, load_image
 from siclib.utils.tools import fork_rng
@@ -103,6 +107,79 @@ def load_h5_anycalib_format(h5_file: Path, img_root: Path) -> list[DataPoint]:
     return datapoints
 
 
+def compute_ray_grid(
+    cam: BaseCamera, params: torch.Tensor, h: int, w: int
+) -> tuple[torch.Tensor, torch.Tensor]:
+    """Unit rays through the centers of the pixels and their validity, both flattened."""
+    rays, valid = cam.ray_grid(h, w, params, 0.5)
+    rays = rays.view(h * w, 3)
+    valid = rays.new_ones(h * w, dtype=torch.bool) if valid is None else valid.view(-1)
+    return rays, valid
+
+
+class RayGridCache:
+    """Cache of ground-truth ray grids, keyed by (cam_id, params, h, w).
+
+    Unprojecting the pixels of some camera models (e.g. Kannala-Brandt or division models)
+    requires iterative or polynomial solves for each pixel. When the same images are
+    transformed in the same way every epoch, e.g. in the val/test splits, or in training with
+    discrete pools of sizes and no crops, the grids are reused from a bounded LRU memo of each
+    DataLoader worker and, optionally, from an on-disk cache shared by all workers and runs.
+    The returned tensors are shared and must not be modified in-place.
+
+    Args:
+        size: maximum number of grids kept in memory (0 to keep none).
+        cache_dir: directory of the on-disk cache, or None to not use it.
+    """
+
+    def __init__(self, size: int, cache_dir: str | Path | None = None):
+        self.size = size
+        self.cache_dir = None if cache_dir is None else Path(cache_dir)
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.memo: OrderedDict[tuple, tuple[torch.Tensor, torch.Tensor]] = OrderedDict()
+
+    def __call__(
+        self, cam: BaseCamera, params: torch.Tensor, h: int, w: int
+    ) -> tuple[torch.Tensor, torch.Tensor]:
+        key = (cam.id, params.cpu().numpy().tobytes(), h, w)
+        if key in self.memo:
+            self.memo.move_to_end(key)
+            return self.memo[key]
+
+        grid = None if self.cache_dir is None else self.load(key)
+        if grid is None:
+            grid = compute_ray_grid(cam, params, h, w)
+            if self.cache_dir is not None:
+                self.save(key, grid)
+        if self.size > 0:
+            self.memo[key] = grid
+            if len(self.memo) > self.size:
+                self.memo.popitem(last=False)
+        return grid
+
+    def path(self, key: tuple) -> Path:
+        return self.cache_dir / f"{hashlib.sha1(repr(key).encode()).hexdigest()}.npz"
+
+    def load(self, key: tuple) -> tuple[torch.Tensor, torch.Tensor] | None:
+        path = self.path(key)
+        if not path.exists():
+            return None
+        try:
+            with np.load(path) as grid:
+                return torch.from_numpy(grid["rays"]), torch.from_numpy(grid["valid"])
+        except (OSError, ValueError, KeyError):  # incomplete or corrupted file
+            logger.warning(f"Recomputing corrupted cached rays {path}.")
+            return None
+
+    def save(self, key: tuple, grid: tuple[torch.Tensor, torch.Tensor]):
+        path = self.path(key)
+        # write to a temporary file first, since several workers may write the same grid
+        tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npz")
+        np.savez(tmp_path, rays=grid[0].cpu().numpy(), valid=grid[1].cpu().numpy())
+        os.replace(tmp_path, path)
+
+
 class EditableConfig:
     """Simple context manager that ensures a config is editable inside the block."""
 
@@ -225,6 +302,101 @@ class BatchedRandomSampler:
             yield from (idx for idx in sample_idxs)
 
 
+class BucketedBatchSampler:
+    """Random batches of images with the same target aspect ratio and resolution.
+
+    Unlike `BatchedRandomSampler`, which draws the (shared) aspect ratio of each batch at random,
+    each image is assigned beforehand to the aspect-ratio bucket closest to its own aspect ratio,
+    i.e. the one requiring the least cropping (or pixel aspect-ratio change). Every epoch, the
+    images of each bucket are shuffled and split into batches, and the batches of all buckets are
+    shuffled together, so buckets are sampled proportionally to their size. The resolution of
+    each batch is drawn from `n_res_buckets` values, so that the images take a small fixed set of
+    sizes. Crops, if any, are sampled for each image.
+
+    In distributed mode, all processes draw the same batches and each of them takes one batch out
+    of `world_size`. It yields lists of indices (idx, *random_floats), in the format of
+    `BatchedRandomSampler`, so it is used as the `batch_sampler` of the DataLoader.
+
+    Args:
+        dataset: `_SimpleDataset` with a pool of aspect ratios.
+        batch_size: number of images per batch (per process).
+        n_ar_buckets: number of aspect ratios, evenly spaced in log-scale, when the aspect ratios
+            are sampled from a range.
+        n_res_buckets: number of resolutions, evenly spaced, when they are sampled from a range.
+    """
+
+    def __init__(self, dataset, batch_size, n_ar_buckets=8, n_res_buckets=4):
+        assert dataset.ar_pool is not None, "Bucketing requires a pool of aspect ratios."
+        self.batch_size = batch_size
+        self.rng_tfs_order = dataset.rng_tfs_order
+
+        if dist.is_available() and dist.is_initialized():
+            self.world_size = dist.get_world_size()
+            self.rank = dist.get_rank()
+        else:
+            self.world_size = 1
+            self.rank = 0
+        self.epoch = None
+
+        # random numbers in [0, 1) leading to each aspect ratio and resolution
+        ar_pool = dataset.ar_pool
+        if isinstance(ar_pool, np.ndarray):
+            ars = ar_pool.astype(np.float64)
+            self.ar_rands = (np.arange(len(ars)) + 0.5) / len(ars)
+        else:
+            ars = np.exp(np.linspace(np.log(ar_pool[0]), np.log(ar_pool[1]), n_ar_buckets))
+            self.ar_rands = np.clip((ars - ar_pool[0]) / max(ar_pool[1] - ar_pool[0], 1e-12), 0, 1)
+        self.res_rands = np.linspace(0, 1, n_res_buckets) if "res" in self.rng_tfs_order else None
+
+        # bucket with the closest aspect ratio (in log-scale) to each image
+        im_ars = np.array([dp.h / dp.w for dp in dataset.datapoints])
+        buckets = np.abs(np.log(im_ars)[:, None] - np.log(ars)[None]).argmin(-1)
+        self.buckets = [np.flatnonzero(buckets == i) for i in range(len(ars))]
+        self.num_batches = sum(len(b) // batch_size for b in self.buckets)
+        self.num_batches -= self.num_batches % self.world_size
+        assert self.num_batches > 0, "Not enough images for a single batch per process."
+
+        counts = ", ".join(f"{ar:.2f}: {len(b)}" for ar, b in zip(ars, self.buckets))
+        logger.info(f"BucketedBatchSampler with {self.world_size} GPUs and buckets {{{counts}}}.")
+
+    def __len__(self):
+        return self.num_batches // self.world_size
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        # prepare RNG
+        if self.epoch is None:
+            assert (
+                self.world_size == 1 and self.rank == 0
+            ), "use set_epoch() if distributed mode is used"
+            seed = int(torch.empty((), dtype=torch.int64).random_().item())
+        else:
+            seed = self.epoch + 777
+        rng = np.random.default_rng(seed=seed)
+
+        # shuffled batches of each bucket, shuffled across buckets
+        bs = self.batch_size
+        batches = []
+        for bucket, idxs in enumerate(self.buckets):
+            idxs = rng.permutation(idxs)
+            batches += [(bucket, idxs[i : i + bs]) for i in range(0, len(idxs) - bs + 1, bs)]
+        order = rng.permutation(len(batches))[: self.num_batches]
+
+        # all processes draw the same batches and take one out of world_size
+        for k in order[self.rank :: self.world_size]:
+            bucket, idxs = batches[k]
+            rands = {"ar": np.full(bs, self.ar_rands[bucket])}
+            if self.res_rands is not None:
+                rands["res"] = np.full(bs, rng.choice(self.res_rands))
+            rands["crop_x"], rands["crop_y"] = rng.random((2, bs))
+            yield [
+                (int(idx), *(float(rands[tf][i]) for tf in self.rng_tfs_order))
+                for i, idx in enumerate(idxs)
+            ]
+
+
 class SimpleDataset(BaseDataset):
     """Dataset for images created with 'create_dataset_from_pano.py'.
 
@@ -285,9 +457,26 @@ class SimpleDataset(BaseDataset):
         },
         "preprocessing": ImagePreprocessor.default_conf,
         "augmentations": {"name": "geocalib", "verbose": False},
+        # photometric augmentations applied to whole training batches by the training loop (see
+        # batch_augmentations.py), e.g. {} for the defaults. The per-image transforms that are
+        # also applied here are disabled in "augmentations".
+        "batch_augmentations": None,
         "p_rotate": 0.0,  # probability to rotate image by +/- 90°
         "reseed": False,
         "seed": 0,
+        # cache of ground-truth rays, used when the same image sizes and intrinsics repeat
+        # across epochs (val/test, or train with discrete geometric transforms)
+        "ray_cache": {
+            "size": 0,  # max number of ray grids kept in memory by each worker
+            "dir": None,  # directory of an on-disk cache, None to disable it
+        },
+        # batches of images with the same target aspect ratio and resolution (see
+        # BucketedBatchSampler), only for training
+        "bucketing": {
+            "enable": False,
+            "n_ar_buckets": 8,  # when the aspect ratios are sampled from a range
+            "n_res_buckets": 4,  # when the resolutions are sampled from a range
+        },
         # data loader options
         "num_workers": 8,
         "prefetch_factor": 2,
@@ -315,6 +504,20 @@ class SimpleDataset(BaseDataset):
 
         # get sampler
         drop_last = split != "test" and distributed
+        bucketing = self.conf.get("bucketing", None)
+        if split == "train" and bucketing is not None and bucketing.enable:
+            batch_sampler = BucketedBatchSampler(
+                dataset, batch_size, bucketing.n_ar_buckets, bucketing.n_res_buckets
+            )
+            return DataLoader(
+                dataset,
+                batch_sampler=batch_sampler,
+                pin_memory=pinned,
+                collate_fn=collate,
+                num_workers=num_workers,
+                worker_init_fn=worker_init_fn,
+                prefetch_factor=self.conf.prefetch_factor,
+            )
         if split != "test" and dataset.npools > 0:
             sampler = BatchedRandomSampler(dataset, batch_size, dataset.npools, drop_last=True)
         elif distributed:
@@ -400,19 +603,7 @@ class _SimpleDataset(torch.utils.data.Dataset):
         self.edge_divisible_by = self.preprocessor.conf.edge_divisible_by
 
         # load image information
-        if self.dset_name in self.OPENPANO_FORMAT:
-            assert f"{split}_csv" in conf, f"Missing {split}_csv in conf"
-            infos_path = Path(self.conf.get(f"{split}_csv"))
-            self.datapoints = load_csv_openpano_format(
-                infos_path, self.img_dir, self.conf.simple_if_possible
-            )
-        elif self.dset_name in self.ANYCALIB_FORMAT:
-            assert f"{split}_h5" in conf, f"Missing {split}_h5 in conf"
-            self.datapoints = load_h5_anycalib_format(
-                Path(self.conf.get(f"{split}_h5")), self.img_dir
-            )
-        else:
-            raise ValueError(f"Unknown dataset format: {self.dset_name}")
+        self.datapoints = self._load_datapoints()
 
         # define augmentations
         aug_name = conf.augmentations.name
@@ -420,7 +611,12 @@ class _SimpleDataset(torch.utils.data.Dataset):
             aug_name in augmentations.keys()
         ), f'{aug_name} not in {" ".join(augmentations.keys())}'
         if self.split == "train":
-            self.augmentation = augmentations[aug_name](conf.augmentations)
+            aug_conf = conf.augmentations
+            if conf.batch_augmentations is not None:
+                aug_conf = disable_batched_transforms(
+                    aug_conf, conf.batch_augmentations, augmentations[aug_name].default_conf
+                )
+            self.augmentation = augmentations[aug_name](aug_conf)
         else:
             self.augmentation = IdentityAugmentation()
 
@@ -498,6 +694,45 @@ class _SimpleDataset(torch.utils.data.Dataset):
         # number of pools from which to sample during training/val
         self.npools = len(rng_tfs_order)
 
+        # cache of ground-truth rays
+        self.ray_cache = None
+        rc = conf.get("ray_cache", None)
+        if rc is not None and (rc.size > 0 or rc.dir is not None) and self._ray_grids_repeat():
+            self.ray_cache = RayGridCache(rc.size, rc.dir)
+            logger.info(
+                f"Caching the ground-truth rays of {split} (memo size {rc.size}, dir {rc.dir})."
+            )
+
+    def _ray_grids_repeat(self) -> bool:
+        """Whether the same (cam_id, params, h, w) are seen across epochs."""
+        if self.split != "train":
+            return True
+        discrete_res = self.res_pool is None or isinstance(self.res_pool, (int, float))
+        discrete_ar = self.ar_pool is None or isinstance(self.ar_pool, np.ndarray)
+        return (
+            discrete_res
+            and discrete_ar
+            and self.crop_pool is None
+            and not self.change_pixel_ar
+            and not self.conf.preprocessing.random_center
+        )
+
+    def _load_datapoints(self) -> list[DataPoint]:
+        """Load the information (path, size and intrinsics) of the images of the split."""
+        split = self.split
+        if self.dset_name in self.OPENPANO_FORMAT:
+            assert f"{split}_csv" in self.conf, f"Missing {split}_csv in conf"
+            infos_path = Path(self.conf.get(f"{split}_csv"))
+            return load_csv_openpano_format(infos_path, self.img_dir, self.conf.simple_if_possible)
+        if self.dset_name in self.ANYCALIB_FORMAT:
+            assert f"{split}_h5" in self.conf, f"Missing {split}_h5 in conf"
+            return load_h5_anycalib_format(Path(self.conf.get(f"{split}_h5")), self.img_dir)
+        raise ValueError(f"Unknown dataset format: {self.dset_name}")
+
+    def _load_image(self, datapoint: DataPoint) -> torch.Tensor:
+        """Load an image as a uint8 HWC tensor."""
+        return load_image(Path(datapoint.file_name), self.conf.grayscale, return_tensor=False)
+
     def __len__(self):
         return len(self.datapoints)
 
@@ -522,7 +757,7 @@ class _SimpleDataset(torch.utils.data.Dataset):
 
         # load image as uint8 and HWC for augmentation
         path = Path(datapoint.file_name)
-        image = load_image(path, self.conf.grayscale, return_tensor=False)
+        image = self._load_image(datapoint)
         # augment image
         image = self.augmentation(image, return_tensor=True)  # (3, H, W)
         h, w = image.shape[-2:]
@@ -588,9 +823,10 @@ class _SimpleDataset(torch.utils.data.Dataset):
 
         # get ground-truth rays (set offset to 0.5 to get rays at the *center* of the pixels)
         h, w = data["image"].shape[-2:]
-        rays, valid = cam.ray_grid(h, w, params, 0.5)
-        rays = rays.view(h * w, 3)
-        valid = rays.new_ones(h * w, dtype=torch.bool) if valid is None else valid.view(-1)
+        if self.ray_cache is None:
+            rays, valid = compute_ray_grid(cam, params, h, w)
+        else:
+            rays, valid = self.ray_cache(cam, params, h, w)
 
         # pad intrinsics to be stackable
         params = torch.cat((params, params.new_zeros(MAX_NPARAMS - len(params))))
@@ -356,6 +356,7 @@ class SimplePipeline(EvalPipeline):
                     viz2d.save_plot(save_to / f"latitude-{i}-{lat_err.median().item():.3f}.jpg")
                     plt.close()
 
+        cache_loader.close()
         summaries = {}
         for k, v in results.items():
             arr = np.array(v)
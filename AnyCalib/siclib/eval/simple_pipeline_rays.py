@@ -313,6 +313,7 @@ class SimplePipeline(EvalPipeline):
                     )
                     plt.close(fig)
 
+        cache_loader.close()
         summaries = {}
         for k, v in results.items():
             arr = np.array(v)
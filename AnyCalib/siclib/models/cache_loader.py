@@ -1,6 +1,9 @@
+import os
 import string
+from collections import OrderedDict
 
 import h5py
+import numpy as np
 import torch
 
 from siclib.datasets.base_dataset import collate
@@ -16,15 +19,118 @@ def pad_line_features(pred, seq_l: int = None):
     raise NotImplementedError
 
 
-def recursive_load(grp, pkeys):
-    return {
-        k: (
-            torch.from_numpy(grp[k].__array__())
-            if isinstance(grp[k], h5py.Dataset)
-            else recursive_load(grp[k], list(grp.keys()))
-        )
-        for k in pkeys
-    }
+def read_dataset(dset, dtype=None, pin_memory=False):
+    """Read a numeric HDF5 dataset into a tensor.
+
+    The values are written by HDF5 directly into the memory of the output tensor, which can be
+    page-locked (pinned) for asynchronous host-to-device copies. Floating point datasets are
+    converted to `dtype` during the read, e.g. predictions exported as float16.
+    """
+    np_dtype = dset.dtype
+    if np_dtype.kind not in "biuf" or dset.shape == ():
+        tensor = torch.from_numpy(np.asarray(dset.__array__()))
+        return tensor if dtype is None or np_dtype.kind != "f" else tensor.to(dtype)
+    if dtype is not None and np_dtype.kind == "f":
+        np_dtype = torch.empty((), dtype=dtype).numpy().dtype
+    tensor = torch.from_numpy(np.empty(0, dtype=np_dtype))
+    tensor = torch.empty(dset.shape, dtype=tensor.dtype, pin_memory=pin_memory)
+    if tensor.numel() > 0:
+        dset.read_direct(tensor.numpy())
+    return tensor
+
+
+def read_datasets(dsets, dtype=None, pin_memory=False):
+    """Read the same dataset of several samples into a single tensor stacked along dim 0.
+
+    Each dataset is written by HDF5 directly into its slice of the output tensor, so the batch
+    needs no collation and is copied to the device at once. Datasets that are not numeric arrays
+    of a common shape are read one by one and collated.
+    """
+    dset = dsets[0]
+    if (
+        dset.dtype.kind not in "biuf"
+        or dset.shape == ()
+        or any(d.shape != dset.shape or d.dtype != dset.dtype for d in dsets)
+    ):
+        return collate([read_dataset(d, dtype, pin_memory) for d in dsets])
+    np_dtype = dset.dtype
+    if dtype is not None and np_dtype.kind == "f":
+        np_dtype = torch.empty((), dtype=dtype).numpy().dtype
+    tensor = torch.from_numpy(np.empty(0, dtype=np_dtype))
+    tensor = torch.empty((len(dsets), *dset.shape), dtype=tensor.dtype, pin_memory=pin_memory)
+    if tensor.numel() > 0:
+        for d, out in zip(dsets, tensor.numpy()):
+            d.read_direct(out)
+    return tensor
+
+
+def recursive_load(grp, pkeys, dtype=None, pin_memory=False):
+    pred = {}
+    for k in pkeys:
+        item = grp[k]  # resolve each link only once
+        if isinstance(item, h5py.Dataset):
+            pred[k] = read_dataset(item, dtype, pin_memory)
+        else:
+            pred[k] = recursive_load(item, list(item.keys()), dtype, pin_memory)
+    return pred
+
+
+def batched_load(grps, pkeys, dtype=None, pin_memory=False):
+    """Equivalent to collating `recursive_load` of each group, with one read per sample and
+    dataset into the batched output tensors."""
+    pred = {}
+    for k in pkeys:
+        items = [grp[k] for grp in grps]
+        if isinstance(items[0], h5py.Dataset):
+            pred[k] = read_datasets(items, dtype, pin_memory)
+        else:
+            pred[k] = batched_load(items, list(items[0].keys()), dtype, pin_memory)
+    return pred
+
+
+class HDF5HandlePool:
+    """LRU pool of HDF5 files opened for reading.
+
+    Opening a file is much more expensive than reading a small group from it, so files are kept
+    open across batches and only the least recently used ones are closed. h5py handles must not
+    be used in a process different from the one that opened them (e.g. DataLoader workers forked
+    from the main process), so the pool is emptied, without closing the inherited handles, when it
+    is accessed from a new process.
+    """
+
+    def __init__(self, max_open=16):
+        assert max_open > 0, f"`max_open` must be positive, got {max_open=}."
+        self.max_open = max_open
+        self.files = OrderedDict()
+        self.pid = os.getpid()
+
+    def get(self, path):
+        if self.pid != os.getpid():
+            self.files, self.pid = OrderedDict(), os.getpid()
+        hfile = self.files.get(path)
+        if hfile is None or not hfile.id.valid:
+            hfile = self.files[path] = h5py.File(path, "r")
+            while len(self.files) > self.max_open:
+                self.files.popitem(last=False)[1].close()
+        self.files.move_to_end(path)
+        return hfile
+
+    def close(self):
+        if self.pid == os.getpid():
+            for hfile in self.files.values():
+                if hfile.id.valid:
+                    hfile.close()
+        self.files.clear()
+
+    def __len__(self):
+        return len(self.files)
+
+    def __getstate__(self):
+        # open handles cannot be pickled, e.g. when spawning DataLoader workers
+        return {"max_open": self.max_open, "files": OrderedDict(), "pid": None}
+
+    def __del__(self):
+        self.close()
 
 
 class CacheLoader(BaseModel):
@@ -39,12 +145,14 @@ class CacheLoader(BaseModel):
         "padding_fn": None,
         "padding_length": None,  # required for batching!
         "numeric_type": "float32",  # [None, "float16", "float32", "float64"]
+        "max_open_files": 16,  # HDF5 files kept open per process (LRU)
+        "pin_memory": False,  # read into pinned memory for async copies to the GPU
     }
 
     required_data_keys = ["name"]  # we need an identifier
 
     def _init(self, conf):
-        self.hfiles = {}
+        self.hfiles = HDF5HandlePool(conf.max_open_files)
         self.padding_fn = conf.padding_fn
         if self.padding_fn is not None:
             self.padding_fn = eval(self.padding_fn)
@@ -66,15 +174,38 @@ class CacheLoader(BaseModel):
             else:
                 device = "cpu"
 
+        pin_memory = (
+            self.conf.pin_memory
+            and torch.device(device).type == "cuda"
+            and torch.cuda.is_available()
+        )
         var_names = [x[1] for x in string.Formatter().parse(self.conf.path) if x[1]]
+        grps = []
         for i, name in enumerate(data["name"]):
             fpath = self.conf.path.format(**{k: data[k][i] for k in var_names})
             if self.conf.add_data_path:
                 fpath = DATA_PATH / fpath
-            hfile = h5py.File(str(fpath), "r")
-            grp = hfile[name]
+            grps.append(self.hfiles.get(str(fpath))[name])
+
+        if self.conf.collate and self.padding_fn is None:
+            # batched reads: each key is read into a single tensor for the whole batch
+            pkeys = self.conf.data_keys if self.conf.data_keys is not None else grps[0].keys()
+            pred = batched_load(grps, list(pkeys), self.numeric_dtype, pin_memory)
+            pred = batch_to_device(pred, device)
+            for k, v in pred.items():
+                for pattern in self.conf.scale:
+                    if k.startswith(pattern):
+                        scales = self.get_scales(data, k.replace(pattern, ""))
+                        # (B, ...) -> (B, 1, ..., 1, ...) to broadcast as scales[i] to pred[k][i]
+                        scales = scales.view(
+                            len(scales), *[1] * (v.dim() - scales.dim()), *scales.shape[1:]
+                        )
+                        pred[k] = pred[k] * scales
+            return pred
+
+        for i, grp in enumerate(grps):
             pkeys = self.conf.data_keys if self.conf.data_keys is not None else grp.keys()
-            pred = recursive_load(grp, pkeys)
+            pred = recursive_load(grp, list(pkeys), self.numeric_dtype, pin_memory)
             if self.numeric_dtype is not None:
                 pred = {
                     k: (
@@ -88,22 +219,24 @@ class CacheLoader(BaseModel):
             for k, v in pred.items():
                 for pattern in self.conf.scale:
                     if k.startswith(pattern):
-                        view_idx = k.replace(pattern, "")
-                        scales = (
-                            data["scales"]
-                            if len(view_idx) == 0
-                            else data[f"view{view_idx}"]["scales"]
-                        )
+                        scales = self.get_scales(data, k.replace(pattern, ""))
                         pred[k] = pred[k] * scales[i]
             # use this function to fix number of keypoints etc.
             if self.padding_fn is not None:
                 pred = self.padding_fn(pred, self.conf.padding_length)
             preds.append(pred)
-            hfile.close()
         if self.conf.collate:
             return batch_to_device(collate(preds), device)
         assert len(preds) == 1
         return batch_to_device(preds[0], device)
 
+    @staticmethod
+    def get_scales(data, view_idx):
+        return data["scales"] if len(view_idx) == 0 else data[f"view{view_idx}"]["scales"]
+
+    def close(self):
+        """Close the HDF5 files kept open by this process."""
+        self.hfiles.close()
+
     def loss(self, pred, data):
         raise NotImplementedError
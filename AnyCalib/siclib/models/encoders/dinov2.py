@@ -59,6 +59,7 @@ class DINOv2(nn.Module):
         num_trainable_blocks: int = -1,
         with_registers: bool = False,
         intermediate_layers: int | list[int] | None = None,
+        grad_checkpointing: bool | int | list[int] = False,
     ):
         super().__init__()
 
@@ -107,6 +108,9 @@ class DINOv2(nn.Module):
         if not norm_layer:
             self.model.norm.requires_grad_(False)
 
+        # blocks whose activations are recomputed in the backward pass to save memory
+        self.model.set_grad_checkpointing(grad_checkpointing)
+
         # intermediate layers to extract features from
         if intermediate_layers is None:
             self.out_index = dinov2_cfg["out_index"]
@@ -147,7 +151,7 @@ class DINOv2(nn.Module):
 
         outputs: list[Tensor] = []
         for i, blk in enumerate(self.model.blocks):
-            x = blk(x)
+            x = self.model.forward_block(i, blk, x)
             if i in self.out_index:
                 outputs.append(x)
         if self.norm_layer:
@@ -180,6 +180,9 @@ class DinoVisionTransformer(nn.Module):
         self.norm = norm_layer(embed_dim)
         self.head = nn.Identity()
 
+        # indices of the blocks with activation checkpointing
+        self.grad_checkpointing: set[int] = set()
+
         self.mask_token = nn.Parameter(torch.zeros(1, embed_dim))
 
         self.init_weights()
@@ -191,6 +194,31 @@ class DinoVisionTransformer(nn.Module):
             nn.init.normal_(self.register_tokens, std=1e-6)
         named_apply(init_weights_vit_timm, self)
 
+    def set_grad_checkpointing(self, blocks: Union[bool, int, Sequence[int]] = True):
+        """Enable activation checkpointing on a subset of the blocks.
+
+        The activations of the checkpointed blocks are not stored during the forward pass
+        but recomputed during the backward pass, trading compute for memory.
+
+        Args:
+            blocks: True (all) or False (none) of the blocks, the number of blocks starting
+                from the first one, or their indices in `self.blocks` (chunks of blocks if
+                `block_chunks > 0`). A negative number means all the blocks.
+        """
+        n = len(self.blocks)
+        if isinstance(blocks, bool):
+            blocks = range(n) if blocks else ()
+        elif isinstance(blocks, int):
+            blocks = range(n if blocks < 0 else min(blocks, n))
+        assert all(0 <= i < n for i in blocks), f"Invalid block indices {blocks} for {n} blocks."
+        self.grad_checkpointing = set(blocks)
+
+    def forward_block(self, i: int, blk: nn.Module, x):
+        """Forward the i-th block, with activation checkpointing if enabled for it."""
+        if i in self.grad_checkpointing and self.training and torch.is_grad_enabled():
+            return torch.utils.checkpoint.checkpoint(blk, x, use_reentrant=False)
+        return blk(x)
+
     def interpolate_pos_encoding(self, x, w, h):
         previous_dtype = x.dtype
         npatch = x.shape[1] - 1
@@ -272,8 +300,8 @@ class DinoVisionTransformer(nn.Module):
 
         x = self.prepare_tokens_with_masks(x, masks)
 
-        for blk in self.blocks:
-            x = blk(x)
+        for i, blk in enumerate(self.blocks):
+            x = self.forward_block(i, blk, x)
 
         x_norm = self.norm(x)
         return {
@@ -290,7 +318,7 @@ class DinoVisionTransformer(nn.Module):
         output, total_block_len = [], len(self.blocks)
         blocks_to_take = range(total_block_len - n, total_block_len) if isinstance(n, int) else n
         for i, blk in enumerate(self.blocks):
-            x = blk(x)
+            x = self.forward_block(i, blk, x)
             if i in blocks_to_take:
                 output.append(x)
         assert len(output) == len(
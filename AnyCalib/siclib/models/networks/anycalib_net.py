@@ -416,6 +416,9 @@ class AnyCalib(BaseModel):
                 "model_name": "dinov2_vitl14",
                 "num_trainable_blocks": -1,  # -1 -> all blocks trainable
                 "intermediate_layers": None,  # None -> default DPT's intermediate layers
+                # True/False, number (from the first) or indices of the blocks whose
+                # activations are recomputed in the backward pass to save memory
+                "grad_checkpointing": False,
             },
         },
         "decoder": {
@@ -30,12 +30,16 @@ from tqdm import tqdm
 
 from siclib import __module_name__, logger
 from siclib.datasets import get_dataset
+from siclib.datasets.batch_augmentations import BatchAugmentation
 from siclib.eval import run_benchmark
 from siclib.models import get_model
 from siclib.settings import EVAL_PATH, TRAINING_PATH
 from siclib.utils.experiments import (
+    CheckpointWriter,
     get_best_checkpoint,
     get_last_checkpoint,
+    load_checkpoint,
+    load_last_checkpoint,
     save_experiment,
 )
 from siclib.utils.stdout_capturing import capture_outputs
@@ -65,6 +69,7 @@ default_train_conf = {
     "optimizer": "adam",  # name of optimizer in [adam, sgd, rmsprop]
     "opt_regexp": None,  # regular expression to filter parameters to optimize
     "optimizer_options": {},  # optional arguments passed to the optimizer
+    "optimizer_impl": None,  # None (torch's default), "foreach" or "fused" (adam[w], sgd)
     "lr": 0.001,  # learning rate
     "lr_schedule": {
         "type": None,
@@ -81,6 +86,8 @@ default_train_conf = {
     "writer": "tensorboard",  # tensorboard or wandb
     "test_every_epoch": 1,  # interval for evaluation on the test benchmarks
     "keep_last_checkpoints": 10,  # keep only the last X checkpoints
+    "async_checkpoints": True,  # write checkpoints on a background thread
+    "save_safetensors": False,  # also export the weights as .safetensors (needs safetensors)
     "load_experiment": None,  # initialize the model from a previous experiment
     "median_metrics": [],  # add the median of some metrics
     "recall_metrics": {},  # add the recall of some metrics
@@ -216,8 +223,13 @@ def filter_parameters(params, regexp):
     return params
 
 
-def pack_lr_parameters(params, base_lr, lr_scaling):
-    """Pack each group of parameters with the respective scaled learning rate."""
+def pack_lr_parameters(params, base_lr, lr_scaling, impl=None):
+    """Pack each group of parameters with the respective scaled learning rate.
+
+    If `impl` is "foreach" or "fused", the groups are updated with the multi-tensor or fused
+    implementations of the optimizer. The fused kernels require all parameters of a group to be
+    floating point tensors: groups that are not fall back to "foreach".
+    """
     filters, scales = tuple(zip(*[(n, s) for s, names in lr_scaling for n in names]))
     scale2params = defaultdict(list)
     for n, p in params:
@@ -230,29 +242,39 @@ def pack_lr_parameters(params, base_lr, lr_scaling):
         "Parameters with scaled learning rate:\n%s",
         {s: [n for n, _ in ps] for s, ps in scale2params.items() if s != 1},
     )
-    return [
+    groups = [
         {"lr": scale * base_lr, "params": [p for _, p in ps]} for scale, ps in scale2params.items()
     ]
+    if impl is None:
+        return groups
+    assert impl in ("foreach", "fused"), f"Unknown optimizer implementation {impl}."
+    for group in groups:
+        impl_ = impl
+        if impl == "fused" and not all(p.is_floating_point() for p in group["params"]):
+            logger.warning(f"Cannot use fused optimizer for group with lr={group['lr']}: foreach.")
+            impl_ = "foreach"
+        group[impl_] = True
+    return groups
 
 
 def training(rank, conf, output_dir, args):
     if args.restore:
         logger.info(f"Restoring from previous training of {args.experiment}")
-        try:
-            init_cp = get_last_checkpoint(args.experiment, allow_interrupted=False)
-        except AssertionError:
-            init_cp = get_best_checkpoint(args.experiment)
-        logger.info(f"Restoring from checkpoint {init_cp.name}")
-        init_cp = torch.load(str(init_cp), map_location="cpu")
+        # the last checkpoint that passes the integrity check, or the best one
+        init_cp_path, init_cp = load_last_checkpoint(args.experiment, allow_interrupted=False)
+        logger.info(f"Restoring from checkpoint {init_cp_path.name}")
         conf = OmegaConf.merge(OmegaConf.create(init_cp["conf"]), conf)
         conf.train = OmegaConf.merge(default_train_conf, conf.train)
         epoch = init_cp["epoch"] + 1
 
         # get the best loss or eval metric from the previous best checkpoint
-        best_cp = get_best_checkpoint(args.experiment)
-        best_cp = torch.load(str(best_cp), map_location="cpu")
-        best_eval = best_cp["eval"][conf.train.best_key]
-        del best_cp
+        try:
+            best_cp = load_checkpoint(get_best_checkpoint(args.experiment))
+            best_eval = best_cp["eval"][conf.train.best_key]
+            del best_cp
+        except (FileNotFoundError, RuntimeError) as e:
+            logger.warning(f"Could not read the best checkpoint, resetting best eval: {e}")
+            best_eval = float("inf")
     else:
         # we start a new, fresh training
         conf.train = OmegaConf.merge(default_train_conf, conf.train)
@@ -266,7 +288,7 @@ def training(rank, conf, output_dir, args):
             except AssertionError:
                 init_cp = get_best_checkpoint(conf.train.load_experiment)
             # init_cp = get_last_checkpoint(conf.train.load_experiment)
-            init_cp = torch.load(str(init_cp), map_location="cpu")
+            init_cp = load_checkpoint(init_cp)
             # load the model config of the old setup, and overwrite with current config
             conf.model = OmegaConf.merge(OmegaConf.create(init_cp["conf"]).model, conf.model)
             print(conf.model)
@@ -304,6 +326,9 @@ def training(rank, conf, output_dir, args):
     logger.info(f"Using device {device}")
 
     dataset = get_dataset(data_conf.name)(data_conf)
+    # photometric augmentations applied to the collated training batches
+    batch_aug_conf = data_conf.get("batch_augmentations", None)
+    batch_augmentation = None if batch_aug_conf is None else BatchAugmentation(batch_aug_conf)
 
     # Optionally load a different validation dataset than the training one
     val_data_conf = conf.get("data_val", None)
@@ -323,10 +348,21 @@ def training(rank, conf, output_dir, args):
     else:
         train_loader = dataset.get_data_loader("train", distributed=args.distributed)
         val_loader = val_dataset.get_data_loader("val")
+    # with a batch sampler, the batch size is only known by the latter
+    train_batch_size = train_loader.batch_size or train_loader.batch_sampler.batch_size
     if rank == 0:
         logger.info(f"Training loader has {len(train_loader)} batches")
         logger.info(f"Validation loader has {len(val_loader)} batches")
 
+    if rank == 0:
+        ckpt_writer = CheckpointWriter(
+            output_dir,
+            conf.train.keep_last_checkpoints,
+            asynchronous=conf.train.async_checkpoints,
+            safetensors=conf.train.save_safetensors,
+        )
+        ckpt_writer.remove_partial_writes()
+
     # interrupts are caught and delayed for graceful termination
     def sigint_handler(signal, frame):
         logger.info("Caught keyboard interrupt signal, will terminate")
@@ -367,7 +403,9 @@ def training(rank, conf, output_dir, args):
     all_params = [p for n, p in params]
     logger.info(f"Num parameters: {sum(p.numel() for p in all_params)}")
 
-    lr_params = pack_lr_parameters(params, conf.train.lr, conf.train.lr_scaling)
+    lr_params = pack_lr_parameters(
+        params, conf.train.lr, conf.train.lr_scaling, conf.train.get("optimizer_impl", None)
+    )
     optimizer = optimizer_fn(lr_params, lr=conf.train.lr, **conf.train.optimizer_options)
     scaler = GradScaler(enabled=args.mixed_precision is not None)
     logger.info(f"Training with mixed_precision={args.mixed_precision}")
@@ -419,7 +457,7 @@ def training(rank, conf, output_dir, args):
 
     while epoch < conf.train.epochs and not stop:
         tot_it = (len(train_loader) * epoch) * (args.n_gpus if args.distributed else 1)
-        tot_n_samples = tot_it * train_loader.batch_size
+        tot_n_samples = tot_it * train_batch_size
 
         if conf.train.num_steps is not None and tot_it > conf.train.num_steps:
             logger.info(f"Reached max number of steps {conf.train.num_steps}")
@@ -468,7 +506,11 @@ def training(rank, conf, output_dir, args):
             logger.info(f'lr changed from {old_lr} to {optimizer.param_groups[0]["lr"]}')
 
         if args.distributed:
-            train_loader.sampler.set_epoch(epoch)
+            # batch samplers (e.g. BucketedBatchSampler) replace the sampler
+            train_sampler = train_loader.batch_sampler
+            if not hasattr(train_sampler, "set_epoch"):
+                train_sampler = train_loader.sampler
+            train_sampler.set_epoch(epoch)
             if hasattr(val_loader.sampler, "set_epoch"):
                 val_loader.sampler.set_epoch(0)  # some eval pipelines may need this
         if epoch > 0 and conf.train.dataset_callback_fn and not args.overfit:
@@ -488,13 +530,16 @@ def training(rank, conf, output_dir, args):
             tot_n_samples = tot_it
             if not args.log_it:
                 # We normalize the x-axis of tensorboard to num samples!
-                tot_n_samples *= train_loader.batch_size
+                tot_n_samples *= train_batch_size
 
             model.train()
             optimizer.zero_grad()
 
+            data = batch_to_device(data, device, non_blocking=False)
+            if batch_augmentation is not None:
+                # in full precision, matching the per-sample augmentations
+                data["image"] = batch_augmentation(data["image"])
             with autocast(enabled=args.mixed_precision is not None, dtype=mp_dtype):
-                data = batch_to_device(data, device, non_blocking=False)
                 pred = model(data)
                 losses, metrics = loss_fn(pred, data)
                 loss = torch.mean(losses["total"])
@@ -557,7 +602,7 @@ def training(rank, conf, output_dir, args):
                     if args.distributed:
                         train_results[k] = train_results[k].sum(-1)
                         torch.distributed.reduce(train_results[k], dst=0)
-                        train_results[k] /= train_loader.batch_size * args.n_gpus
+                        train_results[k] /= train_batch_size * args.n_gpus
                     train_results[k] = torch.mean(train_results[k], -1)
                     train_results[k] = train_results[k].item()
                 if rank == 0:
@@ -631,6 +676,7 @@ def training(rank, conf, output_dir, args):
                             stop,
                             args.distributed,
                             cp_name="checkpoint_best.tar",
+                            writer=ckpt_writer,
                         )
                         logger.info(f"New best val: {conf.train.best_key}={best_eval}")
                     if len(figures) > 0:
@@ -663,6 +709,7 @@ def training(rank, conf, output_dir, args):
                     output_dir,
                     stop,
                     args.distributed,
+                    writer=ckpt_writer,
                 )
 
             if stop:
@@ -682,12 +729,14 @@ def training(rank, conf, output_dir, args):
                 output_dir=output_dir,
                 stop=stop,
                 distributed=args.distributed,
+                writer=ckpt_writer,
             )
 
         epoch += 1
 
     logger.info(f"Finished training on process {rank}.")
     if rank == 0:
+        ckpt_writer.close()
         writer.close()
 
 
@@ -4,10 +4,13 @@ A set of utilities to manage and load checkpoints of training experiments.
 Author: Paul-Edouard Sarlin (skydes)
 """
 
+import hashlib
+import json
 import logging
 import os
 import re
 import shutil
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 
 import torch
@@ -37,6 +40,57 @@ def list_checkpoints(dir_):
     return checkpoints
 
 
+def checksum_path(path):
+    """Path of the file with the SHA-256 digest of a checkpoint."""
+    return Path(f"{path}.sha256")
+
+
+def file_digest(path, chunk_size=2**24):
+    """SHA-256 digest of a file."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_checkpoint(path):
+    """Load a checkpoint after verifying its integrity.
+
+    The digest written next to the checkpoint by `CheckpointWriter` is checked if present
+    (checkpoints saved before it was introduced have none). Corrupted or truncated files raise
+    a RuntimeError.
+    """
+    path = Path(path)
+    digest_path = checksum_path(path)
+    if digest_path.exists() and digest_path.read_text().strip() != file_digest(path):
+        raise RuntimeError(f"Checksum mismatch for checkpoint {path}.")
+    try:
+        return torch.load(str(path), map_location="cpu", weights_only=False)
+    except Exception as e:
+        raise RuntimeError(f"Could not load checkpoint {path}: {e}") from e
+
+
+def load_last_checkpoint(exper, allow_interrupted=True):
+    """Load the last valid checkpoint of an experiment, skipping corrupted ones.
+
+    Falls back to the best checkpoint if none of the numbered checkpoints can be loaded.
+    Returns the path and the content of the loaded checkpoint.
+    """
+    ckpts = list_checkpoints(Path(TRAINING_PATH, exper))
+    if not allow_interrupted:
+        ckpts = [(n, p) for (n, p) in ckpts if "_interrupted" not in p.name]
+    paths = [p for _, p in sorted(ckpts)[::-1]] + [get_best_checkpoint(exper)]
+    for path in paths:
+        if not path.exists():
+            continue
+        try:
+            return path, load_checkpoint(path)
+        except RuntimeError as e:
+            logger.warning(f"Skipping checkpoint {path.name}: {e}")
+    raise FileNotFoundError(f"No valid checkpoint for experiment {exper}.")
+
+
 def get_last_checkpoint(exper, allow_interrupted=True):
     """Get the last saved checkpoint for a given experiment name."""
     ckpts = list_checkpoints(Path(TRAINING_PATH, exper))
@@ -60,6 +114,8 @@ def delete_old_checkpoints(dir_, num_keep):
         if ("_interrupted" in str(ckpt[1]) and kept > 0) or kept >= num_keep:
             logger.info(f"Deleting checkpoint {ckpt[1].name}")
             ckpt[1].unlink()
+            checksum_path(ckpt[1]).unlink(missing_ok=True)
+            ckpt[1].with_suffix(".safetensors").unlink(missing_ok=True)
         else:
             kept += 1
 
@@ -75,7 +131,7 @@ def load_experiment(exper, conf=None, get_last=False, ckpt=None):
     else:
         ckpt = exper
     logger.info(f"Loading checkpoint {ckpt.name}")
-    ckpt = torch.load(str(ckpt), map_location="cpu", weights_only=False)
+    ckpt = load_checkpoint(ckpt)
 
     loaded_conf = OmegaConf.create(ckpt["conf"])
     OmegaConf.set_struct(loaded_conf, False)
@@ -94,6 +150,108 @@ def load_experiment(exper, conf=None, get_last=False, ckpt=None):
     return model
 
 
+def to_cpu(obj):
+    """Recursively copy the tensors of a (nested) state to CPU, decoupling it from training."""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return obj.__class__((k, to_cpu(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return obj.__class__(to_cpu(v) for v in obj)
+    return obj
+
+
+class CheckpointWriter:
+    """Write checkpoints in the background, atomically, and rotate them.
+
+    `save` snapshots the checkpoint to CPU, which is the only part blocking training, and
+    serializes it on a background thread. Files are written to a temporary file, together with
+    their SHA-256 digest, and renamed into place, so that a crash mid-write never leaves a
+    truncated checkpoint behind: `load_last_checkpoint` then resumes from the previous one. At
+    most one write is in flight, which bounds the host memory used by the snapshots.
+
+    Args:
+        output_dir: directory of the experiment.
+        keep_last: number of numbered checkpoints to keep (the best one is always kept).
+        asynchronous: write on a background thread.
+        safetensors: also export the model weights as `<checkpoint>.safetensors`.
+    """
+
+    def __init__(self, output_dir, keep_last, asynchronous=True, safetensors=False):
+        self.output_dir = Path(output_dir)
+        self.keep_last = keep_last
+        self.safetensors = safetensors
+        if safetensors:
+            import safetensors.torch  # noqa: F401 fail early if not installed
+
+        self.executor = ThreadPoolExecutor(1) if asynchronous else None
+        self.pending: Future | None = None
+
+    def remove_partial_writes(self):
+        """Delete the temporary files left by interrupted writes, e.g. when resuming a run.
+
+        Only call this when no other writer is active in `output_dir`.
+        """
+        for tmp in self.output_dir.glob(".*.tmp"):
+            tmp.unlink()
+
+    def save(self, checkpoint, cp_name, copy_to_best=False):
+        """Snapshot a checkpoint and write it, also as `checkpoint_best.tar` if requested."""
+        self.wait()  # raise errors of the previous write, and bound memory
+        checkpoint = to_cpu(checkpoint)
+        if self.executor is None:
+            self._write(checkpoint, cp_name, copy_to_best)
+        else:
+            self.pending = self.executor.submit(self._write, checkpoint, cp_name, copy_to_best)
+
+    def wait(self):
+        """Block until the pending write, if any, is done."""
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            pending.result()
+
+    def close(self):
+        self.wait()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def _replace(self, write_fn, path):
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        write_fn(tmp_path)
+        with open(tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _write(self, checkpoint, cp_name, copy_to_best):
+        cp_path = self.output_dir / cp_name
+        # invalidate the digest of an existing file first, so that it never outlives it
+        checksum_path(cp_path).unlink(missing_ok=True)
+        self._replace(lambda p: torch.save(checkpoint, str(p)), cp_path)
+        digest = file_digest(cp_path)
+        self._replace(lambda p: p.write_text(digest), checksum_path(cp_path))
+        if self.safetensors:
+            from safetensors.torch import save_file
+
+            metadata = {"conf": json.dumps(checkpoint["conf"]), "epoch": str(checkpoint["epoch"])}
+            self._replace(
+                lambda p: save_file(checkpoint["model"], str(p), metadata=metadata),
+                cp_path.with_suffix(".safetensors"),
+            )
+        logger.info(f"Saved checkpoint {cp_name}")
+
+        if copy_to_best:
+            best_path = self.output_dir / "checkpoint_best.tar"
+            checksum_path(best_path).unlink(missing_ok=True)
+            self._replace(lambda p: shutil.copy(cp_path, p), best_path)
+            self._replace(lambda p: p.write_text(digest), checksum_path(best_path))
+            if self.safetensors:
+                self._replace(
+                    lambda p: shutil.copy(cp_path.with_suffix(".safetensors"), p),
+                    best_path.with_suffix(".safetensors"),
+                )
+        delete_old_checkpoints(self.output_dir, self.keep_last)
+
+
 def save_experiment(
     model,
     optimizer,
@@ -108,9 +266,13 @@ def save_experiment(
     stop=False,
     distributed=False,
     cp_name=None,
+    writer=None,
 ):
     """Save the current model to a checkpoint
-    and return the best result so far."""
+    and return the best result so far.
+
+    The checkpoint is written by `writer`, in the background if asynchronous, or synchronously
+    by a new `CheckpointWriter` if None."""
     state = (model.module if distributed else model).state_dict()
     checkpoint = {
         "model": state,
@@ -124,12 +286,13 @@ def save_experiment(
     if cp_name is None:
         cp_name = f"checkpoint_{epoch}_{iter_i}" + ("_interrupted" if stop else "") + ".tar"
     logger.info(f"Saving checkpoint {cp_name}")
-    cp_path = str(output_dir / cp_name)
-    torch.save(checkpoint, cp_path)
 
+    copy_to_best = False
     if cp_name != "checkpoint_best.tar" and results[conf.train.best_key] < best_eval:
         best_eval = results[conf.train.best_key]
         logger.info(f"New best val: {conf.train.best_key}={best_eval}")
-        shutil.copy(cp_path, str(output_dir / "checkpoint_best.tar"))
-    delete_old_checkpoints(output_dir, conf.train.keep_last_checkpoints)
+        copy_to_best = True
+    if writer is None:
+        writer = CheckpointWriter(output_dir, conf.train.keep_last_checkpoints, False)
+    writer.save(checkpoint, cp_name, copy_to_best)
     return best_eval
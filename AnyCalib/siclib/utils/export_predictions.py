@@ -5,6 +5,8 @@ or call from another script.
 """
 
 import logging
+import queue
+import threading
 from pathlib import Path
 
 import h5py
@@ -12,7 +14,7 @@ import numpy as np
 import torch
 from tqdm import tqdm
 
-from siclib.utils.tensor import batch_to_device
+from siclib.utils.tensor import TensorWrapper, batch_to_device
 from siclib.utils.tools import get_device
 
 # flake8: noqa
@@ -21,6 +23,142 @@ from siclib.utils.tools import get_device
 logger = logging.getLogger(__name__)
 
 
+COMPRESSIONS = (None, "lzf", "gzip")
+
+
+def batch_to_host(pred, as_half=False):
+    """Copy a batch of predictions to numpy arrays with one transfer per tensor.
+
+    All the device-to-host copies are enqueued before synchronizing once, instead of copying
+    each key of each sample separately. With `as_half`, float32 predictions are converted to
+    float16 before the copy, which also halves the transferred bytes. Lists and tuples, e.g. of
+    per-sample tensors, are copied element-wise, and other values are returned unchanged.
+    """
+    on_cuda = False
+
+    def _to_host(v):
+        nonlocal on_cuda
+        if isinstance(v, TensorWrapper):
+            v = v._data
+        if isinstance(v, (list, tuple)):
+            return [_to_host(x) for x in v]
+        if not isinstance(v, torch.Tensor):
+            return v
+        if as_half and v.dtype == torch.float32:
+            v = v.half()
+        on_cuda |= v.is_cuda
+        return v.detach().to("cpu", non_blocking=True)
+
+    def _to_numpy(v):
+        if isinstance(v, list):
+            return [_to_numpy(x) for x in v]
+        return v.numpy() if isinstance(v, torch.Tensor) else v
+
+    pred = {k: _to_host(v) for k, v in pred.items()}
+    if on_cuda:
+        torch.cuda.synchronize()
+    return {k: _to_numpy(v) for k, v in pred.items()}
+
+
+class H5Writer:
+    """Writer of the predictions of each sample to a group of an HDF5 file.
+
+    With `queue_size > 0`, the groups are written by a background thread fed by a bounded queue,
+    so that HDF5 writes (and compression) overlap with the model forward passes while the memory
+    of the pending batches stays bounded. Errors of the writer thread are raised in the main
+    thread by the next call to `write` or `close`.
+
+    Args:
+        output_file: path of the HDF5 file. Existing files are overwritten.
+        compression: None, "lzf" (fast) or "gzip" (smaller, slower).
+        compression_opts: compression level for gzip (0-9).
+        chunked: store the (non-scalar) datasets in chunks with an automatically chosen shape.
+            Compressed datasets are always chunked.
+        queue_size: maximum number of pending batches. 0: write synchronously.
+    """
+
+    def __init__(
+        self,
+        output_file,
+        compression=None,
+        compression_opts=None,
+        chunked=False,
+        queue_size=8,
+    ):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"`compression` must be one of {COMPRESSIONS}, got {compression}.")
+        self.dset_kwargs = {}
+        if chunked or compression is not None:
+            self.dset_kwargs["chunks"] = True
+        if compression is not None:
+            self.dset_kwargs |= {"compression": compression, "compression_opts": compression_opts}
+
+        self.hfile = h5py.File(str(output_file), "w")
+        self.error = None
+        self.queue = None
+        if queue_size > 0:
+            self.queue = queue.Queue(maxsize=queue_size)
+            self.thread = threading.Thread(target=self._run, name="H5Writer", daemon=True)
+            self.thread.start()
+
+    def write(self, names, pred):
+        """Write the predictions of a batch.
+
+        Args:
+            names: names of the samples, used as group names.
+            pred: dict of (B, ...) numpy arrays or of lists with B elements.
+        """
+        self._raise_error()
+        if self.queue is None:
+            self._write(names, pred)
+        else:
+            self.queue.put((names, pred))
+
+    def close(self):
+        if self.queue is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.hfile.close()
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _run(self):
+        while (item := self.queue.get()) is not None:
+            # after an error, keep consuming the queue so that the main thread does not block
+            if self.error is None:
+                try:
+                    self._write(*item)
+                except Exception as e:
+                    self.error = e
+
+    def _write(self, names, pred):
+        for idx, name in enumerate(names):
+            try:
+                try:
+                    grp = self.hfile.create_group(name)
+                except ValueError as e:
+                    raise ValueError(f"Group already exists {name}") from e
+
+                for k, v in pred.items():
+                    v = np.asarray(v[idx])
+                    # scalar and empty datasets cannot be chunked
+                    kwargs = self.dset_kwargs if v.size > 0 and v.ndim > 0 else {}
+                    grp.create_dataset(k, data=v, **kwargs)
+            except RuntimeError:
+                print(f"Failed to export {name}")
+                continue
+
+
 @torch.no_grad()
 def export_predictions(
     loader,
@@ -31,54 +169,43 @@ def export_predictions(
     callback_fn=None,
     optional_keys=None,
     verbose=True,
+    compression=None,
+    compression_opts=None,
+    chunked=False,
+    queue_size=8,
 ):  # sourcery skip: low-code-quality
+    """Export the predictions of a model to an HDF5 file with one group per sample.
+
+    See `H5Writer` for the `compression`, `compression_opts`, `chunked` and `queue_size`
+    arguments.
+    """
     if optional_keys is None:
         optional_keys = []
 
     assert keys == "*" or isinstance(keys, (tuple, list))
     Path(output_file).parent.mkdir(exist_ok=True, parents=True)
-    hfile = h5py.File(str(output_file), "w")
     device = get_device()
     model = model.to(device).eval()
 
     if not verbose:
         logger.info(f"Exporting predictions to {output_file}")
 
-    for data_ in tqdm(loader, desc="Exporting", total=len(loader), ncols=80, disable=not verbose):
-        data = batch_to_device(data_, device, non_blocking=True)
-        pred = model(data)
-        if callback_fn is not None:
-            pred = {**callback_fn(pred, data), **pred}
-        if keys != "*":
-            if len(set(keys) - set(pred.keys())) > 0:
-                raise ValueError(f"Missing key {set(keys) - set(pred.keys())}")
-            pred = {k: v for k, v in pred.items() if k in keys + optional_keys}
-
-        # assert len(pred) > 0, "No predictions found"
-
-        for idx in range(len(data["name"])):
-            pred_ = {k: v[idx].cpu().numpy() for k, v in pred.items()}
-
-            if as_half:
-                for k in pred_:
-                    dt = pred_[k].dtype
-                    if (dt == np.float32) and (dt != np.float16):
-                        pred_[k] = pred_[k].astype(np.float16)
-            try:
-                name = data["name"][idx]
-                try:
-                    grp = hfile.create_group(name)
-                except ValueError as e:
-                    raise ValueError(f"Group already exists {name}") from e
+    with H5Writer(output_file, compression, compression_opts, chunked, queue_size) as writer:
+        for data_ in tqdm(
+            loader, desc="Exporting", total=len(loader), ncols=80, disable=not verbose
+        ):
+            data = batch_to_device(data_, device, non_blocking=True)
+            pred = model(data)
+            if callback_fn is not None:
+                pred = {**callback_fn(pred, data), **pred}
+            if keys != "*":
+                if len(set(keys) - set(pred.keys())) > 0:
+                    raise ValueError(f"Missing key {set(keys) - set(pred.keys())}")
+                pred = {k: v for k, v in pred.items() if k in keys + optional_keys}
 
-                # grp = hfile.create_group(name)
-                for k, v in pred_.items():
-                    grp.create_dataset(k, data=v)
-            except RuntimeError:
-                print(f"Failed to export {name}")
-                continue
+            # assert len(pred) > 0, "No predictions found"
 
-        del pred
+            writer.write(list(data["name"]), batch_to_host(pred, as_half))
+            del pred
 
-    hfile.close()
     return output_file
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Insta360 Pro 2 Panorama Rendering from Calibrated Lenses
+
+This script renders an equirectangular or cubemap panorama from the six origin
+images of the Insta360 Pro 2, using the per-lens intrinsics estimated by
+predict_insta360.py and the lens rotations of a rig file. The lookup maps from
+panorama pixels to (lens, x, y) are cached, so re-rendering stored origins with the
+same calibration does not recompute any geometry.
+
+Usage:
+    python stitch_insta360.py                    # Uses default config.json
+    python stitch_insta360.py --config my_config.json  # Uses custom config
+"""
+
+import sys
+import os
+import argparse
+import time
+import numpy as np
+from PIL import Image
+
+# Add current directory to path to find anycalib
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from anycalib.panorama import PanoramaStitcher
+from predict_insta360 import get_default_config, get_image_paths, load_config
+
+
+def run_stitching(config: dict):
+    """Main stitching function."""
+    stitch_config = get_default_config()["stitching"] | config.get("stitching", {})
+    json_file = config.get("output", {}).get("json_file", "anycalib.json")
+    cam_id = config.get("camera", {}).get("cam_id", "kb:4")
+    if not os.path.exists(json_file):
+        print(f"Error: Intrinsics file '{json_file}' not found. Run predict_insta360.py first.")
+        sys.exit(1)
+
+    # Load images
+    images = {}
+    for idx, filename, filepath in get_image_paths(config):
+        if not os.path.exists(filepath):
+            print(f"[{idx}] Image not found: {filepath}")
+            sys.exit(1)
+        images[filename] = np.array(Image.open(filepath).convert("RGB"))
+    print(f"Loaded {len(images)} images")
+
+    stitcher = PanoramaStitcher.from_files(
+        json_file,
+        stitch_config["rig_file"],
+        {name: im.shape[:2] for name, im in images.items()},
+        cam_id=cam_id,
+        max_lenses=stitch_config["max_lenses"],
+        max_angle=stitch_config["max_angle"],
+        feather=stitch_config["feather"],
+        cache_dir=stitch_config["maps_cache_dir"],
+    )
+    projection = stitch_config["projection"]
+    out_size = (stitch_config["height"], stitch_config["width"])
+    print(f"Rendering {projection} panorama of size {out_size[1]}x{out_size[0]}")
+
+    tic = time.perf_counter()
+    stitcher.maps(projection, out_size)
+    print(f"  - Lookup maps ready in {time.perf_counter() - tic:.2f}s")
+    tic = time.perf_counter()
+    pano = stitcher.render(list(images.values()), projection, out_size)
+    print(f"  - Rendered in {time.perf_counter() - tic:.2f}s")
+
+    output_file = stitch_config["output_file"]
+    if os.path.dirname(output_file):
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    Image.fromarray(pano.numpy()).save(output_file)
+    print(f"  - Panorama saved to: {output_file}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Insta360 Pro 2 panorama rendering from AnyCalib intrinsics",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python stitch_insta360.py
+  python stitch_insta360.py --config my_config.json
+
+The "stitching" section of the config selects the rig file, projection and size.
+        """
+    )
+    parser.add_argument(
+        '-c', '--config',
+        type=str,
+        default='config.json',
+        help='Path to configuration JSON file (default: config.json)'
+    )
+    args = parser.parse_args()
+    run_stitching(load_config(args.config))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import pytest
+import torch
+
+pytest.importorskip("omegaconf")  # required by siclib
+
+from siclib.datasets.batch_augmentations import (  # noqa: E402
+    BatchAdvancedBlur,
+    BatchAugmentation,
+    BatchColorJitter,
+    BatchRandomAdditiveShade,
+    disable_batched_transforms,
+)
+
+
+@pytest.mark.parametrize(
+    "transform",
+    [
+        BatchColorJitter(p=1),
+        BatchRandomAdditiveShade(kernel_size_limit=(15, 35), p=1),
+        BatchAdvancedBlur(p=1),
+        BatchAugmentation({"shade": {"p": 0.5, "kernel_size_limit": [15, 35]}}),
+    ],
+)
+@pytest.mark.parametrize("channels", [1, 3])
+def test_shapes_and_range(transform, channels):
+    images = torch.rand(4, channels, 48, 64)
+    out = transform(images)
+    assert out.shape == images.shape and out.dtype == images.dtype
+    assert out.min() >= 0 and out.max() <= 1
+
+
+@pytest.mark.parametrize(
+    "transform",
+    [BatchColorJitter(p=0), BatchRandomAdditiveShade(p=0), BatchAdvancedBlur(p=0)],
+)
+def test_p_zero_is_identity(transform):
+    images = torch.rand(4, 3, 48, 64)
+    assert transform(images) is images
+
+
+def test_blur_kernels():
+    blur = BatchAdvancedBlur(blur_limit=(3, 7))
+    kernels = blur.kernels(256, torch.empty(0))
+    assert kernels.shape == (256, 7, 7)
+    assert (kernels >= 0).all()
+    torch.testing.assert_close(kernels.sum((-2, -1)), torch.ones(256))
+    # the kernels are centered and their supports are within blur_limit
+    assert (kernels[:, 3, 3] > 0).all()
+    assert BatchAdvancedBlur(blur_limit=(3, 3)).kernels(8, kernels).shape == (8, 3, 3)
+    small = BatchAdvancedBlur(blur_limit=(3, 5), beta_limit=(0.5, 0.5))
+    support = small.kernels(256, kernels) > 0
+    sizes = support.any(-1).sum(-1)
+    assert set(sizes.tolist()) == {3, 5}
+    assert (support.any(-1) == support.any(-2)).all()
+    # constant images are preserved
+    images = torch.full((4, 3, 16, 16), 0.3)
+    torch.testing.assert_close(blur.apply(images), images)
+
+
+def test_color_jitter_ranges():
+    images = torch.rand(512, 3, 4, 4) * 0.5
+    brightness = BatchColorJitter(brightness=0.2, contrast=0, saturation=0, hue=0, p=1)
+    factors = brightness(images).flatten(1).mean(1) / images.flatten(1).mean(1)
+    assert factors.min() >= 0.8 - 1e-5 and factors.max() <= 1.2 + 1e-5
+    assert factors.min() < 0.85 and factors.max() > 1.15
+    # the hue shift keeps the value and chroma of each pixel
+    hue = BatchColorJitter(brightness=0, contrast=0, saturation=0, hue=0.2, p=1)
+    out = hue(images)
+    torch.testing.assert_close(out.amax(1), images.amax(1))
+    torch.testing.assert_close(
+        out.amax(1) - out.amin(1), images.amax(1) - images.amin(1)
+    )
+    # hue shifts of 0 and 1 (360°) are identities
+    shifts = torch.tensor([0.0, 1.0]).view(2, 1, 1, 1)
+    torch.testing.assert_close(
+        BatchColorJitter.adjust_hue(images[:2], shifts), images[:2]
+    )
+
+
+def test_shade_transparency_range():
+    shade = BatchRandomAdditiveShade(
+        transparency_limit=(-0.5, 0.8), kernel_size_limit=(3, 5), p=1
+    )
+    images = torch.full((64, 1, 64, 64), 0.5)
+    ratio = shade(images) / images
+    # darkened by at most 80% and brightened by at most 50%, and shaded somewhere
+    assert ratio.min() >= 0.2 - 1e-5 and ratio.max() <= 1.5 + 1e-5
+    assert ((ratio - 1).abs() > 1e-3).flatten(1).any(1).all()
+
+
+def test_batch_augmentation_transforms():
+    assert [type(t) for t in BatchAugmentation().transforms] == [
+        BatchColorJitter,
+        BatchAdvancedBlur,
+    ]
+    aug = BatchAugmentation({"color_jitter": {"p": 0}, "shade": {"p": 1}})
+    assert aug.names == ["shade", "blur"]
+    assert [t.p for t in aug.transforms] == [1, 0.5]
+
+
+def test_disable_batched_transforms():
+    default_conf = {"p": 1.0, "color_jitter": True, "blur": True}
+    aug_conf = {"name": "geocalib", "verbose": False}
+    conf = disable_batched_transforms(aug_conf, {}, default_conf)
+    assert conf == aug_conf | {"color_jitter": False, "blur": False}
+    conf = disable_batched_transforms(aug_conf, {"blur": {"p": 0}}, default_conf)
+    assert conf == aug_conf | {"color_jitter": False}
+    # transforms that cannot be disabled in the per-image augmentations are ignored
+    conf = disable_batched_transforms(aug_conf, {"shade": {"p": 1}}, {"p": 1.0})
+    assert conf == aug_conf
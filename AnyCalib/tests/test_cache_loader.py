@@ -0,0 +1,97 @@
+import pickle
+
+import numpy as np
+import pytest
+import torch
+
+h5py = pytest.importorskip("h5py")
+pytest.importorskip("omegaconf")  # required by siclib
+
+from siclib.models.cache_loader import (  # noqa: E402
+    CacheLoader,
+    HDF5HandlePool,
+    batched_load,
+    read_dataset,
+    recursive_load,
+)
+
+
+def write_preds(path, names, shape=(5, 2)):
+    rng = np.random.default_rng(0)
+    with h5py.File(path, "w") as hfile:
+        for name in names:
+            grp = hfile.create_group(name)
+            grp.create_dataset("keypoints", data=rng.random(shape))
+            grp.create_dataset("idx", data=rng.integers(0, 9, 4, dtype=np.int32))
+            grp.create_dataset("score", data=rng.random())
+            grp.create_group("nested").create_dataset("x", data=rng.random(3))
+
+
+def test_handle_pool_lru(tmp_path):
+    paths = [str(tmp_path / f"{i}.h5") for i in range(3)]
+    for path in paths:
+        write_preds(path, ["a"])
+    pool = HDF5HandlePool(max_open=2)
+    first = pool.get(paths[0])
+    pool.get(paths[1])
+    assert pool.get(paths[0]) is first  # reused and marked as recently used
+    pool.get(paths[2])  # evicts the least recently used file: paths[1]
+    assert len(pool) == 2 and list(pool.files) == [paths[0], paths[2]]
+    assert first.id.valid
+    pool.close()
+    assert len(pool) == 0 and not first.id.valid
+
+
+def test_handle_pool_fork_and_pickle(tmp_path):
+    path = str(tmp_path / "preds.h5")
+    write_preds(path, ["a"])
+    pool = HDF5HandlePool(max_open=4)
+    inherited = pool.get(path)
+    # pickled (e.g. spawned DataLoader workers): empty pool with the same size
+    clone = pickle.loads(pickle.dumps(pool))
+    assert len(clone) == 0 and clone.max_open == 4
+    assert clone.get(path) is not inherited
+    clone.close()
+    # forked: the inherited handles are dropped without being closed
+    pool.pid = -1
+    hfile = pool.get(path)
+    assert hfile is not inherited and len(pool) == 1
+    assert inherited.id.valid
+    inherited.close()
+    pool.close()
+
+
+def test_read_dataset_dtype(tmp_path):
+    path = str(tmp_path / "preds.h5")
+    write_preds(path, ["a"])
+    with h5py.File(path, "r") as hfile:
+        grp = hfile["a"]
+        kpts = read_dataset(grp["keypoints"], torch.float16)
+        assert kpts.dtype == torch.float16 and kpts.shape == (5, 2)
+        torch.testing.assert_close(kpts, torch.from_numpy(grp["keypoints"][()]).half())
+        # integers and scalars
+        assert read_dataset(grp["idx"], torch.float16).dtype == torch.int32
+        score = read_dataset(grp["score"], torch.float32)
+        assert score.dtype == torch.float32 and score.shape == ()
+        assert read_dataset(grp["keypoints"]).dtype == torch.float64
+
+
+def test_batched_load_matches_per_sample(tmp_path):
+    path = str(tmp_path / "preds.h5")
+    write_preds(path, ["a", "b", "c"])
+    with h5py.File(path, "r") as hfile:
+        grps = [hfile[n] for n in ("a", "b", "c")]
+        keys = list(grps[0].keys())
+        batched = batched_load(grps, keys, torch.float32)
+        samples = [recursive_load(grp, keys, torch.float32) for grp in grps]
+    for k in ("keypoints", "idx", "score"):
+        torch.testing.assert_close(batched[k], torch.stack([s[k] for s in samples]))
+    assert batched["nested"]["x"].shape == (3, 3)
+
+    loader = CacheLoader({"path": path, "add_data_path": False})
+    data = {"name": ["a", "c"], "scales": torch.tensor([[1.0, 2.0], [3.0, 4.0]])}
+    pred = loader(data)
+    loader.close()
+    assert pred["keypoints"].shape == (2, 5, 2)
+    expected = torch.stack([samples[0]["keypoints"], samples[2]["keypoints"]])
+    torch.testing.assert_close(pred["keypoints"], expected * data["scales"][:, None])
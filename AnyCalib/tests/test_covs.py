@@ -0,0 +1,105 @@
+import torch
+
+from anycalib.cameras import KannalaBrandt
+from anycalib.cameras.kannala_brandt import propagate_tangent_covs
+from anycalib.manifolds import Unit3
+from anycalib.model.anycalib_pretrained import Calibrator
+from anycalib.model.ray_decoder import field_spread_log_covs
+
+
+def noisy_fields(h: int = 60, w: int = 80):
+    """KB fields with accurate rays on the left half and noisy rays on the right."""
+    torch.manual_seed(0)
+    cam = KannalaBrandt(num_k=2)
+    params = torch.tensor([30.0, 30.0, 40.0, 30.0, 0.05, -0.01], dtype=torch.float64)
+    im_coords = cam.pixel_grid_coords(h, w, params, 0.5).view(h * w, 2)
+    rays, _ = cam.unproject(params, im_coords)
+    std = torch.where(im_coords[:, :1] < w / 2, 1e-4, 3e-2).expand(-1, 2)
+    tcoords = Unit3.logmap_at_z1(rays) + std * torch.randn_like(std)
+    fields = {
+        "rays": Unit3.expmap_at_z1(tcoords)[None],
+        "tangent_coords": tcoords[None],
+        "log_covs": (std**2).log()[None],
+    }
+    return cam, params, im_coords, fields
+
+
+def test_propagate_tangent_covs_matches_autograd():
+    torch.manual_seed(0)
+    bearings = torch.nn.functional.normalize(
+        torch.randn(6, 3, dtype=torch.float64), dim=-1
+    )
+    bearings[:, 2] = bearings[:, 2].abs()
+    covs = torch.rand(6, 2, dtype=torch.float64)
+    k = torch.tensor([0.05, -0.01], dtype=torch.float64)
+
+    def err(tcoords: torch.Tensor, bearing: torch.Tensor) -> torch.Tensor:
+        p = Unit3.expmap(bearing, tcoords)
+        R = p[:2].norm()
+        theta = torch.atan2(R, p[2])
+        return theta * (1 + k[0] * theta**2 + k[1] * theta**4) * p[:2] / R
+
+    expected = []
+    for bearing, cov in zip(bearings, covs):
+        J = torch.autograd.functional.jacobian(
+            lambda t: err(t, bearing), bearings.new_zeros(2)
+        )
+        expected.append(J @ cov.diag() @ J.T)
+    torch.testing.assert_close(
+        propagate_tangent_covs(bearings, covs, k), torch.stack(expected)
+    )
+
+
+def test_kb_weighted_fit():
+    cam, params, im_coords, fields = noisy_fields()
+    rays, covs = fields["rays"][0], fields["log_covs"][0].exp()
+    params_lin, info = cam.fit(im_coords, rays)
+    params_w, info_w = cam.fit(im_coords, rays, covs=covs, params0=params_lin)
+    assert info == info_w == 0
+    err = ((params_lin - params) / params)[:4].abs().max()
+    err_w = ((params_w - params) / params)[:4].abs().max()
+    assert err_w < 0.2 * err
+
+
+def test_calibrator_with_covs():
+    cam, params, _, fields = noisy_fields()
+    data = {"image": torch.zeros(1, 3, 60, 80), "cam_id": ["kb:2"]}
+    out = Calibrator()(fields, data)
+    calib = Calibrator(
+        lin_with_covs=True, nonlin_opt_w_covs=True, cov_guided_sampling=True
+    )
+    assert calib.uses_covs and not Calibrator().uses_covs
+    out_w = calib(fields, data)
+    err = ((out["intrinsics"][0] - params) / params)[:4].abs().max()
+    err_w = ((out_w["intrinsics"][0] - params) / params)[:4].abs().max()
+    assert out_w["success"].all() and err_w < 0.2 * err
+    # covariance-guided RANSAC initialization
+    calib.init_with_sac = True
+    out_sac = calib(fields, data)
+    torch.testing.assert_close(out_sac["intrinsics"][0], out_w["intrinsics"][0])
+
+
+def test_field_spread_log_covs():
+    _, _, _, fields = noisy_fields()
+    tcoords = fields["tangent_coords"].view(1, 60, 80, 2).permute(0, 3, 1, 2)
+    std = field_spread_log_covs(tcoords).exp().sqrt()
+    assert std.shape == (1, 2, 60, 80)
+    # far from the transition between the accurate and the noisy halves
+    torch.testing.assert_close(
+        std[..., 5:-5, 50:].mean(), torch.tensor(3e-2).double(), rtol=0.15, atol=0
+    )
+    assert (std[..., :30] < 2e-3).all()
+
+
+def test_field_spread_log_covs_ignores_curvature():
+    """A noise-free field of a strongly distorted camera gets near-uniform weights."""
+    h = w = 322
+    cam = KannalaBrandt(num_k=2)
+    params = torch.tensor([100.0, 100, 161, 161, 0.02, -0.005], dtype=torch.float64)
+    im_coords = cam.pixel_grid_coords(h, w, params, 0.5).view(h * w, 2)
+    rays, valid = cam.unproject(params, im_coords)
+    assert valid.all()  # up to ~135 deg. from the optical axis
+    tcoords = Unit3.logmap_at_z1(rays).view(1, h, w, 2).permute(0, 3, 1, 2)
+    for min_std in (1e-3, 1e-5):
+        weights = (-field_spread_log_covs(tcoords, min_std=min_std)).exp()
+        assert weights.max() / weights.min() < 1.1
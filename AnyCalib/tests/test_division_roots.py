@@ -0,0 +1,52 @@
+import pytest
+import torch
+
+from anycalib.cameras import Division
+from anycalib.cameras.division import division_radii, radii_via_companion
+
+
+def get_rays(dtype: torch.dtype) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    torch.manual_seed(0)
+    theta = torch.rand(6, 500, dtype=dtype) * 1.5
+    theta[:, 0] = 0  # optical axis
+    k = torch.tensor(
+        [[-0.1, 0.01], [-0.4, 0.05], [-0.6, -0.1], [0.2, -0.3], [-0.3, 0], [-0.8, 0.2]],
+        dtype=dtype,
+    )
+    return torch.sin(theta), torch.cos(theta), k
+
+
+@pytest.mark.parametrize("dtype", [torch.float32, torch.float64])
+def test_quartic_matches_companion(dtype):
+    R, Z, k = get_rays(dtype)
+    r, valid = division_radii(R, Z, k, solver="quartic")
+    r_ref, valid_ref = radii_via_companion(R, Z, k)
+    # the companion path flags the principal point as invalid
+    assert valid[:, 0].all() and (r[:, 0] == 0).all()
+    assert torch.equal(valid[:, 1:], valid_ref[:, 1:])
+    atol = 1e-4 if dtype == torch.float32 else 1e-10
+    torch.testing.assert_close(r[valid_ref], r_ref[valid_ref], atol=atol, rtol=0)
+
+
+@pytest.mark.parametrize("solver", ["quadratic", "quartic", "companion"])
+def test_implicit_gradients(solver):
+    R, Z, k = get_rays(torch.float64)
+    R, Z, k = R[:3, 1:20], Z[:3, 1:20], k[:3, :1] if solver == "quadratic" else k[:3]
+    inputs = tuple(t.clone().requires_grad_(True) for t in (R, Z, k))
+    assert torch.autograd.gradcheck(
+        lambda *x: division_radii(*x, solver=solver)[0], inputs
+    )
+
+
+def test_project_num_k2():
+    cam = Division(num_k=2)
+    params = torch.tensor([300.0, 290, 320, 240, -0.1, 0.01], dtype=torch.float64)
+    im_coords = cam.pixel_grid_coords(60, 80, params, 0.5).view(-1, 2) * 8
+    bearings, _ = cam.unproject(params, im_coords)
+    proj, valid = cam.project(params, bearings)
+    proj_ref, valid_ref = Division(num_k=2, root_solver="companion").project(
+        params, bearings
+    )
+    assert valid.all()
+    torch.testing.assert_close(proj, im_coords)
+    torch.testing.assert_close(proj[valid_ref], proj_ref[valid_ref])
@@ -0,0 +1,95 @@
+import pytest
+import torch
+
+pytest.importorskip("omegaconf")  # required by siclib
+
+from siclib.utils import experiments  # noqa: E402
+from siclib.utils.experiments import (  # noqa: E402
+    CheckpointWriter,
+    checksum_path,
+    load_checkpoint,
+    load_last_checkpoint,
+)
+
+
+def checkpoint(epoch):
+    return {"model": {"w": torch.full((3,), float(epoch))}, "epoch": epoch}
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_keep_last_and_best(tmp_path, asynchronous):
+    writer = CheckpointWriter(tmp_path, keep_last=2, asynchronous=asynchronous)
+    for epoch in range(4):
+        writer.save(checkpoint(epoch), f"checkpoint_{epoch}_0.tar", epoch == 1)
+    writer.close()
+    names = sorted(p.name for p in tmp_path.iterdir())
+    expected = ["checkpoint_2_0.tar", "checkpoint_3_0.tar", "checkpoint_best.tar"]
+    assert names == sorted(expected + [f"{n}.sha256" for n in expected])
+    assert load_checkpoint(tmp_path / "checkpoint_best.tar")["epoch"] == 1
+    assert load_checkpoint(tmp_path / "checkpoint_3_0.tar")["epoch"] == 3
+
+
+def test_corrupted_checkpoints(tmp_path):
+    writer = CheckpointWriter(tmp_path, keep_last=5, asynchronous=False)
+    writer.save(checkpoint(0), "checkpoint_0_0.tar")
+    path = tmp_path / "checkpoint_0_0.tar"
+    data = path.read_bytes()
+
+    # truncated file, with its digest
+    path.write_bytes(data[: len(data) // 2])
+    with pytest.raises(RuntimeError, match="Checksum mismatch"):
+        load_checkpoint(path)
+    # truncated file without digest (e.g. saved by an older version)
+    checksum_path(path).unlink()
+    with pytest.raises(RuntimeError, match="Could not load"):
+        load_checkpoint(path)
+    # same size but corrupted content
+    writer.save(checkpoint(0), "checkpoint_0_0.tar")
+    path.write_bytes(data[:-1] + bytes([data[-1] ^ 1]))
+    with pytest.raises(RuntimeError, match="Checksum mismatch"):
+        load_checkpoint(path)
+
+
+def test_load_last_checkpoint_fallback(tmp_path, monkeypatch):
+    monkeypatch.setattr(experiments, "TRAINING_PATH", tmp_path)
+    exper = tmp_path / "exper"
+    exper.mkdir()
+    writer = CheckpointWriter(exper, keep_last=5, asynchronous=False)
+    for epoch in range(3):
+        writer.save(checkpoint(epoch), f"checkpoint_{epoch}_0.tar", epoch == 0)
+    path, ckpt = load_last_checkpoint("exper")
+    assert path.name == "checkpoint_2_0.tar" and ckpt["epoch"] == 2
+
+    # the last checkpoint is corrupted: resume from the previous one
+    (exper / "checkpoint_2_0.tar").write_bytes(b"garbage")
+    path, ckpt = load_last_checkpoint("exper")
+    assert path.name == "checkpoint_1_0.tar" and ckpt["epoch"] == 1
+
+    # all the numbered checkpoints are corrupted: resume from the best one
+    (exper / "checkpoint_1_0.tar").write_bytes(b"garbage")
+    (exper / "checkpoint_0_0.tar").unlink()
+    path, ckpt = load_last_checkpoint("exper")
+    assert path.name == "checkpoint_best.tar" and ckpt["epoch"] == 0
+
+    (exper / "checkpoint_best.tar").unlink()
+    with pytest.raises(FileNotFoundError, match="No valid checkpoint"):
+        load_last_checkpoint("exper")
+
+
+def test_remove_partial_writes(tmp_path):
+    partial = [
+        tmp_path / ".checkpoint_3_0.tar.tmp",
+        tmp_path / ".checkpoint_3_0.tar.sha256.tmp",
+    ]
+    for tmp in partial:
+        tmp.write_bytes(b"partial")
+    writer = CheckpointWriter(tmp_path, keep_last=2, asynchronous=False)
+    # creating a writer does not delete the files of other writers
+    assert all(tmp.exists() for tmp in partial)
+    writer.remove_partial_writes()
+    assert not any(tmp.exists() for tmp in partial)
+
+    # completed writes do not leave temporary files behind
+    writer.save(checkpoint(0), "checkpoint_0_0.tar", copy_to_best=True)
+    assert not list(tmp_path.glob("*.tmp")) and not list(tmp_path.glob(".*.tmp"))
+    assert load_checkpoint(tmp_path / "checkpoint_0_0.tar")["epoch"] == 0
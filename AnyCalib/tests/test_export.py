@@ -0,0 +1,60 @@
+import pytest
+import torch
+
+from anycalib.model.dinov2 import DINOv2
+from anycalib.model.dpt_light_decoder import LightDPTDecoder
+from anycalib.model.export import ExportedAnyCalib, RayFieldNet, export_ray_field
+from anycalib.model.ray_decoder import ConvexTangentDecoder
+
+# traced size and a different one to check that H/W are dynamic
+SIZES = [(112, 140), (154, 98)]
+
+
+def get_net() -> RayFieldNet:
+    torch.manual_seed(0)
+    backbone = DINOv2(model_name="dinov2_vits14")
+    decoder = LightDPTDecoder(embed_dim=backbone.embed_dim)
+    head = ConvexTangentDecoder(in_channels=decoder.out_channels)
+    return RayFieldNet(backbone, decoder, head).eval()
+
+
+def check_parity(net: RayFieldNet, path: str):
+    export_ray_field(net, path, example_size=SIZES[0])
+    runner = ExportedAnyCalib(path)
+    for size in SIZES:
+        im = torch.rand(2, 3, *size)
+        with torch.no_grad():
+            ref = net.head(net.decoder(net.backbone(im)))
+        rays, tangent_coords = runner.ray_field(im)
+        assert rays.shape == ref["rays"].shape
+        assert torch.allclose(rays, ref["rays"], atol=1e-5)
+        assert torch.allclose(tangent_coords, ref["tangent_coords"], atol=1e-5)
+    # exported rays are fed to the calibrator
+    out = runner.predict(torch.rand(3, 150, 200), cam_id="pinhole")
+    assert out["intrinsics"].shape == (4,)
+    # the valid mask is resized like the image
+    mask = torch.zeros(150, 200, dtype=torch.bool)
+    mask[10:-10, 10:-10] = True
+    out = runner.predict(torch.rand(3, 150, 200), cam_id="pinhole", valid_mask=mask)
+    assert out["intrinsics"].shape == (4,)
+    out = ExportedAnyCalib(path, tta=True).predict(
+        torch.rand(3, 150, 200), cam_id="pinhole"
+    )
+    assert out["intrinsics"].shape == (4,) and "log_covs" in out
+
+
+def test_torchscript_parity(tmp_path):
+    check_parity(get_net(), str(tmp_path / "anycalib.pt"))
+
+
+def test_onnx_parity(tmp_path):
+    pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+    check_parity(get_net(), str(tmp_path / "anycalib.onnx"))
+
+
+def test_register_tokens_not_exportable():
+    net = get_net()
+    net.backbone.with_registers = True
+    with pytest.raises(ValueError, match="register tokens"):
+        RayFieldNet(net.backbone, net.decoder, net.head)
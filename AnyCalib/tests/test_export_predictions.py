@@ -0,0 +1,83 @@
+import pytest
+import torch
+
+h5py = pytest.importorskip("h5py")
+pytest.importorskip("tqdm")  # required by siclib.utils.export_predictions
+
+from siclib.utils.export_predictions import (  # noqa: E402
+    H5Writer,
+    batch_to_host,
+    export_predictions,
+)
+
+
+class ToyModel(torch.nn.Module):
+    """Per-sample intrinsics of different sizes (as lists) and batched fields."""
+
+    def forward(self, data):
+        image = data["image"]
+        return {
+            "intrinsics": [torch.arange(4.0 + i) for i in range(len(image))],
+            "rays": image.mean(1),
+            "idx": torch.arange(len(image)),
+        }
+
+
+def test_batch_to_host():
+    pred = ToyModel()({"image": torch.rand(2, 3, 4, 5)})
+    pred["cam_id"] = ["kb:2", "pinhole"]
+    host = batch_to_host(pred, as_half=True)
+    assert host["rays"].dtype == "float16" and host["rays"].shape == (2, 4, 5)
+    assert host["idx"].dtype == "int64"
+    assert [v.shape for v in host["intrinsics"]] == [(4,), (5,)]
+    assert all(v.dtype == "float16" for v in host["intrinsics"])
+    assert host["cam_id"] == ["kb:2", "pinhole"]
+
+
+@pytest.mark.parametrize("queue_size", [0, 2])
+@pytest.mark.parametrize("compression", [None, "lzf"])
+def test_h5_writer(tmp_path, queue_size, compression):
+    path = tmp_path / "preds.h5"
+    preds = [ToyModel()({"image": torch.rand(2, 3, 4, 5)}) for _ in range(3)]
+    names = [[f"{i}a", f"{i}b"] for i in range(3)]
+    with H5Writer(path, compression, queue_size=queue_size) as writer:
+        for names_, pred in zip(names, preds):
+            writer.write(names_, batch_to_host(pred))
+    with h5py.File(path, "r") as hfile:
+        assert len(hfile) == 6
+        for names_, pred in zip(names, preds):
+            for i, name in enumerate(names_):
+                grp = hfile[name]
+                torch.testing.assert_close(
+                    torch.from_numpy(grp["intrinsics"][()]), pred["intrinsics"][i]
+                )
+                torch.testing.assert_close(
+                    torch.from_numpy(grp["rays"][()]), pred["rays"][i]
+                )
+                assert grp["idx"][()] == i
+                assert grp["rays"].compression == compression
+
+    # errors of the writer thread are raised in the main thread
+    with pytest.raises(ValueError, match="Group already exists"):
+        with H5Writer(tmp_path / "dup.h5", queue_size=queue_size) as writer:
+            writer.write(["a"], {"x": [torch.zeros(1).numpy()]})
+            writer.write(["a"], {"x": [torch.zeros(1).numpy()]})
+
+
+def test_export_predictions(tmp_path):
+    loader = [
+        {"image": torch.rand(2, 3, 4, 5), "name": [f"{i}a", f"{i}b"]} for i in range(2)
+    ]
+    path = export_predictions(
+        loader,
+        ToyModel(),
+        tmp_path / "preds.h5",
+        as_half=True,
+        keys=["intrinsics"],
+        verbose=False,
+    )
+    with h5py.File(path, "r") as hfile:
+        assert sorted(hfile) == ["0a", "0b", "1a", "1b"]
+        assert list(hfile["1b"]) == ["intrinsics"]
+        assert hfile["1b"]["intrinsics"].shape == (5,)
+        assert hfile["1b"]["intrinsics"].dtype == "float16"
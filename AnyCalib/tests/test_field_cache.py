@@ -0,0 +1,44 @@
+import torch
+
+from anycalib.model.field_cache import RayFieldCache
+
+
+def test_field_cache(tmp_path):
+    torch.manual_seed(0)
+    cache = RayFieldCache(str(tmp_path), "anycalib_gen")
+    im = torch.rand(1, 3, 30, 40)
+    calls = []
+
+    def compute_fields():
+        calls.append(1)
+        return {"rays": torch.randn(1, 12, 3), "tangent_coords": torch.randn(1, 12, 2)}
+
+    fields = cache.get(im, (3, 4), compute_fields)
+    cached = cache.get(im.clone(), (3, 4), compute_fields)
+    assert len(calls) == 1
+    assert torch.equal(fields["rays"], cached["rays"])
+    assert torch.equal(fields["tangent_coords"], cached["fov_field"])
+
+    # different content, inference size or model -> new entries
+    im2 = im.clone()
+    im2[0, 0, 0, 0] += 1e-3
+    cache.get(im2, (3, 4), compute_fields)
+    cache.get(im, (4, 3), compute_fields)
+    RayFieldCache(str(tmp_path), "anycalib_dist").get(im, (3, 4), compute_fields)
+    assert len(calls) == 4
+
+    # fields computed differently, e.g. fused from test-time augmentations
+    def compute_fused_fields():
+        return compute_fields() | {"log_covs": torch.randn(1, 12, 2)}
+
+    fused = cache.get(im, (3, 4), compute_fused_fields, tag="tta")
+    cached = cache.get(im, (3, 4), compute_fused_fields, tag="tta")
+    assert len(calls) == 5
+    assert torch.equal(fused["log_covs"], cached["log_covs"])
+    assert "log_covs" not in cache.get(im, (3, 4), compute_fields)
+
+    # corrupted entries are recomputed
+    with open(cache.path(cache.hash_image(im), (3, 4)), "wb") as f:
+        f.write(b"corrupted")
+    cache.get(im, (3, 4), compute_fields)
+    assert len(calls) == 6
@@ -0,0 +1,82 @@
+import pytest
+import torch
+
+from anycalib.cameras.factory import CameraFactory
+from anycalib.image_circle import (
+    ImageCircleCache,
+    detect_image_circle,
+    image_circle_mask,
+)
+from anycalib.model.anycalib_pretrained import AnyCalib, Calibrator
+
+
+def fisheye_image(h: int, w: int, circle: tuple[float, float, float]) -> torch.Tensor:
+    torch.manual_seed(0)
+    mask = image_circle_mask(torch.tensor(circle, dtype=torch.float64), (h, w))
+    image = (0.1 + 0.8 * torch.rand(3, h, w)) * mask
+    image[:, h // 3 : h // 3 + 20, w // 2 : w // 2 + 40] = 0  # dark content inside
+    image[:, 2:8, 2:30] = 0.9  # bright overlay outside the circle
+    return image
+
+
+@pytest.mark.parametrize(
+    "h, w, circle",
+    [
+        (480, 640, (330.0, 235.0, 220.0)),
+        (480, 640, (320.0, 240.0, 300.0)),  # circle cropped by the top/bottom borders
+        (1200, 1600, (790.0, 610.0, 570.0)),  # downsampled before detection
+    ],
+)
+def test_detect_image_circle(h, w, circle):
+    detected = detect_image_circle(fisheye_image(h, w, circle))
+    stride = -(-max(h, w) // 512)
+    torch.testing.assert_close(
+        detected, torch.tensor(circle), rtol=0, atol=float(1.5 * stride)
+    )
+
+
+def test_no_image_circle():
+    torch.manual_seed(0)
+    assert detect_image_circle(0.1 + 0.8 * torch.rand(3, 120, 160)) is None
+    # circle larger than the image: no dark corners
+    image = fisheye_image(120, 160, (80.0, 60.0, 110.0))
+    image[:, :10, :40] = 0.5
+    assert detect_image_circle(image) is None
+
+
+def test_image_circle_cache(tmp_path):
+    path = str(tmp_path / "circles.json")
+    image = fisheye_image(240, 320, (160.0, 120.0, 110.0))
+    circle = ImageCircleCache(path).get("lens_1", image)
+    # reloaded from disk without detecting again
+    cache = ImageCircleCache(path)
+    assert torch.equal(cache.get("lens_1", torch.zeros(3, 240, 320)), circle)
+    # different image size -> detected again
+    assert cache.get("lens_1", torch.zeros(3, 120, 160)) is None
+
+
+def test_calibrator_ignores_pixels_outside_mask():
+    h, w = 60, 80
+    params = torch.tensor([30.0, 30.0, 40.0, 30.0, 0.05, -0.01], dtype=torch.float64)
+    cam = CameraFactory.create_from_id("kb:2")
+    im_coords = cam.pixel_grid_coords(h, w, params, 0.5).view(h * w, 2)
+    rays, _ = cam.unproject(params, im_coords)
+    valid = image_circle_mask(params.new_tensor((40.0, 30.0, 28.0)), (h, w))
+    # garbage rays outside the image circle
+    torch.manual_seed(0)
+    garbage = torch.nn.functional.normalize(torch.randn_like(rays), dim=-1)
+    rays = torch.where(valid.view(-1, 1), rays, garbage)
+    fields = {"rays": rays[None], "tangent_coords": None}
+    data = {"image": torch.zeros(1, 3, h, w), "cam_id": ["kb:2"]}
+    out = Calibrator()(fields, data | {"valid_mask": valid[None]})
+    torch.testing.assert_close(out["intrinsics"][0], params)
+    out = Calibrator()(fields, data)
+    assert not torch.allclose(out["intrinsics"][0], params, rtol=1e-2)
+
+
+def test_resize_mask():
+    mask = image_circle_mask(torch.tensor((320.0, 240.0, 200.0)), (480, 640))
+    resized = AnyCalib.resize_mask(mask, (240, 320))
+    expected = image_circle_mask(torch.tensor((160.0, 120.0, 100.0)), (240, 320))
+    assert resized.shape == (1, 240, 320)
+    assert (resized[0] != expected).float().mean() < 0.005
@@ -0,0 +1,75 @@
+import torch
+from torch import Tensor
+
+from anycalib.cameras.factory import CameraFactory
+from anycalib.manifolds import Unit3
+from anycalib.model.anycalib_pretrained import Calibrator
+from anycalib.model.model_selection import information_criterion, sweep_camera_models
+
+
+def get_fields(cam_id: str, params: Tensor, h: int, w: int, noise: float = 1e-4):
+    torch.manual_seed(0)
+    cam = CameraFactory.create_from_id(cam_id)
+    im_coords = cam.pixel_grid_coords(h, w, params, 0.5).view(h * w, 2)
+    rays, _ = cam.unproject(params, im_coords)
+    tcoords = Unit3.logmap_at_z1(rays) + noise * torch.randn(h * w, 2, dtype=rays.dtype)
+    rays = Unit3.expmap_at_z1(tcoords)
+    return {"rays": rays[None], "tangent_coords": tcoords[None]}
+
+
+def test_information_criterion():
+    # same cost -> fewer parameters are preferred
+    assert information_criterion(1e-3, 5, 1000) < information_criterion(1e-3, 6, 1000)
+    assert information_criterion(1e-3, 5, 1000, "aic") < information_criterion(
+        1e-3, 6, 1000, "aic"
+    )
+    assert information_criterion(float("nan"), 5, 1000) == float("inf")
+
+
+def test_sweep_selects_generating_model():
+    h, w = 60, 80
+    params = torch.tensor([40.0, 40.0, 40.0, 30.0, 0.05, -0.01], dtype=torch.float64)
+    fields = get_fields("kb:2", params, h, w)
+    image = torch.zeros(1, 3, h, w, dtype=torch.float64)
+    cam_ids = ["pinhole", "kb:1", "kb:2", "kb:3", "eucm"]
+    ranking = sweep_camera_models(Calibrator(), fields, image, cam_ids)
+    assert [fit["cam_id"] for fit in ranking][0] == "kb:2"
+    assert torch.allclose(ranking[0]["intrinsics"], params, rtol=1e-2, atol=1e-2)
+    # sequential and threaded sweeps agree
+    ranking_seq = sweep_camera_models(
+        Calibrator(), fields, image, cam_ids, num_workers=1
+    )
+    assert [f["cam_id"] for f in ranking] == [f["cam_id"] for f in ranking_seq]
+    assert all(f["cost"] == g["cost"] for f, g in zip(ranking, ranking_seq))
+
+
+def test_sweep_ranks_robust_fits_with_l2_cost():
+    h, w = 60, 80
+    params = torch.tensor([40.0, 40.0, 40.0, 30.0, 0.05, -0.01], dtype=torch.float64)
+    fields = get_fields("kb:2", params, h, w)
+    image = torch.zeros(1, 3, h, w, dtype=torch.float64)
+    cam_ids = ["pinhole", "kb:1", "kb:2", "kb:3"]
+    calib = Calibrator(nonlin_opt_conf={"loss": "cauchy", "loss_scale": 1e-4})
+    ranking = sweep_camera_models(calib, fields, image, cam_ids, num_workers=1)
+    assert ranking[0]["cam_id"] == "kb:2"
+    # the robust cost differs from the l2 cost used by the criterion
+    fit = ranking[0]
+    assert fit["cost"] != fit["l2_cost"]
+    ranking_l2 = sweep_camera_models(Calibrator(), fields, image, ["kb:2"])
+    assert abs(fit["l2_cost"] - ranking_l2[0]["l2_cost"]) < 1e-2 * fit["l2_cost"]
+
+
+def test_l2_cost_only_on_request(monkeypatch):
+    h, w = 60, 80
+    params = torch.tensor([40.0, 40.0, 40.0, 30.0, 0.05, -0.01], dtype=torch.float64)
+    fields = get_fields("kb:2", params, h, w)
+    data = {"image": torch.zeros(1, 3, h, w), "cam_id": ["kb:2"]}
+    calib = Calibrator(nonlin_opt_conf={"loss": "cauchy", "loss_scale": 1e-4})
+    n_calls = []
+    l2_cost = calib.optimizer.l2_cost
+    monkeypatch.setattr(
+        calib.optimizer, "l2_cost", lambda *args: n_calls.append(1) or l2_cost(*args)
+    )
+    assert "l2_cost" not in calib(fields, data) and not n_calls
+    out = calib(fields, data, return_l2_cost=True)
+    assert out["l2_cost"].shape == (1,) and len(n_calls) == 1
@@ -0,0 +1,113 @@
+import pytest
+import torch
+
+from anycalib.cameras import KannalaBrandt
+from anycalib.manifolds import Unit3
+from anycalib.optim import GaussNewtonCalib, LevMarCalib
+
+
+def get_problem(res_tangent: str):
+    torch.manual_seed(0)
+    cam = KannalaBrandt(num_k=2)
+    params = torch.tensor([[300.0, 310, 320, 240, 0.05, -0.01]], dtype=torch.float64)
+    im_coords = cam.pixel_grid_coords(48, 64, params, 0.5).view(1, -1, 2) * 10
+    bearings, _ = cam.unproject(params, im_coords)
+    bearings = torch.nn.functional.normalize(
+        bearings + 1e-3 * torch.randn_like(bearings), dim=-1
+    )
+    if res_tangent == "z1":
+        bearings = Unit3.logmap_at_z1(bearings)
+    params0 = params * torch.tensor([1.05, 0.95, 1.01, 0.99, 0.5, 0.5]).to(params)
+    weights = torch.rand(1, im_coords.shape[-2], 2, dtype=torch.float64) + 0.5
+    return cam, params0, im_coords, bearings, weights
+
+
+@pytest.mark.parametrize("optim_cls", [GaussNewtonCalib, LevMarCalib])
+@pytest.mark.parametrize("res_tangent", ["fitted", "z1"])
+@pytest.mark.parametrize("num_threads", [1, 3])
+def test_chunked_matches_dense(optim_cls, res_tangent, num_threads):
+    cam, params0, im_coords, obs, weights = get_problem(res_tangent)
+    dense = optim_cls({"res_tangent": res_tangent})
+    chunked = optim_cls(
+        {"res_tangent": res_tangent, "chunk_size": 500, "num_threads": num_threads}
+    )
+    for kwargs in ({}, {"weights": weights, "fix_cxcy": True}):
+        out = dense(cam, params0, im_coords, obs, **kwargs)
+        out_chunked = chunked(cam, params0, im_coords, obs, **kwargs)
+        for x, y in zip(out, out_chunked):
+            torch.testing.assert_close(x, y)
+
+
+def test_chunked_rejects_qr():
+    with pytest.raises(ValueError):
+        GaussNewtonCalib({"solver": "qr", "chunk_size": 1024})
+
+
+@pytest.mark.parametrize("optim_cls", [GaussNewtonCalib, LevMarCalib])
+@pytest.mark.parametrize("chunk_size", [0, 500])
+def test_early_stopping(optim_cls, chunk_size):
+    cam, params0, im_coords, obs, weights = get_problem("fitted")
+    conf = {"max_iters": 20, "chunk_size": chunk_size}
+    full = optim_cls(conf)
+    early = optim_cls(conf | {"cost_rtol": 1e-6, "step_tol": 1e-8, "grad_tol": 1e-12})
+    params, _, cost, _, log = full(cam, params0, im_coords, obs, return_log=True)
+    params_es, _, cost_es, _, log_es = early(
+        cam, params0, im_coords, obs, return_log=True
+    )
+    assert log["n_iters"].item() == 20 and not log["converged"].any()
+    assert log_es["converged"].all() and log_es["n_iters"].item() < 10
+    torch.testing.assert_close(params_es, params, rtol=1e-5, atol=1e-6)
+    torch.testing.assert_close(cost_es, cost, rtol=1e-3, atol=0)
+    t = log_es["step_norm"].shape[0]
+    assert log_es["cost"].shape == (t + 1, 1) and log_es["grad_norm"].shape == (t, 1)
+    assert (log_es["cost"][-1] == cost_es).all()
+    if optim_cls is LevMarCalib:
+        assert log_es["damping"].shape == (t, 1)
+
+
+def test_early_stopping_masks_converged_elements():
+    cam, params0, im_coords, obs, _ = get_problem("z1")
+    conf = {"max_iters": 20, "res_tangent": "z1"}
+    # second element starts at the solution of the first one
+    params_opt = GaussNewtonCalib(conf)(cam, params0, im_coords, obs)[0]
+    params0 = torch.cat((params0, params_opt))
+    im_coords, obs = im_coords.repeat(2, 1, 1), obs.repeat(2, 1, 1)
+    optim = GaussNewtonCalib(conf | {"cost_rtol": 1e-6})
+    params, cost0, cost, _, log = optim(cam, params0, im_coords, obs, return_log=True)
+    assert log["converged"].all()
+    assert log["n_iters"][1] == 1 and log["n_iters"][0] > 1
+    assert (log["step_norm"][1:, 1] == 0).all()
+    torch.testing.assert_close(params[0], params[1])
+
+
+@pytest.mark.parametrize("optim_cls", [GaussNewtonCalib, LevMarCalib])
+@pytest.mark.parametrize("loss", ["huber", "cauchy", "tukey"])
+def test_robust_loss_rejects_outliers(optim_cls, loss):
+    cam, params0, im_coords, obs, _ = get_problem("fitted")
+    params_gt = params0 / torch.tensor([1.05, 0.95, 1.01, 0.99, 0.5, 0.5]).to(params0)
+    # replace 10% of the bearings by random directions
+    outliers = torch.rand(obs.shape[:-1]) < 0.1
+    random = torch.nn.functional.normalize(torch.randn_like(obs), dim=-1)
+    obs = torch.where(outliers[..., None], random * random[..., 2:].sign(), obs)
+    conf = {"max_iters": 20}
+    params_l2 = optim_cls(conf)(cam, params0, im_coords, obs)[0]
+    robust = optim_cls(conf | {"loss": loss, "loss_scale": 0.01})
+    params, cost0, cost, _ = robust(cam, params0, im_coords, obs)
+    assert cost < cost0
+    err_l2 = ((params_l2 - params_gt) / params_gt).abs()[..., :4].max()
+    err = ((params - params_gt) / params_gt).abs()[..., :4].max()
+    assert err < 1e-3 < err_l2
+    # chunked accumulation uses the same IRLS weights
+    chunked = optim_cls(conf | {"loss": loss, "loss_scale": 0.01, "chunk_size": 500})
+    torch.testing.assert_close(chunked(cam, params0, im_coords, obs)[0], params)
+
+
+def test_huber_without_outliers_matches_l2():
+    cam, params0, im_coords, obs, weights = get_problem("fitted")
+    out = GaussNewtonCalib()(cam, params0, im_coords, obs, weights)
+    huber = GaussNewtonCalib({"loss": "huber", "loss_scale": 1e3})
+    out_huber = huber(cam, params0, im_coords, obs, weights)
+    for x, y in zip(out, out_huber):
+        torch.testing.assert_close(x, y, rtol=0, atol=0)
+    with pytest.raises(ValueError):
+        GaussNewtonCalib({"loss": "l1"})
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+import torch
+
+from anycalib.cameras import KannalaBrandt
+from anycalib.panorama import (
+    PanoramaStitcher,
+    load_rig,
+    pano_rays,
+    rotation_from_ypr,
+)
+
+H, W = 150, 200
+PARAMS = torch.tensor([60.0, 60, 100, 75, 0.01, 0, 0, 0], dtype=torch.float64)
+
+
+def color(rays: torch.Tensor) -> torch.Tensor:
+    """Synthetic environment: color as a function of the ray direction."""
+    return 127 + 120 * rays
+
+
+def get_rig() -> tuple[list[torch.Tensor], list[torch.Tensor]]:
+    cam = KannalaBrandt()
+    rotations = [rotation_from_ypr(60 * i, 0, 0) for i in range(6)]
+    rays, _ = cam.ray_grid(H, W, PARAMS)
+    images = [color(rays @ R.T).round().to(torch.uint8) for R in rotations]
+    return rotations, images
+
+
+@pytest.mark.parametrize(
+    "projection, out_size", [("equirect", (100, 200)), ("cubemap", (50, 300))]
+)
+def test_render_synthetic_rig(projection, out_size, tmp_path):
+    rotations, images = get_rig()
+    stitcher = PanoramaStitcher(
+        [KannalaBrandt()] * 6, [PARAMS] * 6, rotations, [(H, W)] * 6, cache_dir=tmp_path
+    )
+    pano = stitcher.render(images, projection, out_size)
+    assert pano.shape == (*out_size, 3) and pano.dtype == torch.uint8
+    expected = color(pano_rays(projection, out_size)).view(*out_size, 3)
+    covered = pano.sum(-1) > 0
+    # the horizontal ring covers the equator (of the lateral faces) of the panorama
+    n_lateral = 4 * out_size[0] if projection == "cubemap" else out_size[1]
+    assert covered[out_size[0] // 2, :n_lateral].all()
+    assert (pano.double() - expected)[covered].abs().max() < 2
+
+    # maps are reused from disk by a new stitcher
+    assert len(list(tmp_path.iterdir())) == 1
+    stitcher = PanoramaStitcher(
+        [KannalaBrandt()] * 6, [PARAMS] * 6, rotations, [(H, W)] * 6, cache_dir=tmp_path
+    )
+    stitcher.build_maps = None  # must not be called
+    assert torch.equal(stitcher.render(images, projection, out_size), pano)
+
+
+def test_load_rig(tmp_path):
+    R = rotation_from_ypr(10, 20, 30)
+    path = tmp_path / "rig.json"
+    lenses = {"a.jpg": {"ypr_deg": [10, 20, 30]}, "b.jpg": {"R": R.tolist()}}
+    path.write_text(json.dumps({"lenses": lenses}))
+    rig = load_rig(str(path))
+    torch.testing.assert_close(rig["a.jpg"], R)
+    torch.testing.assert_close(rig["b.jpg"], R)
+    # yaw to the right and pitch up
+    z = torch.tensor([0, 0, 1.0], dtype=torch.float64)
+    torch.testing.assert_close(rotation_from_ypr(90, 0, 0) @ z, z.new_tensor([1, 0, 0]))
+    torch.testing.assert_close(
+        rotation_from_ypr(0, 90, 0) @ z, z.new_tensor([0, -1, 0])
+    )
@@ -0,0 +1,107 @@
+import pytest
+import torch
+
+from anycalib.cameras import (
+    CameraFactory,
+    Division,
+    KannalaBrandt,
+    Radial,
+    SimpleKannalaBrandt,
+    radial_lut,
+)
+from anycalib.model.anycalib_pretrained import get_cam_list
+
+CAMS = {
+    "kb": (
+        KannalaBrandt,
+        {"num_k": 4},
+        [300.0, 290, 320, 240, -0.04, -0.005, -5e-4, -9e-5],
+    ),
+    "simple_kb": (SimpleKannalaBrandt, {"num_k": 2}, [300.0, 320, 240, 0.02, -0.01]),
+    "radial": (Radial, {"num_k": 2}, [500.0, 490, 320, 240, -0.2, 0.05]),
+    "division": (Division, {"num_k": 2}, [300.0, 290, 320, 240, -0.1, 0.01]),
+}
+
+
+def get_data(name: str, dtype: torch.dtype):
+    cam_cls, kwargs, params = CAMS[name]
+    exact, lut = cam_cls(**kwargs), cam_cls(**kwargs, lut_size=1024)
+    params = torch.tensor(params, dtype=dtype)
+    im_coords = exact.pixel_grid_coords(120, 160, params, 0.5).view(-1, 2) * 4
+    return exact, lut, params, im_coords
+
+
+@pytest.mark.parametrize("name", list(CAMS))
+@pytest.mark.parametrize("dtype", [torch.float32, torch.float64])
+def test_lut_matches_exact(name, dtype):
+    exact, lut, params, im_coords = get_data(name, dtype)
+    bearings, valid = exact.unproject(params, im_coords)
+    bearings_lut, valid_lut = lut.unproject(params, im_coords)
+    valid = (
+        torch.ones_like(im_coords[..., 0], dtype=torch.bool) if valid is None else valid
+    )
+    valid_lut = valid if valid_lut is None else valid_lut
+    assert torch.equal(valid, valid_lut)
+    atol = 1e-4 if dtype == torch.float32 else 1e-7
+    torch.testing.assert_close(bearings_lut[valid], bearings[valid], atol=atol, rtol=0)
+
+    proj, valid = exact.project(params, bearings)
+    proj_lut, valid_lut = lut.project(params, bearings)
+    if valid is not None:
+        assert torch.equal(valid, valid_lut)
+    atol = 1e-2 if dtype == torch.float32 else 1e-5  # pixels
+    torch.testing.assert_close(proj_lut, proj, atol=atol, rtol=0)
+
+
+@pytest.mark.parametrize("name", list(CAMS))
+def test_lut_batched_params(name):
+    """One table per set of intrinsics, e.g. when scoring RANSAC hypotheses."""
+    exact, lut, params, im_coords = get_data(name, torch.float64)
+    params = params * torch.linspace(0.9, 1.1, 5, dtype=params.dtype)[:, None]
+    bearings, _ = exact.unproject(params, im_coords[None])
+    bearings_lut, _ = lut.unproject(params, im_coords[None])
+    assert bearings_lut.shape == (5, len(im_coords), 3)
+    torch.testing.assert_close(bearings_lut, bearings, atol=1e-5, rtol=0)
+
+
+def test_lut_fallback_and_gradients():
+    exact, lut, params, _ = get_data("division", torch.float64)
+    # rays behind the camera are beyond the table and solved exactly
+    rays = torch.tensor([[0.1, 0.0, 0.995], [0.6, 0.0, 0.8], [0.99, 0.0, -0.141]])
+    rays = torch.nn.functional.normalize(rays.to(params), dim=-1)
+    proj, valid = exact.project(params, rays)
+    proj_lut, valid_lut = lut.project(params, rays)
+    assert torch.equal(valid, valid_lut)
+    torch.testing.assert_close(proj_lut[valid], proj[valid])
+    # the exact (differentiable) solver is used when gradients are needed
+    params.requires_grad_(True)
+    lut.project(params, rays)[0].sum().backward()
+    assert params.grad is not None
+
+
+def test_lut_size_from_factory():
+    assert CameraFactory.create_from_id("kb:4", lut_size=512).lut_size == 512
+    assert CameraFactory.create_from_id("radial:2").lut_size == 0
+    # ignored by models with closed-form (un)projections
+    assert not hasattr(CameraFactory.create_from_id("pinhole", 512), "lut_size")
+    cams = get_cam_list({"cam_id": ["division:2", "simple_kb:1"]}, lut_size=256)
+    assert [cam.lut_size for cam in cams] == [256, 256]
+
+
+def test_lut_cache():
+    radial_lut._lut_cache.clear()
+    _, lut, params, im_coords = get_data("kb", torch.float64)
+    bearings, _ = lut.unproject(params, im_coords)
+    assert len(radial_lut._lut_cache) == 1
+    table = next(iter(radial_lut._lut_cache.values()))
+    # same intrinsics -> same table
+    torch.testing.assert_close(lut.unproject(params.clone(), im_coords)[0], bearings)
+    assert len(radial_lut._lut_cache) == 1
+    assert next(iter(radial_lut._lut_cache.values())) is table
+    # new intrinsics -> new table
+    lut.unproject(params * 1.01, im_coords)
+    assert len(radial_lut._lut_cache) == 2
+    # many sets of intrinsics (e.g. RANSAC hypotheses) are not cached
+    params = params * torch.linspace(0.9, 1.1, 20, dtype=params.dtype)[:, None]
+    lut.unproject(params, im_coords[None])
+    assert len(radial_lut._lut_cache) == 2
@@ -0,0 +1,102 @@
+import pytest
+import torch
+
+from anycalib.cameras.factory import CameraFactory
+from anycalib.manifolds import Unit3
+from anycalib.model.anycalib_pretrained import Calibrator
+from anycalib.ransac import RANSAC
+
+PARAMS = {
+    "pinhole": [600.0, 550, 320, 240],
+    "kb:2": [400.0, 380, 320, 240, -0.04, -0.005],
+    "division:2": [400.0, 380, 320, 240, -0.1, 0.01],
+}
+
+
+def get_correspondences(cam_id: str, outlier_ratio: float = 0.3):
+    """Correspondences of a 640x480 image with a fraction of random outliers."""
+    torch.manual_seed(0)
+    cam = CameraFactory.create_from_id(cam_id)
+    params = torch.tensor(PARAMS[cam_id], dtype=torch.float64)
+    im_coords = cam.pixel_grid_coords(48, 64, params, 0.5).view(-1, 2) * 10
+    bearings, _ = cam.unproject(params, im_coords)
+    n_out = int(outlier_ratio * len(bearings))
+    outliers = torch.randn(n_out, 3, dtype=torch.float64)
+    outliers[:, 2] = outliers[:, 2].abs() + 0.5
+    bearings[:n_out] = outliers / outliers.norm(dim=-1, keepdim=True)
+    return cam, params, im_coords, bearings
+
+
+@pytest.mark.parametrize("cam_id", list(PARAMS))
+def test_adaptive_ransac(cam_id):
+    cam, params, im_coords, bearings = get_correspondences(cam_id)
+    ransac = RANSAC({"adaptive": True})
+    params_hat, inliers, info = ransac(cam, im_coords, bearings, return_info=True)
+    assert torch.allclose(params_hat, params, rtol=1e-3, atol=1e-3)
+    assert inliers.float().mean() >= 0.69
+    # early termination and pre-verification
+    assert info["n_hypotheses"] < ransac.cfg["n_samples"]
+    assert info["n_scored"] <= info["n_hypotheses"]
+    assert info["time"] > 0
+    # the result does not depend on the number of threads
+    params_seq, inliers_seq = RANSAC({"adaptive": True, "num_threads": 1})(
+        cam, im_coords, bearings
+    )
+    assert torch.equal(params_hat, params_seq)
+    assert torch.equal(inliers, inliers_seq)
+
+
+def test_adaptive_ransac_batched():
+    cam, params, im_coords, bearings = get_correspondences("kb:2")
+    ransac = RANSAC({"adaptive": True})
+    params_hat, inliers = ransac(
+        cam, im_coords.expand(2, -1, -1), bearings.expand(2, -1, -1)
+    )
+    assert params_hat.shape == (2, len(params))
+    assert inliers.shape == (2, len(bearings))
+    assert torch.allclose(params_hat, params.expand(2, -1), rtol=1e-3, atol=1e-3)
+    # more correspondences than `max_correspondences`: one subset for the batch
+    ransac = RANSAC({"adaptive": True, "max_correspondences": 1000})
+    params_hat, inliers = ransac(
+        cam, im_coords.expand(2, -1, -1), bearings.expand(2, -1, -1)
+    )
+    assert params_hat.shape == (2, len(params))
+    assert inliers.shape == (2, 1000)
+    assert torch.allclose(params_hat, params.expand(2, -1), rtol=1e-3, atol=1e-3)
+
+
+def test_adaptive_ransac_all_rejected():
+    cam, _, im_coords, bearings = get_correspondences("kb:2")
+    # no hypothesis passes the T(d,d) test -> same result as the fixed variant
+    cfg = {"th_reproj_error": 1e-30, "n_preverify": 4}
+    params_hat, inliers = RANSAC(cfg | {"adaptive": True})(cam, im_coords, bearings)
+    params_fixed, inliers_fixed = RANSAC(cfg)(cam, im_coords, bearings)
+    assert params_hat.isfinite().all()
+    assert torch.equal(params_hat, params_fixed)
+    assert torch.equal(inliers, inliers_fixed)
+
+
+def test_required_hypotheses():
+    log_failure = torch.tensor(1 - 0.99).log().item()
+    assert RANSAC.required_hypotheses(1.0, 4, log_failure) == 0
+    assert RANSAC.required_hypotheses(0.0, 4, log_failure) == float("inf")
+    # classic value: w=0.5, s=4, p=0.99 -> 72 hypotheses
+    assert RANSAC.required_hypotheses(0.5, 4, log_failure) == 72
+
+
+@pytest.mark.parametrize("init_with_sac", [True, False])
+def test_calibrator_sac_with_known_cxcy(init_with_sac, monkeypatch):
+    """RANSAC uses the known principal point both for the initialization and as the
+    fallback of the linear fit."""
+    cam = CameraFactory.create_from_id("kb:2")
+    params = torch.tensor(PARAMS["kb:2"]) / 10
+    im_coords = cam.pixel_grid_coords(48, 64, params, 0.5).view(-1, 2)
+    rays, _ = cam.unproject(params, im_coords)
+    fields = {"rays": rays[None], "tangent_coords": Unit3.logmap_at_z1(rays)[None]}
+    cxcy = params[None, 2:4] + 0.5  # known (and slightly off) principal point
+    data = {"image": torch.zeros(1, 3, 48, 64), "cam_id": ["kb:2"], "cxcy": cxcy}
+    if not init_with_sac:  # make the linear fit fail
+        failed_fit = (torch.zeros(len(params)), torch.tensor(1))
+        monkeypatch.setattr(type(cam), "fit", lambda *args: failed_fit)
+    out = Calibrator(init_with_sac=init_with_sac, fallback_to_sac=True)(fields, data)
+    torch.testing.assert_close(out["intrinsics"][0][2:4], cxcy[0])
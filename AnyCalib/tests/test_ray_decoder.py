@@ -0,0 +1,39 @@
+import pytest
+import torch
+
+from anycalib.model.ray_decoder import (
+    ConvexTangentDecoder,
+    cvx_upsample,
+    cvx_upsample_tiled,
+)
+
+
+@pytest.mark.parametrize("shape", [(1, 2, 5, 7), (2, 2, 23, 17), (1, 3, 46, 46)])
+def test_tiled_upsampling(shape):
+    torch.manual_seed(0)
+    n, c, h, w = shape
+    x = torch.randn(n, c, h, w)
+    mask = torch.randn(n, 9 * 49, h, w).view(n, 1, 9, 7, 7, h, w).softmax(dim=2)
+    ref = cvx_upsample(x, mask)
+    assert ref.shape == (n, c, 7 * h, 7 * w)
+    tiled = cvx_upsample_tiled(x, mask, 7, 1)
+    assert torch.allclose(ref, tiled, rtol=0, atol=1e-6)
+    # independent of the size of the bands, also with banded masks
+    for band_rows in (4, 8, 100):
+        assert torch.equal(tiled, cvx_upsample_tiled(x, mask, 7, band_rows))
+    mask_fn = lambda r0, r1: mask[..., r0:r1, :]  # noqa: E731
+    assert torch.equal(tiled, cvx_upsample_tiled(x, mask_fn, 7, 3))
+
+
+def test_tiled_decoder():
+    torch.manual_seed(0)
+    decoder = ConvexTangentDecoder(in_channels=32).eval()
+    tiled = ConvexTangentDecoder(in_channels=32, tile_rows=3).eval()
+    tiled.load_state_dict(decoder.state_dict())
+    x = torch.randn(2, 32, 4 * 11, 4 * 9)
+    with torch.no_grad():
+        out, out_tiled = decoder(x), tiled(x)
+    assert torch.allclose(out["rays"], out_tiled["rays"], rtol=0, atol=1e-6)
+    assert torch.allclose(
+        out["tangent_coords"], out_tiled["tangent_coords"], rtol=0, atol=1e-6
+    )
@@ -0,0 +1,96 @@
+from types import SimpleNamespace
+
+import torch
+
+from anycalib.cameras import KannalaBrandt
+from anycalib.manifolds import Unit3
+from anycalib.model.anycalib_pretrained import AnyCalib, Calibrator
+from anycalib.model.ray_decoder import fuse_tangent_fields
+
+H, W = 42, 56
+
+
+def centered_field() -> torch.Tensor:
+    """(H*W, 2) tangent field of a camera with the principal point at the center."""
+    cam = KannalaBrandt(num_k=2)
+    params = torch.tensor([30.0, 32.0, W / 2, H / 2, 0.05, -0.01])
+    im_coords = cam.pixel_grid_coords(H, W, params, 0.5).view(H * W, 2)
+    rays, _ = cam.unproject(params, im_coords)
+    return Unit3.logmap_at_z1(rays)
+
+
+def stub_model(corruption: str | None = None) -> SimpleNamespace:
+    """Stand-in for the network, ignoring the image content and, optionally, adding
+    noise to the top-left corner or a constant bias to the top rows of every image of
+    the batch."""
+    tcoords = centered_field()
+
+    def compute_fields(image: torch.Tensor) -> dict[str, torch.Tensor]:
+        t = tcoords.expand(image.shape[0], -1, -1).clone()
+        t = t.view(-1, H, W, 2)
+        if corruption == "noise":
+            torch.manual_seed(0)
+            t[:, :10, :14] += 0.05 * torch.randn_like(t[:, :10, :14])
+        elif corruption == "bias":
+            t[:, :10] += 0.02
+        t = t.view(-1, H * W, 2)
+        return {"rays": Unit3.expmap_at_z1(t), "tangent_coords": t}
+
+    return SimpleNamespace(compute_fields=compute_fields)
+
+
+def test_tta_undoes_flips():
+    fields = AnyCalib.compute_fields_tta(stub_model(), torch.rand(2, 3, H, W))
+    tcoords = centered_field().expand(2, -1, -1)
+    torch.testing.assert_close(fields["tangent_coords"], tcoords)
+    torch.testing.assert_close(fields["rays"], Unit3.expmap_at_z1(tcoords))
+    assert fields["log_covs"].shape == (2, H * W, 2)
+
+
+def test_tta_fusion_downweights_noise():
+    model = stub_model("noise")
+    single = model.compute_fields(torch.rand(1, 3, H, W))
+    fused = AnyCalib.compute_fields_tta(model, torch.rand(1, 3, H, W))
+    tcoords = centered_field()
+    corner = torch.zeros(H, W, dtype=torch.bool)
+    corner[:10, :14] = True
+    corner = corner.view(-1)
+    err = (single["tangent_coords"][0, corner] - tcoords[corner]).norm(dim=-1)
+    err_fused = (fused["tangent_coords"][0, corner] - tcoords[corner]).norm(dim=-1)
+    assert err_fused.mean() < 0.2 * err.mean()
+
+    # the fused variance weights the calibration
+    data = {"image": torch.zeros(1, 3, H, W), "cam_id": ["kb:2"]}
+    calib = Calibrator(lin_with_covs=True, nonlin_opt_w_covs=True)
+    out = calib(fused, data)
+    assert out["success"].all()
+    torch.testing.assert_close(
+        out["intrinsics"][0][:4],
+        torch.tensor([30.0, 32.0, W / 2, H / 2]),
+        rtol=5e-3,
+        atol=0,
+    )
+
+
+def test_tta_variance_of_disagreeing_views():
+    # smooth errors cannot be detected from the spread of a single field, but the
+    # un-flipped views disagree on them
+    fused = AnyCalib.compute_fields_tta(stub_model("bias"), torch.rand(1, 3, H, W))
+    log_covs = fused["log_covs"][0].mean(-1).view(H, W)
+    assert log_covs[1:5].max() < log_covs[1:5].min() + 1
+    # away from the bias boundaries, which the local fits (7x7 windows) smooth over
+    assert log_covs[1:5].min() > log_covs[16:-16].max() + 4
+
+
+def test_fusion_of_distorted_fields():
+    """Noise-free views of a strongly distorted camera are fused with a uniform
+    variance, i.e. the curvature of the projection is not mistaken for noise."""
+    h = w = 322
+    cam = KannalaBrandt(num_k=2)
+    params = torch.tensor([100.0, 100, 161, 161, 0.02, -0.005], dtype=torch.float64)
+    im_coords = cam.pixel_grid_coords(h, w, params, 0.5).view(h * w, 2)
+    rays, _ = cam.unproject(params, im_coords)
+    tcoords = Unit3.logmap_at_z1(rays).view(1, h, w, 2).permute(0, 3, 1, 2)
+    fused, log_covs = fuse_tangent_fields(tcoords.expand(3, -1, -1, -1, -1), 1e-5)
+    torch.testing.assert_close(fused, tcoords)
+    assert log_covs.max() - log_covs.min() < 0.1
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+import torch
+
+from anycalib.cameras import KannalaBrandt
+from anycalib.undistorter import Undistorter
+
+H, W = 120, 160
+PARAMS = torch.tensor([80.0, 82, 80, 60, 0.05, -0.01, 0.0, 0.0])
+
+
+def get_frames(n: int = 3) -> torch.Tensor:
+    y, x = torch.meshgrid(torch.arange(H), torch.arange(W), indexing="ij")
+    frames = [
+        torch.stack(
+            (100 + 80 * torch.sin(x / (5.0 + i)), 255 * x / W, 255 * y / H), dim=-1
+        )
+        for i in range(n)
+    ]
+    return torch.stack(frames).round().to(torch.uint8)
+
+
+@pytest.mark.parametrize("grid_format", ["fixed", "float32"])
+def test_matches_undistort_image(grid_format):
+    cam = KannalaBrandt()
+    frames = get_frames()
+    ref = cam.undistort_image(
+        frames.permute(0, 3, 1, 2).float(),
+        PARAMS.expand(len(frames), -1),
+        scale=0.8,
+        outside_value=0.0,
+    )
+    ref = ref.round().clamp(0, 255).permute(0, 2, 3, 1)
+    undistorter = Undistorter(cam, PARAMS, (H, W), scale=0.8, grid_format=grid_format)
+    out = undistorter(frames)
+    assert out.dtype == torch.uint8 and out.shape == frames.shape
+    diff = (out.float() - ref).abs()
+    assert diff.max() <= (1 if grid_format == "fixed" else 0)
+    if grid_format == "fixed":
+        assert undistorter.nbytes() == 6 * H * W
+
+
+def test_stream():
+    undistorter = Undistorter(KannalaBrandt(), PARAMS, (H, W), out_size=(60, 100))
+    frames = get_frames(5)
+    expected = undistorter(frames)
+    assert expected.shape == (5, 60, 100, 3)
+    outs = list(undistorter.stream((f.numpy() for f in frames), batch_size=2))
+    assert len(outs) == 5 and all(isinstance(o, np.ndarray) for o in outs)
+    np.testing.assert_array_equal(np.stack(outs), expected.numpy())